@@ -0,0 +1,231 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .authentication import AsyncTokenAuthentication
+from .decorators import catalog_cache
+from .indexes import ingredient_index
+from .pagination import AsyncPageNumberPagination
+from .serializers import SubscriptionsSerializer
+from .views import (
+    CustomUserViewSet,
+    IngredientViewSet,
+    RecipeViewSet,
+    TagViewSet
+)
+from users.models import User
+
+# Запросы с этими параметрами обслуживают синхронные вьюсеты:
+# другие форматы ответа и курсорная пагинация.
+SYNC_ONLY_PARAMS = ('format', 'cursor')
+EXCEPTION_HEADERS = ('WWW-Authenticate', 'Retry-After')
+
+authentication = AsyncTokenAuthentication()
+renderer = JSONRenderer()
+
+
+def render(data, status=200, headers=None):
+    """JSON-ответ, как у JSONRenderer в DRF."""
+    response = HttpResponse(
+        renderer.render(data), content_type=renderer.media_type,
+        status=status, headers=headers,
+    )
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def async_api_view(view):
+    """
+    Асинхронное представление API: аутентификация по токену,
+    ответ в JSON, ошибки - через обработчик исключений DRF.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user_auth = await authentication.aauthenticate(request)
+            request = Request(request, authenticators=(authentication,))
+            if user_auth is None:
+                request._not_authenticated()
+            else:
+                request._authenticator = authentication
+                request.user, request.auth = user_auth
+            return await view(request, *args, **kwargs)
+        except Exception as exc:
+            if isinstance(exc, (
+                exceptions.NotAuthenticated, exceptions.AuthenticationFailed
+            )):
+                exc.auth_header = authentication.authenticate_header(request)
+            response = api_settings.EXCEPTION_HANDLER(
+                exc, {'request': request}
+            )
+            if response is None:
+                raise
+            return render(response.data, response.status_code, {
+                name: response[name]
+                for name in EXCEPTION_HEADERS if response.has_header(name)
+            })
+    return wrapper
+
+
+def get_viewset(viewset_class, action, request, **kwargs):
+    """
+    Вьюсет для переиспользования его выборки, фильтров,
+    сериализаторов и прав доступа; права и частота запросов
+    проверяются сразу.
+    """
+    initkwargs = getattr(getattr(viewset_class, action), 'kwargs', {})
+    view = viewset_class(**initkwargs)
+    view.action = action
+    view.request = request
+    view.args = ()
+    view.kwargs = kwargs
+    view.format_kwarg = None
+    view.check_permissions(request)
+    view.check_throttles(request)
+    return view
+
+
+async def afilter_queryset(view, queryset):
+    """Фильтры проверяют значения параметров запросами к БД."""
+    if view.request.query_params:
+        return await sync_to_async(view.filter_queryset)(queryset)
+    return view.filter_queryset(queryset)
+
+
+async def aget_object(queryset, **filters):
+    try:
+        return await queryset.aget(**filters)
+    except (ObjectDoesNotExist, TypeError, ValueError, DjangoValidationError):
+        raise Http404
+
+
+async def get_page(view, queryset, serializer_class=None):
+    paginator = AsyncPageNumberPagination()
+    page = await paginator.apaginate_queryset(queryset, view.request, view)
+    if serializer_class is None:
+        serializer = view.get_serializer(page, many=True)
+    else:
+        serializer = serializer_class(
+            page, many=True, context=view.get_serializer_context()
+        )
+    return render(paginator.get_paginated_response(serializer.data).data)
+
+
+@async_api_view
+async def recipe_list(request):
+    view = get_viewset(RecipeViewSet, 'list', request)
+    return await get_page(
+        view, await afilter_queryset(view, view.get_queryset())
+    )
+
+
+@async_api_view
+async def recipe_detail(request, pk):
+    view = get_viewset(RecipeViewSet, 'retrieve', request, pk=pk)
+    queryset = await afilter_queryset(view, view.get_queryset())
+    return render(view.get_serializer(await aget_object(queryset, pk=pk)).data)
+
+
+@catalog_cache
+@async_api_view
+async def tag_list(request):
+    view = get_viewset(TagViewSet, 'list', request)
+    tags = [tag async for tag in view.get_queryset()]
+    return render(view.get_serializer(tags, many=True).data)
+
+
+@catalog_cache
+@async_api_view
+async def tag_detail(request, pk):
+    view = get_viewset(TagViewSet, 'retrieve', request, pk=pk)
+    return render(view.get_serializer(
+        await aget_object(view.get_queryset(), pk=pk)
+    ).data)
+
+
+@catalog_cache
+@async_api_view
+async def ingredient_list(request):
+    get_viewset(IngredientViewSet, 'list', request)
+    name = request.query_params.get('name')
+    limit = settings.INGREDIENT_SEARCH_LIMIT if name else None
+    return render(await ingredient_index.asearch(name, limit))
+
+
+@catalog_cache
+@async_api_view
+async def ingredient_detail(request, pk):
+    view = get_viewset(IngredientViewSet, 'retrieve', request, pk=pk)
+    return render(view.get_serializer(
+        await aget_object(view.get_queryset(), pk=pk)
+    ).data)
+
+
+@async_api_view
+async def subscriptions(request):
+    view = get_viewset(CustomUserViewSet, 'subscriptions', request)
+    authors = view.with_recipes(User.objects.filter(
+        following__user=request.user
+    ))
+    return await get_page(view, authors, SubscriptionsSerializer)
+
+
+ASYNC_READ_VIEWS = {
+    'recipes-list': recipe_list,
+    'recipes-detail': recipe_detail,
+    'tags-list': tag_list,
+    'tags-detail': tag_detail,
+    'ingredients-list': ingredient_list,
+    'ingredients-detail': ingredient_detail,
+    'users-subscriptions': subscriptions,
+}
+
+
+def async_read(async_view, sync_view):
+    """
+    GET и HEAD обслуживает асинхронное представление,
+    остальные методы - синхронный вьюсет в отдельном потоке.
+    """
+    run_sync = sync_to_async(sync_view)
+
+    # Атрибуты вьюсета (cls, actions) нужны LoadSheddingMiddleware.
+    @wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not any(
+            param in request.GET or param in kwargs
+            for param in SYNC_ONLY_PARAMS
+        ):
+            return await async_view(request, *args, **kwargs)
+        return await run_sync(request, *args, **kwargs)
+
+    # CSRF проверяет DRF, как и для синхронных вьюсетов.
+    view.csrf_exempt = True
+    return view
+
+
+def get_async_urlpatterns(urlpatterns):
+    """
+    Маршруты роутера в том же порядке, с асинхронным чтением там,
+    где оно есть: иначе адрес карточки перехватит действия списка
+    вроде recipes/download_shopping_cart/.
+    """
+    return [
+        URLPattern(
+            pattern.pattern,
+            async_read(ASYNC_READ_VIEWS[pattern.name], pattern.callback),
+            pattern.default_args,
+            pattern.name,
+        )
+        if pattern.name in ASYNC_READ_VIEWS else pattern
+        for pattern in urlpatterns
+    ]
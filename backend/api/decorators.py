@@ -0,0 +1,74 @@
+from asyncio import iscoroutinefunction
+from calendar import timegm
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from recipes.catalog import get_catalog_last_modified, get_catalog_version
+
+
+def get_catalog_etag(request, *args, **kwargs):
+    """
+    Сильный ETag справочника: версия справочников и хеш заголовка
+    Accept, так как от него зависит представление ответа.
+    """
+    accept = md5(
+        request.headers.get('Accept', '').encode(), usedforsecurity=False
+    ).hexdigest()[:8]
+    return f'"{get_catalog_version()}-{accept}"'
+
+
+def get_catalog_conditions(request):
+    """ETag и Last-Modified (в секундах) справочников для запроса."""
+    return (
+        get_catalog_etag(request),
+        timegm(get_catalog_last_modified().utctimetuple()),
+    )
+
+
+def patch_catalog_response(request, response, etag, last_modified):
+    """Заголовки кеширования ответа справочника."""
+    if request.method in ('GET', 'HEAD'):
+        if not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        response.headers.setdefault('ETag', etag)
+        patch_cache_control(
+            response, public=True, max_age=settings.CATALOG_MAX_AGE
+        )
+    return response
+
+
+def catalog_cache(view):
+    """
+    Условные GET-запросы к справочникам: ETag и Last-Modified
+    по версии справочников, ответ 304 на If-None-Match
+    без обращения к БД, Cache-Control для браузеров.
+    Подходит и для синхронных, и для асинхронных представлений.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            etag, last_modified = get_catalog_conditions(request)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return patch_catalog_response(
+                request, response, etag, last_modified
+            )
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        etag, last_modified = get_catalog_conditions(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return patch_catalog_response(request, response, etag, last_modified)
+    return wrapper
@@ -1,38 +1,57 @@
+from django.conf import settings
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, When
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import FavoriteRecipe, Recipe, RecipeShoppingList
+from recipes.search import search_recipes
+from recipes.tag_masks import get_mask, get_tag_bits
 
+from .indexes import pantry_index
 
-class IngredientFilter(SearchFilter):
-    """Поиск ингредиентов по названию."""
-    search_param = 'name'
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Список чисел через запятую."""
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_bits()]
 
 
 class RecipeFilter(FilterSet):
     """Фильтр рецептов по автору, тегу,
-    наличию в избранном и в списке покупок.
+    наличию в избранном и в списке покупок,
+    поиск по названию и описанию и по имеющимся продуктам.
     """
-    author = filters.AllValuesMultipleFilter(
-        field_name='author__id',
+    # Неизвестный автор - пустой список, а не ошибка.
+    author = NumberInFilter(
+        field_name='author',
+        lookup_expr='in',
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited',
         label='favorite',
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = filters.MultipleChoiceFilter(
+        method='get_tags',
+        choices=get_tag_choices,
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart',
         label='shopping_cart',
     )
+    search = filters.CharFilter(
+        method='get_search',
+        label='search',
+    )
+    missing_max = filters.NumberFilter(
+        method='get_missing_max',
+        label='missing_max',
+        min_value=0,
+    )
+    have = NumberInFilter(
+        method='get_have',
+        label='have',
+    )
 
     class Meta:
         model = Recipe
@@ -42,21 +61,72 @@ class RecipeFilter(FilterSet):
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
+            'have',
+            'missing_max',
         )
 
+    def filter_user_list(self, queryset, model, value):
+        """
+        Рецепты, которые есть (value) или которых нет в списке model
+        текущего пользователя: подзапрос EXISTS по уникальному индексу
+        (user, recipe) не размножает строки и сохраняет другие фильтры.
+        У анонима списки пусты.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        in_list = Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk')
+        ))
+        return queryset.filter(in_list if value else ~in_list)
+
     def get_is_favorited(self, queryset, name, value):
         """Рецепты, находящиеся в списке избранного."""
-        if value:
-            return queryset.filter(
-                elected__user=self.request.user
-            )
-        return queryset.exclude(
-            elected__user=self.request.user
-        )
+        return self.filter_user_list(queryset, FavoriteRecipe, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         """Рецепты, находящиеся в списке покупок."""
-        if value:
-            return Recipe.objects.filter(
-                shopping__user=self.request.user
-            )
+        return self.filter_user_list(queryset, RecipeShoppingList, value)
+
+    def get_search(self, queryset, name, value):
+        """Поиск по названию и описанию с ранжированием."""
+        return search_recipes(queryset, value)
+
+    def get_tags(self, queryset, name, value):
+        """
+        Рецепты с любым из тегов: проверка битов Recipe.tag_mask
+        без соединения со связями и дубликатов.
+        """
+        tag_bits = get_tag_bits()
+        mask = get_mask(
+            tag_bits[slug] for slug in value if slug in tag_bits
+        )
+        return queryset.alias(
+            tag_match=F('tag_mask').bitand(mask)
+        ).filter(tag_match__gt=0)
+
+    def get_missing_max(self, queryset, name, value):
+        """Учитывается вместе с have."""
+        return queryset
+
+    def get_have(self, queryset, name, value):
+        """
+        Рецепты, которые можно приготовить из ингредиентов value,
+        докупив не больше missing_max (по умолчанию 0). Сначала
+        рецепты с наибольшей долей имеющихся ингредиентов. Индекс сам
+        отбирает не больше PANTRY_RESULTS_LIMIT лучших рецептов,
+        чтобы запрос и COUNT пагинации оставались небольшими.
+        """
+        missing_max = int(self.form.cleaned_data.get('missing_max') or 0)
+        groups = pantry_index.search(
+            map(int, value), missing_max, settings.PANTRY_RESULTS_LIMIT
+        )
+        if not groups:
+            return queryset.none()
+        return queryset.filter(
+            id__in=[recipe_id for ids in groups for recipe_id in ids]
+        ).annotate(pantry_rank=Case(
+            *(When(id__in=ids, then=rank) for rank, ids in enumerate(groups)),
+            output_field=IntegerField(),
+        )).order_by('pantry_rank', '-pub_date', 'id')
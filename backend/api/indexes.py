@@ -0,0 +1,286 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db import DatabaseError
+
+from recipes.catalog import get_catalog_version
+from recipes.models import Ingredient, RecipeIngredient
+from recipes.pantry import get_pantry_changes, get_pantry_version
+
+
+def fold(text):
+    """Приведение строки к ключу поиска: без регистра, «ё» как «е»."""
+    return text.casefold().replace('ё', 'е')
+
+
+class IngredientPrefixIndex:
+    """
+    Отсортированный индекс ингредиентов в памяти процесса
+    для поиска по началу названия без запросов к БД.
+    Перестраивается лениво, когда меняется версия справочников
+    (в том числе после изменений в других процессах).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._items = []
+        self._version = None
+
+    def _load(self, version, rows):
+        rows = sorted((fold(name), name, unit, pk) for pk, name, unit in rows)
+        keys = [key for key, *_ in rows]
+        items = [
+            {'id': pk, 'name': name, 'unit': unit}
+            for _, name, unit, pk in rows
+        ]
+        with self._lock:
+            self._keys, self._items = keys, items
+            self._version = version
+
+    def build(self):
+        """Загружает все ингредиенты из БД и строит индекс."""
+        version = get_catalog_version()
+        self._load(version, Ingredient.objects.values_list(
+            'id', 'name', 'unit'
+        ))
+
+    async def abuild(self):
+        """Асинхронная версия build."""
+        version = get_catalog_version()
+        self._load(version, [
+            row async for row in Ingredient.objects.values_list(
+                'id', 'name', 'unit'
+            )
+        ])
+
+    def warm_up(self):
+        """Построение индекса при старте воркера."""
+        try:
+            self.build()
+        except DatabaseError:
+            self.invalidate()
+
+    def invalidate(self):
+        """Помечает индекс устаревшим, он перестроится при обращении."""
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        if self._version != get_catalog_version():
+            self.build()
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        self._ensure_fresh()
+        return self._search(prefix, limit)
+
+    async def asearch(self, prefix, limit=None):
+        """Асинхронная версия search."""
+        if self._version != get_catalog_version():
+            await self.abuild()
+        return self._search(prefix, limit)
+
+    def _search(self, prefix, limit):
+        keys, items = self._keys, self._items
+        if limit is None:
+            limit = len(items)
+        if not prefix:
+            return items[:limit]
+        prefix = fold(prefix)
+        start = bisect_left(keys, prefix)
+        result = []
+        for position in range(start, min(start + limit, len(keys))):
+            if not keys[position].startswith(prefix):
+                break
+            result.append(items[position])
+        return result
+
+
+def to_mask(positions, size):
+    """Битовая маска из номеров битов."""
+    buffer = bytearray(size // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def from_mask(mask):
+    """Номера установленных битов маски по возрастанию."""
+    bits = bin(mask)[:1:-1]
+    position = bits.find('1')
+    while position != -1:
+        yield position
+        position = bits.find('1', position + 1)
+
+
+def add_to_counters(planes, mask):
+    """
+    Прибавляет единицу к счётчикам битов mask. Счётчики хранятся
+    по разрядам: planes[i] - маска битов, у которых i-й разряд
+    счётчика равен единице.
+    """
+    for digit, plane in enumerate(planes):
+        planes[digit], mask = plane ^ mask, plane & mask
+        if not mask:
+            return
+    if mask:
+        planes.append(mask)
+
+
+def counter_equals(planes, count):
+    """Маска битов, счётчик которых равен count."""
+    if count >> len(planes):
+        return 0
+    mask = -1
+    for digit, plane in enumerate(planes):
+        mask &= plane if count >> digit & 1 else ~plane
+    return mask
+
+
+class PantryIndex:
+    """
+    Инвертированный индекс ингредиент -> рецепты в памяти процесса
+    для поиска рецептов по имеющимся продуктам. Множества рецептов -
+    битовые маски (бит - позиция рецепта), поэтому объединения
+    и подсчёт совпадений - побитовые операции над целыми.
+    Изменения рецептов, в том числе в других процессах,
+    подхватываются по журналу recipes.pantry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = []
+        self._positions = {}
+        self._recipes = {}
+        self._ingredients = defaultdict(int)
+        self._sizes = defaultdict(int)
+
+    def _load(self, version, rows):
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in rows:
+            recipes[recipe_id].add(ingredient_id)
+        ids = sorted(recipes)
+        ingredients, sizes = defaultdict(list), defaultdict(list)
+        for position, recipe_id in enumerate(ids):
+            sizes[len(recipes[recipe_id])].append(position)
+            for ingredient_id in recipes[recipe_id]:
+                ingredients[ingredient_id].append(position)
+        self._ids = ids
+        self._positions = {
+            recipe_id: position for position, recipe_id in enumerate(ids)
+        }
+        self._recipes = {
+            recipe_id: frozenset(items) for recipe_id, items in recipes.items()
+        }
+        self._ingredients = defaultdict(int, {
+            ingredient_id: to_mask(positions, len(ids))
+            for ingredient_id, positions in ingredients.items()
+        })
+        self._sizes = defaultdict(int, {
+            size: to_mask(positions, len(ids))
+            for size, positions in sizes.items()
+        })
+        self._version = version
+
+    def build(self):
+        """Загружает состав всех рецептов из БД и строит индекс."""
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        version = get_pantry_version()
+        self._load(version, RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).order_by().iterator(chunk_size=5000))
+
+    def _update(self, version, recipe_ids):
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            recipes[recipe_id].add(ingredient_id)
+        for recipe_id in recipe_ids:
+            position = self._positions.get(recipe_id)
+            old = self._recipes.pop(recipe_id, ())
+            if old:
+                bit = ~(1 << position)
+                self._sizes[len(old)] &= bit
+                for ingredient_id in old:
+                    self._ingredients[ingredient_id] &= bit
+            new = recipes.get(recipe_id)
+            if not new:
+                continue
+            if position is None:
+                position = self._positions[recipe_id] = len(self._ids)
+                self._ids.append(recipe_id)
+            bit = 1 << position
+            self._sizes[len(new)] |= bit
+            for ingredient_id in new:
+                self._ingredients[ingredient_id] |= bit
+            self._recipes[recipe_id] = frozenset(new)
+        self._version = version
+
+    def warm_up(self):
+        """Построение индекса при старте воркера."""
+        try:
+            self.build()
+        except DatabaseError:
+            self.invalidate()
+
+    def invalidate(self):
+        """Помечает индекс устаревшим, он перестроится при обращении."""
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        version = get_pantry_version()
+        if version == self._version:
+            return
+        if self._version is not None:
+            changes = get_pantry_changes(self._version, version)
+            if changes is not None:
+                self._update(version, changes)
+                return
+        self._build()
+
+    def search(self, ingredient_ids, missing_max=0, limit=None):
+        """
+        Рецепты хотя бы с одним из ингредиентов ingredient_ids, для
+        которых из них не хватает не больше missing_max: списки id
+        рецептов с одинаковой долей имеющихся ингредиентов, от большей
+        доли к меньшей (при равной доле - с меньшим числом недостающих).
+        Всего не больше limit рецептов: из последней группы остаются
+        самые новые.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            planes = []
+            for ingredient_id in set(ingredient_ids):
+                add_to_counters(
+                    planes, self._ingredients.get(ingredient_id, 0)
+                )
+            groups = defaultdict(int)
+            for size, recipes in self._sizes.items():
+                for matched in range(max(size - missing_max, 1), size + 1):
+                    mask = recipes & counter_equals(planes, matched)
+                    if mask:
+                        groups[-matched / size, size - matched] |= mask
+            ids = self._ids
+        result = []
+        left = limit
+        for key in sorted(groups):
+            group = [ids[position] for position in from_mask(groups[key])]
+            if left is not None:
+                group = sorted(group)[-left:]
+                left -= len(group)
+            result.append(group)
+            if left == 0:
+                break
+        return result
+
+
+ingredient_index = IngredientPrefixIndex()
+pantry_index = PantryIndex()
@@ -0,0 +1,436 @@
+import asyncio
+import itertools
+import json
+import math
+import platform
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from urllib.parse import quote
+
+from asgiref.sync import (
+    ThreadSensitiveContext,
+    async_to_sync,
+    sync_to_async
+)
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.middleware import QueryCollector, QueryInstrumentationMiddleware
+from recipes.models import Recipe, RecipeIngredient, Tag
+from users.models import User
+
+# auth - запрос от имени пользователя --user, иначе анонимно;
+# patch - изменение рецепта пользователя: запросы чередуют два
+# варианта данных из get_payloads, чтобы каждый что-то менял.
+Endpoint = namedtuple(
+    'Endpoint', ('name', 'url', 'auth', 'method'), defaults=('get',)
+)
+
+ENDPOINTS = (
+    Endpoint('tags', '/api/tags/', False),
+    Endpoint('tag', '/api/tags/{tag}/', False),
+    Endpoint('ingredients', '/api/ingredients/', False),
+    Endpoint('ingredients_search', '/api/ingredients/?name={name}', False),
+    Endpoint('recipes', '/api/recipes/', True),
+    Endpoint('recipes_cursor', '/api/recipes/?cursor=', True),
+    Endpoint('recipes_tags', '/api/recipes/?tags={tag_slug}', True),
+    Endpoint('recipes_author', '/api/recipes/?author={author}', True),
+    Endpoint('recipes_favorited', '/api/recipes/?is_favorited=1', True),
+    Endpoint('recipes_in_cart', '/api/recipes/?is_in_shopping_cart=1',
+             True),
+    Endpoint('recipes_search', '/api/recipes/?search={name}', True),
+    Endpoint('recipes_pantry',
+             '/api/recipes/?have={pantry}&missing_max=2', True),
+    Endpoint('recipe', '/api/recipes/{recipe}/', True),
+    Endpoint('similar', '/api/recipes/{recipe}/similar/', True),
+    Endpoint('download_shopping_cart',
+             '/api/recipes/download_shopping_cart/', True),
+    Endpoint('users', '/api/users/', True),
+    Endpoint('user', '/api/users/{author}/', True),
+    Endpoint('me', '/api/users/me/', True),
+    Endpoint('subscriptions', '/api/users/subscriptions/?recipes_limit=3',
+             True),
+    Endpoint('feed', '/api/recipes/feed/', True),
+    Endpoint('recipe_update_text', '/api/recipes/{own_recipe}/', True,
+             'patch'),
+    Endpoint('recipe_update_amount', '/api/recipes/{own_recipe}/', True,
+             'patch'),
+    Endpoint('recipe_update_tags', '/api/recipes/{own_recipe}/', True,
+             'patch'),
+)
+# Адреса для каждого способа запуска приложения.
+URLCONFS = {
+    'wsgi': 'recipebook.urls',
+    'asgi': 'recipebook.asgi_urls',
+}
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def get_content(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+async def aget_content(response):
+    if response.streaming:
+        return b''.join([chunk async for chunk in response])
+    return response.content
+
+
+def get_user(username):
+    """Пользователь для запросов с авторизацией."""
+    try:
+        return User.objects.get(username=username)
+    except User.DoesNotExist:
+        raise CommandError(
+            f'Пользователь {username} не найден, '
+            f'создайте данные командой seed или укажите --user'
+        )
+
+
+def get_context(user):
+    """Значения для подстановки в адреса эндпоинтов."""
+    recipe = Recipe.objects.first()
+    tag = Tag.objects.first()
+    own_recipe = user.recipes.first()
+    if recipe is None or tag is None or own_recipe is None:
+        raise CommandError(
+            'В БД нет рецептов, тегов или рецептов пользователя'
+        )
+    author = user.follower.values_list('author', flat=True).first()
+    # Запас продуктов - ингредиенты первых рецептов, несколько десятков.
+    pantry = RecipeIngredient.objects.filter(
+        recipe__in=Recipe.objects.values('id')[:10]
+    ).values_list('ingredient_id', flat=True).distinct()
+    return {
+        'tag': tag.id,
+        'tag_slug': quote(tag.slug),
+        'recipe': recipe.id,
+        'own_recipe': own_recipe.id,
+        'author': author or user.id,
+        'name': quote(recipe.name.split()[0][:3].lower()),
+        'pantry': ','.join(map(str, pantry)),
+    }
+
+
+def get_headers(user):
+    """Заголовки анонимных запросов и запросов с авторизацией."""
+    token, _ = Token.objects.get_or_create(user=user)
+    return {
+        False: {},
+        True: {'Authorization': f'Token {token.key}'},
+    }
+
+
+def client_settings(interface='wsgi'):
+    """
+    Настройки для запросов тестовым клиентом: он обращается к хосту
+    testserver, а нагрузку создаёт сама команда, поэтому ограничения
+    частоты и сброс нагрузки отключены.
+    """
+    return override_settings(
+        ALLOWED_HOSTS=['testserver'],
+        ROOT_URLCONF=URLCONFS[interface],
+        REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}
+        },
+        LOAD_SHEDDING_MAX_REQUESTS=0,
+    )
+
+
+def get_payloads(recipe):
+    """
+    Два варианта данных для каждого сценария изменения рецепта:
+    исходный и с одной правкой текста, количества или тегов.
+    """
+    ingredients = [
+        {'id': item.ingredient_id, 'amount': item.amount}
+        for item in recipe.recipeingredient_set.order_by('id')
+    ]
+    tags = list(recipe.tags.values_list('id', flat=True))
+    original = {
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'tags': tags,
+        'ingredients': ingredients,
+    }
+    other_tag = Tag.objects.exclude(id__in=tags).values_list(
+        'id', flat=True
+    ).first()
+    changes = {
+        'recipe_update_text': {'text': f'{recipe.text} '},
+        'recipe_update_amount': {'ingredients': [
+            {**ingredients[0], 'amount': ingredients[0]['amount'] % 5000 + 1},
+            *ingredients[1:],
+        ]},
+        'recipe_update_tags': {
+            'tags': tags + [other_tag] if other_tag else tags[1:]
+        },
+    }
+    return {
+        name: ({**original, **change}, original)
+        for name, change in changes.items()
+    }
+
+
+class Command(BaseCommand):
+    """
+    Замеряем время ответа API через тестовый клиент Django,
+    без сети и веб-сервера: перцентили задержки, пропускную
+    способность, число запросов к БД, из них изменяющих данные,
+    и размер ответа для каждого эндпоинта. --interface asgi замеряет
+    асинхронные представления, --concurrency - параллельные запросы
+    (потоки для WSGI, сопрограммы для ASGI). Сценарии изменения
+    рецепта выполняются последовательно в транзакции, которая
+    откатывается. Данные для замеров удобно создать командой seed.
+    """
+    help = 'Бенчмарк эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'endpoints',
+            nargs='*',
+            help='Эндпоинты для замера, по умолчанию все',
+        )
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Количество замеров для эндпоинта')
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Количество запросов для прогрева')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Количество параллельных запросов')
+        parser.add_argument('--interface', choices=tuple(URLCONFS),
+                            default='wsgi',
+                            help='Синхронные (WSGI) или асинхронные '
+                                 '(ASGI) представления')
+        parser.add_argument('--user', default='seed0',
+                            help='Имя пользователя для запросов '
+                                 'с авторизацией')
+        parser.add_argument('--output',
+                            help='Сохранить результаты в JSON-файл')
+        parser.add_argument('--compare',
+                            help='JSON-файл прошлого запуска для сравнения')
+
+    def handle(self, *args, **options):
+        names = set(options['endpoints'])
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if endpoint.name in names or not names
+        ]
+        unknown = names - {endpoint.name for endpoint in ENDPOINTS}
+        if unknown:
+            raise CommandError(
+                f'Неизвестные эндпоинты: {", ".join(sorted(unknown))}'
+            )
+        for option in ('requests', 'concurrency'):
+            if options[option] < 1:
+                raise CommandError(f'--{option} должен быть больше нуля')
+        user = get_user(options['user'])
+        context = get_context(user)
+        payloads = get_payloads(Recipe.objects.get(id=context['own_recipe']))
+        headers = get_headers(user)
+        measure = (
+            async_to_sync(self.ameasure)
+            if options['interface'] == 'asgi' else self.measure
+        )
+        results = {}
+        with client_settings(options['interface']):
+            for endpoint in endpoints:
+                url = endpoint.url.format(**context)
+                if endpoint.method == 'get':
+                    results[endpoint.name] = measure(
+                        url, headers[endpoint.auth], options
+                    )
+                    continue
+                with transaction.atomic():
+                    results[endpoint.name] = measure(
+                        url, headers[endpoint.auth],
+                        {**options, 'concurrency': 1},
+                        payloads[endpoint.name],
+                    )
+                    transaction.set_rollback(True)
+        report = {
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'interface': options['interface'],
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'endpoints': results,
+        }
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)['endpoints']
+        self.print_report(results, previous)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+    def measure(self, url, headers, options, payloads=None):
+        """Замер через WSGI; параллельные запросы - в потоках."""
+        client = Client(raise_request_exception=False, headers=headers)
+        numbers = itertools.count()
+
+        def request(client):
+            if payloads is None:
+                return client.get(url)
+            return client.patch(url, payloads[next(numbers) % 2],
+                                content_type='application/json')
+
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            response = request(client)
+            size = len(get_content(response))
+        for _ in range(options['warmup']):
+            get_content(request(client))
+
+        def worker(count):
+            worker_client = Client(
+                raise_request_exception=False, headers=headers
+            )
+            timings = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    get_content(request(worker_client))
+                    timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                if options['concurrency'] > 1:
+                    connections.close_all()
+            return timings
+
+        started = time.perf_counter()
+        if options['concurrency'] == 1:
+            timings = worker(options['requests'])
+        else:
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                timings = [
+                    timing
+                    for worker_timings in executor.map(
+                        worker, self.split(options)
+                    )
+                    for timing in worker_timings
+                ]
+        return self.get_result(url, response, collector, size, timings,
+                               time.perf_counter() - started)
+
+    async def ameasure(self, url, headers, options, payloads=None):
+        """Замер через ASGI; параллельные запросы - в сопрограммах."""
+        client = AsyncClient(raise_request_exception=False)
+        numbers = itertools.count()
+
+        async def request():
+            if payloads is None:
+                return await client.get(url, headers=headers)
+            return await client.patch(
+                url, payloads[next(numbers) % 2],
+                content_type='application/json', headers=headers,
+            )
+
+        # Асинхронный ORM работает в потоке sync_to_async: запросы
+        # считаются обёрткой на его соединениях, как в middleware.
+        collector = QueryCollector()
+        await sync_to_async(QueryInstrumentationMiddleware.add_wrapper)(
+            collector
+        )
+        try:
+            response = await request()
+            size = len(await aget_content(response))
+        finally:
+            await sync_to_async(
+                QueryInstrumentationMiddleware.remove_wrapper
+            )(collector)
+        for _ in range(options['warmup']):
+            await aget_content(await request())
+
+        async def worker(count):
+            timings = []
+            for _ in range(count):
+                # Как в ASGI-сервере: у каждого запроса свой поток
+                # для синхронного кода и своё соединение с БД.
+                async with (
+                    ThreadSensitiveContext()
+                    if options['concurrency'] > 1 else nullcontext()
+                ):
+                    started = time.perf_counter()
+                    await aget_content(await request())
+                    timings.append((time.perf_counter() - started) * 1000)
+            return timings
+
+        started = time.perf_counter()
+        timings = [
+            timing
+            for worker_timings in await asyncio.gather(*(
+                worker(count) for count in self.split(options)
+            ))
+            for timing in worker_timings
+        ]
+        return self.get_result(url, response, collector, size, timings,
+                               time.perf_counter() - started)
+
+    @staticmethod
+    def split(options):
+        """Распределение запросов между параллельными исполнителями."""
+        count, rest = divmod(options['requests'], options['concurrency'])
+        counts = [
+            count + (number < rest)
+            for number in range(options['concurrency'])
+        ]
+        return [count for count in counts if count]
+
+    @staticmethod
+    def get_result(url, response, collector, size, timings, elapsed):
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': collector.count,
+            'writes': collector.writes,
+            'bytes': size,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'rps': round(len(timings) / elapsed, 1),
+        }
+
+    def print_report(self, results, previous):
+        self.stdout.write(
+            f'{"Эндпоинт":<24}{"код":>5}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"rps":>8}{"SQL":>6}{"запись":>8}{"байт":>9}'
+        )
+        for name, result in results.items():
+            line = (
+                f'{name:<24}{result["status"]:>5}{result["p50_ms"]:>9.2f}'
+                f'{result["p95_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+                f'{result["rps"]:>8.0f}'
+                f'{result["queries"]:>6}{result["writes"]:>8}'
+                f'{result["bytes"]:>9}'
+            )
+            old = previous.get(name)
+            if old and old['p95_ms']:
+                line += (
+                    f'  p95 {result["p95_ms"] / old["p95_ms"] - 1:+.0%}, '
+                    f'SQL {result["queries"] - old["queries"]:+d}'
+                )
+                if 'writes' in old:
+                    line += (
+                        f', запись {result["writes"] - old["writes"]:+d}'
+                    )
+                if old.get('rps'):
+                    line += f', rps {result["rps"] / old["rps"] - 1:+.0%}'
+            self.stdout.write(line)
@@ -0,0 +1,163 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.management.commands.benchmark import (
+    ENDPOINTS,
+    client_settings,
+    get_content,
+    get_context,
+    get_headers,
+    get_user
+)
+
+# Таблицы, которые эндпоинт читает целиком по назначению.
+FULL_SCANS = {
+    'ingredients': {'recipes_ingredient'},
+    # Условие tag_mask & N > 0 не поддерживается индексом: COUNT
+    # пагинации проверяет маску у каждого рецепта, без соединений.
+    'recipes_tags': {'recipes_recipe'},
+}
+
+
+def is_spilled(node):
+    """Сортировка узла плана (или его параллельных процессов) на диске."""
+    for sort in (node, *node.get('Workers', ())):
+        methods = [sort.get('Sort Method', '')] + [
+            method
+            for groups in ('Full-sort Groups', 'Pre-sorted Groups')
+            for method in sort.get(groups, {}).get('Sort Methods Used', ())
+        ]
+        if sort.get('Sort Space Type') == 'Disk' or any(
+            method.startswith('external') for method in methods
+        ):
+            return True
+    return False
+
+
+def find_plan_problems(plan, table_rows, min_rows, full_scans=()):
+    """
+    Замечания к плану EXPLAIN (ANALYZE, FORMAT JSON): последовательное
+    чтение таблиц от min_rows строк, кроме подсчёта всех строк
+    и таблиц full_scans, и сортировки, не поместившиеся в work_mem.
+    """
+    problems = []
+
+    def walk(node, parent):
+        relation = node.get('Relation Name')
+        if (
+            node['Node Type'] == 'Seq Scan'
+            and relation not in full_scans
+            and table_rows.get(relation, 0) >= min_rows
+            and ('Filter' in node or parent.get('Node Type') != 'Aggregate')
+        ):
+            problems.append(
+                f'Seq Scan по {relation} '
+                f'({table_rows[relation]} строк в таблице)'
+            )
+        if is_spilled(node):
+            problems.append(f'{node["Node Type"]} на диске')
+        for child in node.get('Plans', ()):
+            walk(child, node)
+
+    walk(plan, {})
+    return problems
+
+
+def get_table_rows(analyze=False):
+    """{таблица: число строк по статистике PostgreSQL}."""
+    with connection.cursor() as cursor:
+        if analyze:
+            cursor.execute('ANALYZE')
+        cursor.execute(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'"
+        )
+        return {relation: int(rows) for relation, rows in cursor.fetchall()}
+
+
+class Command(BaseCommand):
+    """
+    Проверяем планы SQL-запросов ключевых эндпоинтов API
+    в PostgreSQL: каждый SELECT, выполненный при GET-запросе
+    из бенчмарка, повторяется с EXPLAIN (ANALYZE, FORMAT JSON),
+    и команда завершается ошибкой, если план читает большую таблицу
+    последовательно или сортирует на диске. Данные удобно создать
+    командой seed, перед проверкой нужна статистика (--analyze).
+    """
+    help = 'Проверка планов SQL-запросов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'endpoints',
+            nargs='*',
+            help='Эндпоинты для проверки, по умолчанию все GET',
+        )
+        parser.add_argument('--user', default='seed0',
+                            help='Имя пользователя для запросов '
+                                 'с авторизацией')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Таблицы меньше этого числа строк '
+                                 'можно читать последовательно')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Обновить статистику таблиц (ANALYZE)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Планы запросов проверяются в PostgreSQL')
+        names = set(options['endpoints'])
+        endpoints = [
+            endpoint for endpoint in ENDPOINTS
+            if endpoint.method == 'get'
+            and (endpoint.name in names or not names)
+        ]
+        unknown = names - {endpoint.name for endpoint in endpoints}
+        if unknown:
+            raise CommandError(
+                f'Неизвестные эндпоинты: {", ".join(sorted(unknown))}'
+            )
+        user = get_user(options['user'])
+        context = get_context(user)
+        headers = get_headers(user)
+        table_rows = get_table_rows(options['analyze'])
+        failed = 0
+        with client_settings():
+            for endpoint in endpoints:
+                client = Client(raise_request_exception=False,
+                                headers=headers[endpoint.auth])
+                with CaptureQueriesContext(connection) as queries:
+                    get_content(client.get(endpoint.url.format(**context)))
+                selects = [
+                    query['sql'] for query in queries.captured_queries
+                    if query['sql'].lstrip().upper().startswith('SELECT')
+                ]
+                problems = []
+                for sql in selects:
+                    for problem in self.explain(
+                        sql, table_rows, options['min_rows'],
+                        FULL_SCANS.get(endpoint.name, ()),
+                    ):
+                        problems.append(f'  {problem}: {sql[:200]}')
+                failed += bool(problems)
+                self.stdout.write(
+                    f'{endpoint.name:<24}{len(selects):>4} SQL  '
+                    f'{"замечания" if problems else "ok"}'
+                )
+                for problem in problems:
+                    self.stdout.write(problem)
+        if failed:
+            raise CommandError(f'Эндпоинтов с замечаниями к планам: {failed}')
+
+    @staticmethod
+    def explain(sql, table_rows, min_rows, full_scans):
+        # ANALYZE выполняет запрос: изменения, если они есть, откатываются.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+            result = cursor.fetchone()[0]
+            transaction.set_rollback(True)
+        if isinstance(result, str):
+            result = json.loads(result)
+        return find_plan_problems(result[0]['Plan'], table_rows, min_rows,
+                                  full_scans)
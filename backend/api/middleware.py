@@ -0,0 +1,429 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from hashlib import md5
+from http import HTTPStatus
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from recipebook.routers import replica_reads
+
+from .throttling import get_throttle_scope
+
+logger = logging.getLogger('api.performance')
+
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def get_fingerprint(sql):
+    """SQL без значений параметров: одинаковый для запросов одного вида."""
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryCollector:
+    """
+    Обёртка для connection.execute_wrapper: считает запросы,
+    в том числе изменяющие данные, и их время, группируя
+    по тексту SQL.
+    """
+
+    WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+    def __init__(self):
+        self.count = 0
+        self.writes = 0
+        self.duration = 0.0
+        self._by_sql = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            if sql.lstrip()[:6].upper() in self.WRITE_STATEMENTS:
+                self.writes += 1
+            self.duration += duration
+            stats = self._by_sql[sql]
+            stats[0] += 1
+            stats[1] += duration
+
+    def get_fingerprints(self):
+        """{отпечаток: [количество, время]} по убыванию количества."""
+        # Нормализация дорогая, поэтому делается один раз
+        # для каждого уникального текста запроса в конце.
+        fingerprints = defaultdict(lambda: [0, 0.0])
+        for sql, (count, duration) in self._by_sql.items():
+            stats = fingerprints[get_fingerprint(sql)]
+            stats[0] += count
+            stats[1] += duration
+        return dict(sorted(
+            fingerprints.items(), key=lambda item: -item[1][0]
+        ))
+
+    def get_duplicates(self, threshold):
+        """Повторяющиеся запросы одного вида - признак N+1."""
+        return {
+            fingerprint: stats
+            for fingerprint, stats in self.get_fingerprints().items()
+            if stats[0] >= threshold
+        }
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Замеряет запросы к БД для каждого HTTP-запроса и добавляет
+    заголовок Server-Timing с фазами db (запросы к БД), serialize
+    (работа представления и сериализаторов без учёта БД) и render
+    (рендеринг ответа). Медленные запросы пишутся в лог api.performance
+    вместе с повторяющимися SQL (N+1). Тело потоковых ответов
+    формируется после middleware и в замеры не попадает.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_INSTRUMENTATION:
+            return self.get_response(request)
+        collector = QueryCollector()
+        request._instrumentation = {'collector': collector}
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            response = self.get_response(request)
+        return self.finalize(request, response, collector, started)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSTRUMENTATION:
+            return await self.get_response(request)
+        collector = QueryCollector()
+        request._instrumentation = {'collector': collector}
+        started = time.perf_counter()
+        # Асинхронный ORM выполняет запросы в потоке sync_to_async,
+        # общем для всего запроса: обёртка ставится на его соединения.
+        await sync_to_async(self.add_wrapper)(collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(self.remove_wrapper)(collector)
+        return self.finalize(request, response, collector, started)
+
+    @staticmethod
+    def add_wrapper(collector):
+        for connection in connections.all():
+            connection.execute_wrappers.append(collector)
+
+    @staticmethod
+    def remove_wrapper(collector):
+        for connection in connections.all():
+            if collector in connection.execute_wrappers:
+                connection.execute_wrappers.remove(collector)
+
+    def finalize(self, request, response, collector, started):
+        """Заголовок Server-Timing и лог медленного запроса."""
+        finished = time.perf_counter()
+        timings = self.get_timings(request, collector, started, finished)
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}'
+            + (f';desc="{collector.count} queries"' if name == 'db' else '')
+            for name, duration in timings.items()
+        )
+        if (
+            timings['total'] >= settings.SLOW_REQUEST_MS
+            or collector.count >= settings.SLOW_REQUEST_QUERIES
+        ):
+            self.log_slow_request(request, response, collector, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_instrumentation'):
+            request._instrumentation.update(
+                view_started=time.perf_counter(),
+                db_before_view=request._instrumentation['collector'].duration,
+            )
+
+    def process_template_response(self, request, response):
+        # Вызывается сразу после представления, до рендеринга ответа.
+        instrumentation = getattr(request, '_instrumentation', None)
+        if instrumentation and 'view_started' in instrumentation:
+            instrumentation.update(
+                view_finished=time.perf_counter(),
+                view_db=(
+                    instrumentation['collector'].duration
+                    - instrumentation['db_before_view']
+                ),
+            )
+        return response
+
+    def get_timings(self, request, collector, started, finished):
+        """Длительность фаз запроса в миллисекундах."""
+        instrumentation = request._instrumentation
+        serialize = render = 0.0
+        if 'view_started' in instrumentation:
+            # Ответы без рендеринга (например, потоковые) целиком
+            # относятся к работе представления.
+            view_finished = instrumentation.get('view_finished', finished)
+            view_db = instrumentation.get(
+                'view_db',
+                collector.duration - instrumentation['db_before_view'],
+            )
+            serialize = max(
+                view_finished - instrumentation['view_started'] - view_db, 0
+            )
+            render = finished - view_finished
+        return {
+            'db': collector.duration * 1000,
+            'serialize': serialize * 1000,
+            'render': render * 1000,
+            'total': (finished - started) * 1000,
+        }
+
+    def log_slow_request(self, request, response, collector, timings):
+        duplicates = collector.get_duplicates(
+            settings.DUPLICATE_QUERY_THRESHOLD
+        )
+        resolver_match = request.resolver_match
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': collector.count,
+            'timings_ms': {
+                name: round(duration, 1) for name, duration in timings.items()
+            },
+            'top_queries': [
+                {
+                    'fingerprint': md5(fingerprint.encode()).hexdigest()[:12],
+                    'sql': fingerprint,
+                    'count': count,
+                    'ms': round(duration * 1000, 1),
+                    'n_plus_one': fingerprint in duplicates,
+                }
+                for fingerprint, (count, duration)
+                in list(collector.get_fingerprints().items())[:10]
+            ],
+            'n_plus_one': len(duplicates),
+        }, ensure_ascii=False))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Разрешает чтение с реплик для безопасных запросов (GET, HEAD,
+    OPTIONS) к API; админка и остальные страницы читают из основной
+    БД. После изменяющего запроса клиент REPLICA_PIN_SECONDS
+    читает из основной БД, чтобы видеть свои изменения, даже если
+    реплики отстают. Клиент определяется по заголовку Authorization
+    или cookie сессии; метка хранится в общем кеше.
+    """
+    sync_capable = True
+    async_capable = True
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    REPLICA_PATH_PREFIX = '/api/'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = self.get_pin_key(request)
+        if request.method not in self.SAFE_METHODS:
+            response = self.get_response(request)
+            if key:
+                cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+        if not request.path.startswith(self.REPLICA_PATH_PREFIX):
+            return self.get_response(request)
+        with replica_reads(not (key and cache.get(key))):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        key = self.get_pin_key(request)
+        if request.method not in self.SAFE_METHODS:
+            response = await self.get_response(request)
+            if key:
+                await cache.aset(key, True, settings.REPLICA_PIN_SECONDS)
+            return response
+        if not request.path.startswith(self.REPLICA_PATH_PREFIX):
+            return await self.get_response(request)
+        with replica_reads(not (key and await cache.aget(key))):
+            return await self.get_response(request)
+
+    @staticmethod
+    def get_pin_key(request):
+        """Ключ метки чтения из основной БД для клиента запроса."""
+        client = request.headers.get('Authorization') or request.COOKIES.get(
+            settings.SESSION_COOKIE_NAME
+        )
+        if not client:
+            return None
+        return f'replica-pin:{md5(client.encode()).hexdigest()}'
+
+
+class ReleasingContent:
+    """
+    Содержимое потокового ответа, после отдачи или закрытия
+    которого вызывается release.
+    """
+
+    def __init__(self, content, release):
+        self.content = content
+        self.release = release
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self):
+        release, self.release = self.release, None
+        if release is not None:
+            release()
+
+
+class AsyncReleasingContent(ReleasingContent):
+    """Содержимое асинхронного потокового ответа с вызовом release."""
+
+    # Django считает содержимое синхронным, если у него есть __iter__.
+    __iter__ = None
+
+    async def __aiter__(self):
+        try:
+            async for part in self.content:
+                yield part
+        finally:
+            self.close()
+
+
+class LoadSheddingMiddleware:
+    """
+    Сброс нагрузки: когда процесс уже обрабатывает
+    LOAD_SHEDDING_MAX_REQUESTS запросов, дорогие запросы (области
+    ограничения из LOAD_SHEDDING_SCOPES) сразу получают 429
+    с Retry-After вместо ожидания в очереди воркера. Потоковый ответ
+    считается обрабатываемым, пока не отдан.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.should_shed(request):
+            return self.shed(request)
+        self.acquire()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release()
+            raise
+        return self.release_after(response)
+
+    async def __acall__(self, request):
+        if self.should_shed(request):
+            return self.shed(request)
+        self.acquire()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.release()
+            raise
+        return self.release_after(response)
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def release_after(self, response):
+        if response.streaming:
+            content_class = (
+                AsyncReleasingContent if response.is_async
+                else ReleasingContent
+            )
+            response.streaming_content = content_class(
+                response.streaming_content, self.release
+            )
+        else:
+            self.release()
+        return response
+
+    def should_shed(self, request):
+        limit = settings.LOAD_SHEDDING_MAX_REQUESTS
+        if not limit or self.in_flight < limit:
+            return False
+        # Адрес разбирается, только когда процесс перегружен.
+        try:
+            view = resolve(request.path_info).func
+        except Resolver404:
+            return False
+        view_class = getattr(view, 'cls', None)
+        if view_class is None:
+            return False
+        action = (getattr(view, 'actions', None) or {}).get(
+            request.method.lower()
+        )
+        return get_throttle_scope(
+            view_class, action, request.method
+        ) in settings.LOAD_SHEDDING_SCOPES
+
+    def shed(self, request):
+        logger.warning(
+            'Запрос %s %s отклонён: обрабатывается %s запросов',
+            request.method, request.path, self.in_flight,
+        )
+        return JsonResponse(
+            {'detail': 'Сервер перегружен, повторите запрос позже.'},
+            status=HTTPStatus.TOO_MANY_REQUESTS,
+            headers={'Retry-After': str(settings.LOAD_SHEDDING_RETRY_AFTER)},
+        )
@@ -0,0 +1,148 @@
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (
+    BasePagination,
+    Cursor,
+    CursorPagination,
+    PageNumberPagination
+)
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация ленты рецептов по (-pub_date, id)."""
+    ordering = ('-pub_date', 'id')
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    """Курсорная пагинация подписок по уникальному username."""
+    ordering = ('username',)
+
+
+class OptInCursorPagination(BasePagination):
+    """
+    Постраничная пагинация (?page=) по умолчанию,
+    курсорная - если в запросе есть параметр cursor
+    (для первой страницы - пустой: ?cursor=).
+    В курсорном режиме нет COUNT(*) и OFFSET по всей выборке.
+    Курсор строится по ordering, поэтому с параметрами ranked_params,
+    задающими свой порядок (ранжирование), он не принимается.
+    """
+    page_pagination_class = PageNumberPagination
+    cursor_pagination_class = RecipeCursorPagination
+    ranked_params = ('search', 'have')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor_param = self.cursor_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            ranked = [
+                param for param in self.ranked_params
+                if param in request.query_params
+            ]
+            if ranked:
+                raise ValidationError({cursor_param: [
+                    f'Курсорная пагинация недоступна с параметрами '
+                    f'{", ".join(ranked)}: используйте ?page=.'
+                ]})
+            self.paginator = self.cursor_pagination_class()
+        else:
+            self.paginator = self.page_pagination_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_pagination_class().get_paginated_response_schema(
+            schema
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_pagination_class().get_schema_operation_parameters(
+                view
+            )
+            + self.cursor_pagination_class().get_schema_operation_parameters(
+                view
+            )
+        )
+
+
+class SubscriptionPagination(OptInCursorPagination):
+    """Пагинация подписок с курсорным режимом по запросу."""
+    cursor_pagination_class = SubscriptionCursorPagination
+    ranked_params = ()
+
+
+class FeedCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация ленты подписок только вперёд. Позиция
+    в курсоре - дата публикации и id последнего рецепта страницы,
+    строки страницы возвращает get_page(limit, position).
+    """
+    ordering = ('-pub_date', 'id')
+
+    def paginate_feed(self, get_page, request):
+        """id рецептов страницы."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        position = None
+        if cursor is not None and cursor.position is not None:
+            position = self.decode_position(cursor.position)
+        rows = get_page(self.page_size + 1, position)
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = rows[-1] if rows else None
+        return [recipe_id for _, recipe_id in rows]
+
+    def decode_position(self, position):
+        pub_date, _, recipe_id = position.rpartition(' ')
+        try:
+            return datetime.fromisoformat(pub_date), int(recipe_id)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        pub_date, recipe_id = self.next_position
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False,
+            position=f'{pub_date.isoformat()} {recipe_id}',
+        ))
+
+    def get_previous_link(self):
+        return None
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """
+    Постраничная пагинация для асинхронных представлений:
+    COUNT(*) и выборка страницы через асинхронный ORM.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Число объектов считается заранее, чтобы Paginator
+        # не выполнял синхронный COUNT(*).
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        self.request = request
+        return [obj async for obj in self.page.object_list]
@@ -0,0 +1,89 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер файла со списком покупок.
+    Содержимое файла отдаётся по частям методом stream,
+    render используется только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+    title = 'Список покупок'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, ingredients):
+        """Генератор частей файла по строкам (название, ед., количество)."""
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в виде простого текста."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{self.title}:'
+        for name, unit, amount in ingredients:
+            yield f'\n- {name} ({unit}) - {amount}'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'unit', 'amount'))
+        for row in ingredients:
+            yield writer.writerow(row)
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, ingredients):
+        separator = ''
+        yield '['
+        for name, unit, amount in ingredients:
+            yield separator + json.dumps(
+                {'name': name, 'unit': unit, 'amount': amount},
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']'
+
+
+class MarkdownShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в формате Markdown с чекбоксами."""
+    media_type = 'text/markdown'
+    format = 'md'
+
+    def stream(self, ingredients):
+        yield f'# {self.title}\n\n'
+        for name, unit, amount in ingredients:
+            yield f'- [ ] {name} ({unit}) — {amount}\n'
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    MarkdownShoppingListRenderer,
+)
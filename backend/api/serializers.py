@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_base64.fields import Base64ImageField
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers, status
@@ -13,9 +15,27 @@ from recipes.models import (
     RecipeShoppingList,
     Tag
 )
+from recipes.images import get_image_urls, schedule_derivatives
+from recipes.services import change_recipe_amounts
+from recipes.pantry import record_pantry_change
+from recipes.similarity import refresh_similar
 from users.models import Follow, User
 
 
+def get_absolute_image_urls(recipe, request=None):
+    """Ссылки на уменьшенные копии изображения, абсолютные при запросе."""
+    urls = get_image_urls(recipe)
+    if request is None:
+        return urls
+    return {
+        size: {
+            extension: request.build_absolute_uri(url)
+            for extension, url in formats.items()
+        }
+        for size, formats in urls.items()
+    }
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор создания нового пользователя."""
     class Meta:
@@ -45,10 +65,14 @@ class CustomUserSerializer(UserSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
 
     def get_is_subscribed(self, obj):
         """Подписан ли пользователь на автора."""
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -59,8 +83,8 @@ class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с моделью тегов."""
     class Meta:
         model = Tag
-        fields = ('__all__')
-        read_only_fields = (fields,)
+        fields = ('id', 'name', 'color', 'slug')
+        read_only_fields = fields
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -99,10 +123,15 @@ class RecipeShortSerializer(serializers.ModelSerializer):
     отображения на страницах со списком покупок и подписками.
     """
     image = Base64ImageField()
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('name', 'image', 'author', 'cooking_time')
+        fields = ('name', 'image', 'images', 'author', 'cooking_time')
+
+    def get_images(self, obj):
+        """Уменьшенные копии изображения в форматах WebP и JPEG."""
+        return get_absolute_image_urls(obj, self.context.get('request'))
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -120,15 +149,23 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'favorites_count', 'in_carts_count',
+                  'name', 'image', 'images', 'text', 'cooking_time')
+
+    def get_images(self, obj):
+        """Уменьшенные копии изображения в форматах WebP и JPEG."""
+        return get_absolute_image_urls(obj, self.context.get('request'))
 
     def get_is_favorited(self, obj):
         """Проверка на наличие рецепта в избранном."""
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -137,6 +174,8 @@ class RecipeSerializer(serializers.ModelSerializer):
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка на наличие рецепта в списке покупок."""
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -148,9 +187,9 @@ class IngredientAddRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для добавления ингредиентов в рецепт.
     """
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient')
+    # Наличие ингредиентов проверяется одним запросом
+    # в RecipeCreateUpdateSerializer.validate_ingredients.
+    id = serializers.IntegerField(min_value=1, source='ingredient_id')
     amount = serializers.IntegerField()
 
     class Meta:
@@ -164,10 +203,7 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     и обновления рецепта.
     """
     ingredients = IngredientAddRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField(min_value=1))
     image = Base64ImageField()
     author = CustomUserSerializer(read_only=True)
 
@@ -183,18 +219,90 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             raise ValidationError(
                 'Необходимо выбрать ингредиенты!'
             )
+        ingredient_ids = [
+            ingredient['ingredient_id'] for ingredient in ingredients
+        ]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise ValidationError(
+                'Ингредиенты не должны повторяться!'
+            )
+        missing = set(ingredient_ids) - set(Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).values_list('id', flat=True))
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}'
+            )
         return ingredients
 
+    def validate_tags(self, tags):
+        """Проверка тегов одним запросом."""
+        tags = list(dict.fromkeys(tags))
+        missing = set(tags) - set(Tag.objects.filter(
+            id__in=tags
+        ).values_list('id', flat=True))
+        if missing:
+            raise ValidationError(
+                f'Теги не найдены: {", ".join(map(str, sorted(missing)))}'
+            )
+        return tags
+
     def _add_ingredients(self, recipe, ingredients):
         """Добавление ингредиентов в рецепт."""
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient['ingredient'],
+                ingredient_id=ingredient['ingredient_id'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients
         )
 
+    def _update_ingredients(self, recipe, old_amounts, new_amounts):
+        """
+        Изменение состава рецепта на разницу: удаляются только
+        убранные ингредиенты, новые и с изменённым количеством
+        записываются одним INSERT ... ON CONFLICT DO UPDATE.
+        Возвращает, изменился ли набор ингредиентов.
+        """
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = {
+            ingredient_id: amount
+            for ingredient_id, amount in new_amounts.items()
+            if old_amounts.get(ingredient_id) != amount
+        }
+        if changed:
+            RecipeIngredient.objects.bulk_create(
+                (
+                    RecipeIngredient(recipe=recipe,
+                                     ingredient_id=ingredient_id,
+                                     amount=amount)
+                    for ingredient_id, amount in changed.items()
+                ),
+                update_conflicts=True,
+                unique_fields=('recipe', 'ingredient'),
+                update_fields=('amount',),
+            )
+        return old_amounts.keys() != new_amounts.keys()
+
+    def _update_tags(self, recipe, tags):
+        """
+        Изменение тегов рецепта на разницу.
+        Возвращает, изменились ли теги.
+        """
+        old_tags = {tag.id for tag in recipe.tags.all()}
+        removed = old_tags - set(tags)
+        added = set(tags) - old_tags
+        if removed:
+            recipe.tags.remove(*removed)
+        if added:
+            recipe.tags.add(*added)
+        return bool(removed or added)
+
     @transaction.atomic
     def create(self, validated_data):
         """"Добавление рецепта."""
@@ -206,23 +314,59 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
                                        **validated_data)
         recipe.tags.set(tags)
         self._add_ingredients(recipe, ingredients)
+        refresh_similar(recipe.id)
+        record_pantry_change(recipe.id)
+        schedule_derivatives(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, recipe, validated_data):
-        """"Обновление рецепта."""
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        RecipeIngredient.objects.filter(recipe=recipe).delete()
-        recipe.tags.set(tags)
-        self._add_ingredients(recipe, ingredients)
-        return super().update(recipe, validated_data)
+        """
+        Обновление рецепта. Текущие ингредиенты и теги берутся
+        из загруженных вьюсетом заранее, в БД пишется только разница.
+        """
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        features_changed = False
+        if tags is not None:
+            features_changed = self._update_tags(recipe, tags)
+        if ingredients is not None:
+            old_amounts = {
+                item.ingredient_id: item.amount
+                for item in recipe.recipeingredient_set.all()
+            }
+            new_amounts = {
+                ingredient['ingredient_id']: ingredient['amount']
+                for ingredient in ingredients
+            }
+            if self._update_ingredients(recipe, old_amounts, new_amounts):
+                features_changed = True
+                record_pantry_change(recipe.id)
+            change_recipe_amounts(recipe, old_amounts, new_amounts)
+        if features_changed:
+            # Похожие рецепты считаются по набору ингредиентов и тегов.
+            refresh_similar(recipe.id)
+        old_image = recipe.image.name
+        recipe = super().update(recipe, validated_data)
+        if 'image' in validated_data:
+            schedule_derivatives(recipe, old_image)
+        return recipe
 
     def to_representation(self, recipe):
         """
         Отображает новый или обновленный рецепт
         через полный сериализатор RecipeSerializer.
+        Теги и ингредиенты загружаются двумя запросами,
+        а не отдельным запросом на каждый ингредиент.
         """
+        prefetch_related_objects(
+            [recipe],
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
         context = {'request': self.context.get('request')}
         return RecipeSerializer(recipe, context=context).data
 
@@ -230,13 +374,9 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 class SubscriptionsSerializer(CustomUserSerializer):
     """Сериализатор для работы с подписками."""
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
 
     class Meta(CustomUserSerializer.Meta):
-        fields = CustomUserSerializer.Meta.fields + (
-            'recipes_count',
-            'recipes'
-        )
+        fields = CustomUserSerializer.Meta.fields + ('recipes',)
         read_only_fields = (
             'email',
             'username',
@@ -245,21 +385,18 @@ class SubscriptionsSerializer(CustomUserSerializer):
         )
 
     def get_recipes(self, obj):
-        """Рецепты пользователя."""
+        """
+        Рецепты пользователя: загруженные заранее
+        (см. CustomUserViewSet.with_recipes) или все.
+        """
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
         context = {'request': request}
-        if limit:
-            recipes = obj.recipes.all()[:(int(limit))]
-        else:
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
             recipes = obj.recipes.all()
         return RecipeShortSerializer(recipes, many=True,
                                      context=context).data
 
-    def get_recipes_count(self, obj):
-        """Количество рецептов пользователя."""
-        return obj.recipes.count()
-
 
 class FollowSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Follow."""
@@ -358,3 +495,24 @@ class RecipeShoppingListSerializer(serializers.ModelSerializer):
             instance.recipe,
             context=context
         ).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Список id рецептов для массового добавления в избранное
+    или список покупок и удаления из них.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+    )
+
+    def validate_ids(self, ids):
+        """Не больше RECIPE_BATCH_LIMIT рецептов, без повторов."""
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > settings.RECIPE_BATCH_LIMIT:
+            raise ValidationError(
+                f'Не больше {settings.RECIPE_BATCH_LIMIT} рецептов '
+                f'за один запрос.'
+            )
+        return ids
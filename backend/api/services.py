@@ -1,17 +1,54 @@
-from django.db.models import F, Sum
+from itertools import islice
 
-from recipes.models import RecipeIngredient
+from asgiref.sync import sync_to_async
+
+from recipes.models import ShoppingListIngredient
+
+SHOPPING_LIST_CHUNK_SIZE = 2000
+# Сколько частей потокового ответа читается за один переход
+# в синхронный поток.
+STREAM_BATCH_SIZE = 500
 
 
 def get_ingredients(user):
     """
-    Cуммирование одинаковых ингредиентов
-    из разных рецептов для списка покупок.
+    Сводный список покупок пользователя:
+    название, единица измерения и суммарное количество.
+    """
+    return ShoppingListIngredient.objects.filter(user=user).values_list(
+        'ingredient__name', 'ingredient__unit', 'amount'
+    ).order_by('ingredient__name', 'ingredient__unit')
+
+
+def iter_ingredients(user):
+    """
+    Построчное чтение списка покупок через серверный курсор,
+    без загрузки всего списка в память.
+    """
+    return get_ingredients(user).iterator(
+        chunk_size=SHOPPING_LIST_CHUNK_SIZE
+    )
+
+
+async def aiter_batches(iterable, batch_size=STREAM_BATCH_SIZE):
+    """
+    Асинхронный итератор по синхронному для потоковых ответов
+    под ASGI: части читаются пачками в потоке запроса (с его
+    соединением с БД) и отдаются по мере чтения. Синхронный
+    итератор ASGI-обработчик Django собрал бы в память целиком.
     """
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__shopping__user=user).values(
-        name=F('ingredient__name'),
-        unit=F('ingredient__unit')
-    ).annotate(amount=Sum('amount')).values_list(
-        'ingredient__name', 'ingredient__unit', 'amount')
-    return ingredients
+    iterator = iter(iterable)
+    next_batch = sync_to_async(
+        lambda: list(islice(iterator, batch_size)), thread_sensitive=True
+    )
+    try:
+        while True:
+            batch = await next_batch()
+            if not batch:
+                return
+            for part in batch:
+                yield part
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
@@ -1,6 +1,81 @@
+import json
+import shutil
+import tempfile
+import warnings
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
 
-from django.test import Client, TestCase
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.filters import RecipeFilter
+from api.management.commands.explain_queries import (
+    FULL_SCANS,
+    find_plan_problems
+)
+from api.indexes import ingredient_index, pantry_index
+from api.middleware import (
+    LoadSheddingMiddleware,
+    QueryCollector,
+    ReplicaRoutingMiddleware,
+    get_fingerprint
+)
+from api.serializers import RecipeCreateUpdateSerializer
+from api.throttling import TokenBucketThrottle
+from recipes.counters import get_counter_drift
+from recipes.images import (
+    IMAGE_FORMATS,
+    IMAGE_SIZES,
+    get_derivative_name,
+    has_derivatives
+)
+from recipes.models import (
+    TAG_BITS,
+    FavoriteRecipe,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeShoppingList,
+    ShoppingListIngredient,
+    SimilarRecipe,
+    Tag
+)
+from recipebook.routers import PrimaryReplicaRouter, replica_reads
+from recipes.feed import get_feed_drift
+from recipes.pantry import (
+    PANTRY_VERSION_KEY,
+    get_pantry_version,
+    record_pantry_change
+)
+from recipes.services import get_recipe_amounts, get_shopping_list_drift
+from recipes.similarity import rebuild_similar
+from recipes.tag_masks import (
+    assign_tag_bits,
+    calculate_masks,
+    rebuild_tag_masks
+)
+from users.models import Follow, User
 
 # from recipes.models import Recipe
 # from users.models import User
@@ -39,3 +114,2459 @@ class RecipeBookAPITestCase(TestCase):
     #     self.assertTrue(
     #         Recipe.objects.filter(username='vasya.pupkin').exists()
     #     )
+
+
+class RecipeQueryCountTestCase(TestCase):
+    """Число запросов к БД при выводе рецептов не зависит от их количества."""
+    LIST_QUERIES = 5
+    DETAIL_QUERIES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@recipebook.ru', username='reader',
+            first_name='Читатель', last_name='Читателев', password='Qwerty123'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                email=f'author{i}@recipebook.ru', username=f'author{i}',
+                first_name='Автор', last_name=str(i), password='Qwerty123'
+            ) for i in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name='Завтрак', color='#E26C2D',
+                               slug='breakfast'),
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch'),
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {i}', unit='г')
+            for i in range(3)
+        ]
+        Follow.objects.create(user=cls.user, author=cls.authors[0])
+
+    def create_recipes(self, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                author=self.authors[i % len(self.authors)],
+                name=f'Рецепт {Recipe.objects.count()}',
+                image='recipes/images/test.png',
+                text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set(self.tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=100)
+                for ingredient in self.ingredients
+            )
+            FavoriteRecipe.objects.create(user=self.user, recipe=recipe)
+            RecipeShoppingList.objects.create(user=self.user, recipe=recipe)
+
+    def get_clients(self):
+        authorized_client = APIClient()
+        authorized_client.force_authenticate(self.user)
+        return APIClient(), authorized_client
+
+    def test_list_query_count(self):
+        """Список рецептов выводится за постоянное число запросов."""
+        for count in (1, 6):
+            self.create_recipes(count)
+            for client in self.get_clients():
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = client.get('/api/recipes/')
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_detail_query_count(self):
+        """Рецепт выводится за постоянное число запросов."""
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        for client in self.get_clients():
+            with self.assertNumQueries(self.DETAIL_QUERIES):
+                response = client.get(f'/api/recipes/{recipe.id}/')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_author_filter(self):
+        """Фильтр по автору; неизвестный автор - пустой список."""
+        self.create_recipes(3)
+        client = APIClient()
+        response = client.get(f'/api/recipes/?author={self.authors[1].id}')
+        self.assertEqual(
+            [result['author']['id'] for result in response.data['results']],
+            [self.authors[1].id],
+        )
+        response = client.get('/api/recipes/?author=100500')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_viewer_flags(self):
+        """Отметки избранного, покупок и подписки берутся из аннотаций."""
+        self.create_recipes(3)
+        guest_client, authorized_client = self.get_clients()
+        for result in authorized_client.get('/api/recipes/').data['results']:
+            self.assertTrue(result['is_favorited'])
+            self.assertTrue(result['is_in_shopping_cart'])
+            self.assertEqual(
+                result['author']['is_subscribed'],
+                result['author']['id'] == self.authors[0].id
+            )
+            self.assertEqual(len(result['tags']), len(self.tags))
+            self.assertEqual(len(result['ingredients']),
+                             len(self.ingredients))
+        for result in guest_client.get('/api/recipes/').data['results']:
+            self.assertFalse(result['is_favorited'])
+            self.assertFalse(result['is_in_shopping_cart'])
+            self.assertFalse(result['author']['is_subscribed'])
+
+
+class ShoppingCartDownloadTestCase(TestCase):
+    """Выгрузка списка покупок в разных форматах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@recipebook.ru', username='buyer',
+            first_name='Покупатель', last_name='Покупателев',
+            password='Qwerty123'
+        )
+        salt = Ingredient.objects.create(name='соль', unit='г')
+        milk = Ingredient.objects.create(name='молоко', unit='мл')
+        for i, amounts in enumerate(((5, 200), (10, 300))):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=salt,
+                                            amount=amounts[0])
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=milk,
+                                            amount=amounts[1])
+            RecipeShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.user)
+
+    def download(self, file_format=None):
+        url = '/api/recipes/download_shopping_cart/'
+        if file_format:
+            url += f'?format={file_format}'
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_formats(self):
+        """Ингредиенты суммируются и выводятся в выбранном формате."""
+        expected = {
+            None: ('txt', 'Список покупок:\n- молоко (мл) - 500'
+                          '\n- соль (г) - 15'),
+            'txt': ('txt', 'Список покупок:\n- молоко (мл) - 500'
+                           '\n- соль (г) - 15'),
+            'csv': ('csv', 'name,unit,amount\r\nмолоко,мл,500\r\n'
+                           'соль,г,15\r\n'),
+            'json': ('json', '[{"name": "молоко", "unit": "мл", '
+                             '"amount": 500},{"name": "соль", "unit": "г", '
+                             '"amount": 15}]'),
+            'md': ('md', '# Список покупок\n\n- [ ] молоко (мл) — 500\n'
+                         '- [ ] соль (г) — 15\n'),
+        }
+        for file_format, (extension, content) in expected.items():
+            with self.subTest(file_format=file_format):
+                response, body = self.download(file_format)
+                self.assertEqual(body, content)
+                self.assertEqual(
+                    response['Content-Disposition'],
+                    f'attachment; filename="shopping_list.{extension}"'
+                )
+
+    def test_unknown_format(self):
+        """Неизвестный формат не поддерживается."""
+        response = self.authorized_client.get(
+            '/api/recipes/download_shopping_cart/?format=pdf'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_anonymous(self):
+        """Аноним не может скачать список покупок."""
+        response = Client().get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class ShoppingListAggregateTestCase(TestCase):
+    """Сводный список покупок поддерживается изменениями на разницу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='cook@recipebook.ru', username='cook',
+            first_name='Повар', last_name='Поваров', password='Qwerty123'
+        )
+        cls.buyers = [
+            User.objects.create_user(
+                email=f'buyer{i}@recipebook.ru', username=f'buyer{i}',
+                first_name='Покупатель', last_name=str(i),
+                password='Qwerty123'
+            ) for i in range(2)
+        ]
+        cls.tag = Tag.objects.create(name='Ужин', color='#8775D2',
+                                     slug='dinner')
+        cls.salt, cls.milk, cls.eggs = (
+            Ingredient.objects.create(name=name, unit=unit)
+            for name, unit in (('соль', 'г'), ('молоко', 'мл'),
+                               ('яйца', 'шт'))
+        )
+
+    def setUp(self):
+        self.recipes = []
+        for i in range(2):
+            recipe = Recipe.objects.create(
+                author=self.author, name=f'Рецепт {i}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set([self.tag])
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=self.salt, amount=5)
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=self.milk, amount=200)
+            self.recipes.append(recipe)
+
+    def get_client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def get_amounts(self, user):
+        return dict(ShoppingListIngredient.objects.filter(
+            user=user
+        ).values_list('ingredient__name', 'amount'))
+
+    def test_cart_and_recipe_changes(self):
+        """Добавление, изменение и удаление рецептов в списке покупок."""
+        buyer, other_buyer = self.buyers
+        for user in self.buyers:
+            client = self.get_client(user)
+            for recipe in self.recipes:
+                response = client.post(
+                    f'/api/recipes/{recipe.id}/shopping_cart/'
+                )
+                self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(self.get_amounts(buyer),
+                         {'соль': 10, 'молоко': 400})
+
+        response = self.get_client(self.author).patch(
+            f'/api/recipes/{self.recipes[0].id}/',
+            {'tags': [self.tag.id], 'ingredients': [
+                {'id': self.salt.id, 'amount': 7},
+                {'id': self.eggs.id, 'amount': 2},
+            ]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for user in self.buyers:
+            self.assertEqual(self.get_amounts(user),
+                             {'соль': 12, 'молоко': 200, 'яйца': 2})
+
+        response = self.get_client(buyer).delete(
+            f'/api/recipes/{self.recipes[1].id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(self.get_amounts(buyer), {'соль': 7, 'яйца': 2})
+
+        response = self.get_client(self.author).delete(
+            f'/api/recipes/{self.recipes[0].id}/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(self.get_amounts(buyer), {})
+        self.assertEqual(self.get_amounts(other_buyer),
+                         {'соль': 5, 'молоко': 200})
+        self.assertEqual(get_shopping_list_drift(), {})
+
+    def test_rebuild_command(self):
+        """Команда находит и исправляет расхождения."""
+        RecipeShoppingList.objects.create(user=self.buyers[0],
+                                          recipe=self.recipes[0])
+        ShoppingListIngredient.objects.filter(
+            ingredient=self.salt
+        ).update(amount=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_lists', '--check',
+                         stdout=StringIO())
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(self.get_amounts(self.buyers[0]),
+                         {'соль': 5, 'молоко': 200})
+
+
+class IngredientSearchTestCase(TestCase):
+    """Поиск ингредиентов по началу названия из индекса в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, unit=unit) for name, unit in (
+                ('Ёжевика', 'г'), ('ежевичный джем', 'г'), ('Яблоки', 'г'),
+                ('яблочный сок', 'мл'), ('яйца', 'шт'), ('Ячмень', 'г'),
+            )
+        )
+
+    def setUp(self):
+        ingredient_index.invalidate()
+        self.guest_client = Client()
+
+    def search(self, name):
+        response = self.guest_client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_search_without_queries(self):
+        """Поиск без учёта регистра и без запросов к БД."""
+        self.search('я')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('ЯБЛ'), ['Яблоки', 'яблочный сок'])
+            self.assertEqual(self.search('еже'),
+                             ['Ёжевика', 'ежевичный джем'])
+            self.assertEqual(self.search('ящ'), [])
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_search_limit(self):
+        """Число подсказок ограничено настройкой."""
+        self.assertEqual(self.search('я'), ['Яблоки', 'яблочный сок'])
+
+    def test_rebuild_on_change(self):
+        """Индекс перестраивается после изменения ингредиентов."""
+        self.assertEqual(self.search('яйц'), ['яйца'])
+        Ingredient.objects.create(name='Яйцо перепелиное', unit='шт')
+        Ingredient.objects.get(name='яйца').delete()
+        self.assertEqual(self.search('яйц'), ['Яйцо перепелиное'])
+
+
+class RecipeSearchTestCase(TestCase):
+    """Поиск рецептов по названию и описанию."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='chef@recipebook.ru', username='chef',
+            first_name='Шеф', last_name='Шефов', password='Qwerty123'
+        )
+        for name, text in (
+            ('Блины на молоке', 'Тонкие блины к чаю'),
+            ('Сырники', 'Подавать с блинами не нужно'),
+            ('Борщ', 'Свёкла, капуста и картофель'),
+        ):
+            Recipe.objects.create(
+                author=cls.author, name=name, text=text,
+                image='recipes/images/test.png', cooking_time=30,
+            )
+
+    def search(self, value):
+        response = Client().get('/api/recipes/', {'search': value})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def test_ranked_search(self):
+        """Совпадение в названии выше совпадения в описании."""
+        self.assertEqual(self.search('блин'), ['Блины на молоке', 'Сырники'])
+        self.assertEqual(self.search('КАПУСТА'), ['Борщ'])
+        self.assertEqual(self.search('пицца'), [])
+
+    def test_index_follows_changes(self):
+        """Поисковый индекс обновляется при сохранении и удалении."""
+        recipe = Recipe.objects.get(name='Борщ')
+        recipe.text = 'Щавель и яйцо'
+        recipe.save()
+        self.assertEqual(self.search('капуста'), [])
+        self.assertEqual(self.search('щавель'), ['Борщ'])
+        recipe.delete()
+        self.assertEqual(self.search('щавель'), [])
+
+
+class CursorPaginationTestCase(TestCase):
+    """Курсорная пагинация ленты рецептов и подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='scroller@recipebook.ru', username='scroller',
+            first_name='Читатель', last_name='Ленты', password='Qwerty123'
+        )
+        for i in range(8):
+            author = User.objects.create_user(
+                email=f'writer{i}@recipebook.ru', username=f'writer{i}',
+                first_name='Автор', last_name=str(i), password='Qwerty123'
+            )
+            Follow.objects.create(user=cls.user, author=author)
+            for j in range(2):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {i}-{j}',
+                    image='recipes/images/test.png', text='Описание',
+                    cooking_time=10,
+                )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('count', response.data)
+            names += [
+                item.get('name') or item.get('username')
+                for item in response.data['results']
+            ]
+            url = response.data['next']
+        return names
+
+    def test_recipe_cursor(self):
+        """Курсор проходит все рецепты в порядке (-pub_date, id)."""
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', 'id'
+        ).values_list('name', flat=True))
+        self.assertEqual(self.collect('/api/recipes/?cursor='), expected)
+
+    def test_recipe_cursor_without_count(self):
+        """Курсорный режим не считает COUNT(*), постраничный - считает."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/?cursor=')
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        ))
+        response = self.client.get('/api/recipes/?page=2')
+        self.assertEqual(response.data['count'], Recipe.objects.count())
+
+    def test_ranked_params_without_cursor(self):
+        """Курсор не смешивается с ранжированием поиска и продуктов."""
+        for query in ('search=рецепт', 'have=1'):
+            response = self.client.get(f'/api/recipes/?cursor=&{query}')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+            self.assertIn('cursor', response.data)
+            response = self.client.get(f'/api/recipes/?{query}')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_subscriptions_cursor(self):
+        """Курсор проходит все подписки."""
+        expected = [f'writer{i}' for i in range(8)]
+        self.assertEqual(
+            self.collect('/api/users/subscriptions/?cursor='), expected
+        )
+
+
+class RecipeImageDerivativesTestCase(TestCase):
+    """Уменьшенные копии изображений рецептов."""
+    IMAGE = (
+        'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABie'
+        'ywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAA'
+        'CklEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg=='
+    )
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            email='photo@recipebook.ru', username='photo',
+            first_name='Фото', last_name='Графов', password='Qwerty123'
+        )
+        self.tag = Tag.objects.create(name='Ужин', color='#8775D2',
+                                      slug='dinner')
+        self.ingredient = Ingredient.objects.create(name='соль', unit='г')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                'tags': [self.tag.id], 'image': self.IMAGE, 'name': 'Фото',
+                'text': 'Описание', 'cooking_time': 1,
+            }, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return Recipe.objects.get(id=response.data['id'])
+
+    def test_derivatives_on_upload(self):
+        """После сохранения создаются копии всех размеров и форматов."""
+        recipe = self.create_recipe()
+        self.assertEqual(recipe.image_derivatives, recipe.image.name)
+        # Наличие копий берётся из рецепта, без запросов к хранилищу.
+        with patch.object(FileSystemStorage, 'exists',
+                          side_effect=AssertionError):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        images = response.data['images']
+        self.assertEqual(set(images), set(IMAGE_SIZES))
+        image = Recipe.objects.get().image
+        for size in IMAGE_SIZES:
+            self.assertEqual(set(images[size]), set(IMAGE_FORMATS))
+            for extension in IMAGE_FORMATS:
+                name = get_derivative_name(image.name, size, extension)
+                self.assertTrue(image.storage.exists(name))
+                self.assertTrue(images[size][extension].endswith(name))
+
+    def test_original_fallback(self):
+        """Без копий (не созданы или ошибка) ссылки ведут на оригинал."""
+        with patch('recipes.images.create_derivatives',
+                   side_effect=OSError('Повреждённый файл')):
+            recipe = self.create_recipe()
+        self.assertFalse(has_derivatives(recipe.image))
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        for formats in response.data['images'].values():
+            for url in formats.values():
+                self.assertTrue(url.endswith(recipe.image.url))
+
+    def test_replaced_image(self):
+        """Копии прежнего изображения удаляются при замене."""
+        recipe = self.create_recipe()
+        old_name = recipe.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/', {'image': self.IMAGE},
+                format='json',
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.image.name, old_name)
+        self.assertEqual(recipe.image_derivatives, recipe.image.name)
+        for size in IMAGE_SIZES:
+            for extension in IMAGE_FORMATS:
+                self.assertFalse(recipe.image.storage.exists(
+                    get_derivative_name(old_name, size, extension)
+                ))
+                self.assertTrue(recipe.image.storage.exists(
+                    get_derivative_name(recipe.image.name, size, extension)
+                ))
+
+    def test_backfill_command(self):
+        """Команда создаёт копии для уже загруженных изображений."""
+        recipe = Recipe.objects.create(
+            author=self.user, name='Старый рецепт', text='Описание',
+            image='recipes/images/old.png', cooking_time=1,
+        )
+        self.assertFalse(has_derivatives(recipe.image))
+        image = Image.new('RGB', (1600, 900), 'red')
+        buffer = BytesIO()
+        image.save(buffer, 'PNG')
+        recipe.image.storage.save(recipe.image.name,
+                                  ContentFile(buffer.getvalue()))
+        call_command('create_image_derivatives', stdout=StringIO())
+        self.assertTrue(has_derivatives(recipe.image))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_derivatives, recipe.image.name)
+        with recipe.image.storage.open(get_derivative_name(
+            recipe.image.name, 'card', 'webp'
+        )) as file:
+            self.assertEqual(Image.open(file).size, (600, 338))
+
+
+class CatalogConditionalGetTestCase(TestCase):
+    """Условные GET-запросы к тегам и ингредиентам."""
+    URLS = ('/api/tags/', '/api/ingredients/', '/api/ingredients/?name=тест')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Десерт', color='#8775D2',
+                                     slug='dessert')
+        Ingredient.objects.create(name='тестовая соль', unit='г')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_not_modified_without_queries(self):
+        """Повторный запрос с If-None-Match - 304 без запросов к БД."""
+        for url in self.URLS:
+            response = self.guest_client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('Last-Modified', response)
+            etag = response['ETag']
+            self.assertFalse(etag.startswith('W/'))
+            with self.assertNumQueries(0):
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+            self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_tag_fields(self):
+        """Служебный бит маски тега не отдаётся."""
+        response = self.guest_client.get('/api/tags/')
+        self.assertEqual(response.json(), [{
+            'id': self.tag.id, 'name': 'Десерт', 'color': '#8775D2',
+            'slug': 'dessert',
+        }])
+
+    def test_version_bumped_on_change(self):
+        """Изменение справочника меняет ETag."""
+        etag = self.guest_client.get('/api/tags/')['ETag']
+        self.tag.name = 'Сладкое'
+        self.tag.save()
+        response = self.guest_client.get('/api/tags/',
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        call_command('import', stdout=StringIO())
+        response = self.guest_client.get('/api/tags/',
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class CatalogImportTestCase(TestCase):
+    """Импорт справочников из файлов."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        path = f'{self.tmp_dir}/{name}'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_import_is_idempotent(self):
+        """Повторная загрузка не создаёт дубликатов."""
+        path = self.write_file(
+            'ingredients.json',
+            '[{"name": "импорт мука", "measurement_unit": "г"},'
+            ' {"name": "импорт сахар", "measurement_unit": "г"},'
+            ' {"name": "импорт мука", "measurement_unit": "г"}]'
+        )
+        for _ in range(2):
+            call_command('import', 'ingredients', '--file', path,
+                         '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(
+            Ingredient.objects.filter(name__startswith='импорт').count(), 2
+        )
+
+    def test_tags_updated_from_ndjson(self):
+        """Теги обновляются по slug."""
+        Tag.objects.create(name='Старое', color='#000000', slug='import')
+        path = self.write_file(
+            'tags.jsonl',
+            '{"name": "Новое", "color": "#ffffff", "slug": "import"}\n'
+        )
+        call_command('import', 'tags', '--file', path, stdout=StringIO())
+        tag = Tag.objects.get(slug='import')
+        self.assertEqual((tag.name, tag.color), ('Новое', '#ffffff'))
+
+    def test_last_duplicate_wins(self):
+        """Из строк с одним ключом в пачке записывается последняя."""
+        path = self.write_file(
+            'tags.csv',
+            'name,color,slug\n'
+            'Первое,#000000,import\n'
+            'Второе,#ffffff,import\n'
+        )
+        call_command('import', 'tags', '--file', path, stdout=StringIO())
+        tag = Tag.objects.get(slug='import')
+        self.assertEqual((tag.name, tag.color), ('Второе', '#ffffff'))
+
+    def test_dry_run(self):
+        """--dry-run показывает изменения и ничего не пишет."""
+        Tag.objects.create(name='Старое', color='#000000', slug='import')
+        path = self.write_file(
+            'tags.csv',
+            'name,color,slug\n'
+            'Новое,#ffffff,import\n'
+            'Другое,#ffffff,import-new\n'
+        )
+        out = StringIO()
+        call_command('import', 'tags', '--file', path, '--dry-run',
+                     stdout=out)
+        self.assertIn('новых 1, изменённых 1, без изменений 0',
+                      out.getvalue())
+        self.assertFalse(Tag.objects.filter(slug='import-new').exists())
+        self.assertEqual(Tag.objects.get(slug='import').name, 'Старое')
+
+    def test_invalid_arguments(self):
+        """Неизвестный справочник и --file для нескольких - ошибка."""
+        with self.assertRaises(CommandError):
+            call_command('import', 'recipes', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('import', '--file', 'x.csv', stdout=StringIO())
+
+
+class SubscriptionsQueryCountTestCase(TestCase):
+    """Подписки с рецептами авторов за постоянное число запросов."""
+    QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='fan@recipebook.ru', username='fan',
+            first_name='Подписчик', last_name='Подписчиков',
+            password='Qwerty123'
+        )
+        cls.authors = []
+        for i in range(6):
+            author = User.objects.create_user(
+                email=f'star{i}@recipebook.ru', username=f'star{i}',
+                first_name='Автор', last_name=str(i), password='Qwerty123'
+            )
+            Follow.objects.create(user=cls.user, author=author)
+            for j in range(i):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {i}-{j}',
+                    image='recipes/images/test.png', text='Описание',
+                    cooking_time=10,
+                )
+            cls.authors.append(author)
+        cls.new_author = User.objects.create_user(
+            email='newstar@recipebook.ru', username='newstar',
+            first_name='Новый', last_name='Автор', password='Qwerty123'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit(self):
+        """Не больше recipes_limit последних рецептов каждого автора."""
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for result in response.data['results']:
+            author = User.objects.get(id=result['id'])
+            expected = list(author.recipes.values_list(
+                'name', flat=True
+            )[:2])
+            self.assertEqual(
+                [recipe['name'] for recipe in result['recipes']], expected
+            )
+            self.assertEqual(result['recipes_count'],
+                             author.recipes.count())
+            self.assertTrue(result['is_subscribed'])
+
+    def test_without_limit(self):
+        """Без recipes_limit выводятся все рецепты."""
+        with self.assertNumQueries(self.QUERIES):
+            response = self.client.get('/api/users/subscriptions/')
+        for result in response.data['results']:
+            self.assertEqual(len(result['recipes']), result['recipes_count'])
+
+    def test_invalid_limit(self):
+        """Некорректный recipes_limit - ошибка 400."""
+        for limit in ('abc', '-1'):
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={limit}'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.client.post(
+            f'/api/users/{self.new_author.id}/subscribe/?recipes_limit=x'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(Follow.objects.filter(
+            user=self.user, author=self.new_author
+        ).exists())
+
+    def test_subscribe_response(self):
+        """Ответ на подписку содержит рецепты автора."""
+        Recipe.objects.create(
+            author=self.new_author, name='Новый рецепт',
+            image='recipes/images/test.png', text='Описание',
+            cooking_time=10,
+        )
+        response = self.client.post(
+            f'/api/users/{self.new_author.id}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(response.data['recipes'][0]['name'], 'Новый рецепт')
+        self.assertTrue(response.data['is_subscribed'])
+
+
+class SeedBenchmarkTestCase(TestCase):
+    """Генерация тестовых данных и бенчмарк API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'тестовый продукт {number}', unit='г')
+            for number in range(20)
+        )
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def seed(self, *args):
+        call_command('seed', '--users', '5', '--recipes', '30',
+                     '--follows', '2', '--favorites', '3', '--cart', '2',
+                     *args, stdout=StringIO())
+        return list(Recipe.objects.order_by('name').values_list(
+            'author__username', 'name', 'cooking_time'
+        ))
+
+    def test_seed_is_reproducible(self):
+        """Одинаковый --seed даёт одинаковые данные."""
+        recipes = self.seed()
+        self.assertEqual(len(recipes), 30)
+        self.assertEqual(User.objects.filter(
+            username__startswith='seed').count(), 5)
+        self.assertEqual(Follow.objects.count(), 10)
+        self.assertEqual(FavoriteRecipe.objects.count(), 15)
+        self.assertFalse(get_shopping_list_drift())
+        self.assertFalse(get_counter_drift())
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.assertEqual(self.seed('--clear'), recipes)
+        self.assertNotEqual(self.seed('--clear', '--seed', '2'), recipes)
+
+    def test_benchmark(self):
+        """Бенчмарк сохраняет результаты по всем эндпоинтам."""
+        self.seed()
+        output = f'{self.tmp_dir}/benchmark.json'
+        call_command('benchmark', '--requests', '2', '--warmup', '0',
+                     '--output', output, stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertIn('recipes', report['endpoints'])
+        for name, result in report['endpoints'].items():
+            self.assertEqual(result['status'], HTTPStatus.OK, name)
+            self.assertGreater(result['bytes'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertEqual(result['writes'] > 0,
+                             name.startswith('recipe_update'), name)
+        self.assertFalse(get_counter_drift())
+        out = StringIO()
+        call_command('benchmark', 'me', '--requests', '1',
+                     '--compare', output, stdout=out)
+        self.assertIn('p95', out.getvalue())
+        call_command('benchmark', 'recipes', 'subscriptions', '--requests',
+                     '2', '--interface', 'asgi', '--output', output,
+                     stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(report['interface'], 'asgi')
+        for name, result in report['endpoints'].items():
+            self.assertEqual(result['status'], HTTPStatus.OK, name)
+            self.assertGreater(result['queries'], 0)
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'unknown', stdout=StringIO())
+
+
+class QueryInstrumentationTestCase(TestCase):
+    """Замеры запросов к БД и заголовок Server-Timing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(name=f'Метка {number}', color=f'#00000{number}',
+                               slug=f'label-{number}')
+            for number in range(3)
+        ]
+
+    def test_server_timing_header(self):
+        """В ответе есть фазы db, serialize, render и total."""
+        response = self.client.get('/api/tags/')
+        phases = [
+            phase.split(';')[0]
+            for phase in response['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(phases, ['db', 'serialize', 'render', 'total'])
+        self.assertIn('queries"', response['Server-Timing'])
+
+    @override_settings(QUERY_INSTRUMENTATION=False)
+    def test_disabled(self):
+        """Замеры можно отключить."""
+        self.assertNotIn('Server-Timing', self.client.get('/api/tags/'))
+
+    def test_fingerprint(self):
+        """Отпечаток не зависит от значений и длины списка IN."""
+        self.assertEqual(
+            get_fingerprint(
+                "SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a'"
+            ),
+            get_fingerprint(
+                "SELECT *  FROM t WHERE id IN (%s) AND name = 'it''s'"
+            ),
+        )
+
+    def test_duplicates(self):
+        """Одинаковые запросы с разными параметрами - признак N+1."""
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            for tag in self.tags:
+                Tag.objects.get(id=tag.id)
+            list(Ingredient.objects.all())
+        self.assertEqual(collector.count, 4)
+        duplicates = collector.get_duplicates(3)
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(list(duplicates.values())[0][0], 3)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logged(self):
+        """Медленный запрос пишется в лог в формате JSON."""
+        with self.assertLogs('api.performance', 'WARNING') as logs:
+            self.client.get(f'/api/tags/{self.tags[0].id}/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['event'], 'slow_request')
+        self.assertEqual(record['view'], 'api:tags-detail')
+        self.assertEqual(record['status'], HTTPStatus.OK)
+        self.assertIn('db', record['timings_ms'])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'],
+                   ROOT_URLCONF='recipebook.asgi_urls')
+class AsyncReadViewsTestCase(TestCase):
+    """Асинхронное чтение отвечает так же, как синхронные вьюсеты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@recipebook.ru', username='reader',
+            first_name='Читатель', last_name='Читателев',
+            password='Qwerty123'
+        )
+        cls.author = User.objects.create_user(
+            email='writer@recipebook.ru', username='writer',
+            first_name='Автор', last_name='Авторов', password='Qwerty123'
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tag = Tag.objects.create(name='Ужин', color='#A1B2C3',
+                                     slug='dinner')
+        cls.ingredient = Ingredient.objects.create(name='тестовый рис',
+                                                   unit='г')
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Плов {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=30,
+            )
+            recipe.tags.add(cls.tag)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=200
+            )
+        cls.recipe = recipe
+
+    def setUp(self):
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+
+    @async_to_sync
+    async def request(self, method, url, headers=None):
+        return await getattr(self.async_client, method)(url, headers=headers)
+
+    def get(self, url, headers=None):
+        """Ответы асинхронного и синхронного представлений."""
+        headers = self.headers if headers is None else headers
+        response = self.request('get', url, headers)
+        with override_settings(ROOT_URLCONF='recipebook.urls'):
+            sync_response = Client(headers=headers).get(url)
+        return response, sync_response
+
+    def test_same_responses(self):
+        """Тело и код ответа совпадают с синхронными вьюсетами."""
+        for url in (
+            '/api/recipes/', f'/api/recipes/?tags={self.tag.slug}',
+            f'/api/recipes/?author={self.author.id}&page=2&limit=2',
+            f'/api/recipes/{self.recipe.id}/', '/api/recipes/0/',
+            '/api/recipes/?page=100', '/api/tags/',
+            f'/api/tags/{self.tag.id}/', '/api/ingredients/?name=тест',
+            f'/api/ingredients/{self.ingredient.id}/',
+            '/api/users/subscriptions/?recipes_limit=1',
+            '/api/users/subscriptions/?recipes_limit=x',
+        ):
+            with self.subTest(url=url):
+                response, sync_response = self.get(url)
+                self.assertEqual(response.status_code,
+                                 sync_response.status_code)
+                self.assertEqual(response.content, sync_response.content)
+
+    def test_authentication_errors(self):
+        """Ошибки аутентификации - как у DRF, с WWW-Authenticate."""
+        for url, headers in (
+            ('/api/users/subscriptions/', {}),
+            ('/api/recipes/', {'Authorization': 'Token invalid'}),
+        ):
+            with self.subTest(url=url):
+                response, sync_response = self.get(url, headers)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.UNAUTHORIZED)
+                self.assertEqual(response.content, sync_response.content)
+                self.assertEqual(response['WWW-Authenticate'],
+                                 sync_response['WWW-Authenticate'])
+
+    def test_catalog_not_modified(self):
+        """Асинхронные справочники отвечают 304 без запросов к БД."""
+        response = self.request('get', '/api/tags/')
+        with self.assertNumQueries(0):
+            response = self.request(
+                'get', '/api/tags/', {'If-None-Match': response['ETag']}
+            )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_sync_fallback(self):
+        """Запись и курсорная пагинация обслуживают синхронные вьюсеты."""
+        response, sync_response = self.get('/api/recipes/?cursor=')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content, sync_response.content)
+        response = self.request(
+            'post', f'/api/recipes/{self.recipe.id}/favorite/', self.headers
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertTrue(FavoriteRecipe.objects.filter(
+            user=self.user, recipe=self.recipe
+        ).exists())
+        response = self.request(
+            'get', '/api/recipes/download_shopping_cart/', self.headers
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.resolver_match.view_name,
+                         'api:recipes-download-shopping-cart')
+
+    def test_streaming_export(self):
+        """Список покупок под ASGI отдаётся потоком, без буферизации."""
+        RecipeShoppingList.objects.create(user=self.user, recipe=self.recipe)
+        url = '/api/recipes/download_shopping_cart/'
+
+        @async_to_sync
+        async def download():
+            response = await self.async_client.get(url, headers=self.headers)
+            self.assertTrue(response.is_async)
+            return b''.join([part async for part in response])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            content = download()
+        with override_settings(ROOT_URLCONF='recipebook.urls'):
+            sync_response = Client(headers=self.headers).get(url)
+        self.assertEqual(content, b''.join(sync_response.streaming_content))
+        self.assertIn('тестовый рис'.encode(), content)
+
+
+class CountersTestCase(TestCase):
+    """Счётчики избранного, списков покупок, рецептов и подписчиков."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='counter@recipebook.ru', username='counter',
+            first_name='Счётчик', last_name='Счётчиков', password='Qwerty123'
+        )
+        cls.author = User.objects.create_user(
+            email='counted@recipebook.ru', username='counted',
+            first_name='Автор', last_name='Авторов', password='Qwerty123'
+        )
+        cls.ingredient = Ingredient.objects.create(name='тестовая мука',
+                                                   unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = self.create_recipe('Блины')
+
+    def create_recipe(self, name):
+        recipe = Recipe.objects.create(
+            author=self.author, name=name, image='recipes/images/test.png',
+            text='Описание', cooking_time=20,
+        )
+        RecipeIngredient.objects.create(recipe=recipe,
+                                        ingredient=self.ingredient,
+                                        amount=300)
+        return recipe
+
+    def assertCounters(self, obj, **counters):
+        obj.refresh_from_db()
+        for field, value in counters.items():
+            self.assertEqual(getattr(obj, field), value, field)
+
+    def test_favorite_and_cart(self):
+        """Добавление и удаление рецепта меняют счётчики и ответ API."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        response = self.client.post(f'{url}favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.client.post(f'{url}shopping_cart/')
+        self.assertCounters(self.recipe, favorites_count=1, in_carts_count=1)
+        response = self.client.get(url)
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.assertEqual(response.data['in_carts_count'], 1)
+        self.client.delete(f'{url}favorite/')
+        self.client.delete(f'{url}shopping_cart/')
+        self.assertCounters(self.recipe, favorites_count=0, in_carts_count=0)
+
+    def test_recipes_and_followers(self):
+        """Рецепты и подписки меняют счётчики автора."""
+        self.assertCounters(self.author, recipes_count=1)
+        response = self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertEqual(response.data['followers_count'], 1)
+        self.create_recipe('Оладьи').delete()
+        self.recipe.delete()
+        self.assertCounters(self.author, recipes_count=0, followers_count=1)
+        self.user.delete()
+        self.assertCounters(self.author, followers_count=0)
+
+    def test_recount(self):
+        """recount находит и исправляет расхождения."""
+        FavoriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.update(favorites_count=5, in_carts_count=2)
+        User.objects.filter(id=self.author.id).update(recipes_count=0)
+        with self.assertRaises(CommandError):
+            call_command('recount', '--check', stdout=StringIO())
+        call_command('recount', stdout=StringIO())
+        self.assertCounters(self.recipe, favorites_count=1, in_carts_count=0)
+        self.assertCounters(self.author, recipes_count=1)
+        call_command('recount', '--check', stdout=StringIO())
+
+
+class AdminQueryCountTestCase(TestCase):
+    """Число запросов страниц админки не зависит от объёма данных."""
+    CHANGELISTS = (
+        'recipes/tag', 'recipes/ingredient', 'recipes/recipe',
+        'recipes/favoriterecipe', 'recipes/recipeshoppinglist',
+        'recipes/recipeingredient', 'recipes/recipetag',
+        'users/user', 'users/follow',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@recipebook.ru', username='admin',
+            first_name='Админ', last_name='Админов', password='Qwerty123'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}',
+                               color=f'#1{number}1{number}1{number}',
+                               slug=f'admin-tag-{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'тестовый продукт {number}', unit='г')
+            for number in range(30)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.number = 0
+
+    def add_data(self, count):
+        """Авторы с рецептами, подписками, избранным и покупками."""
+        for _ in range(count):
+            self.number += 1
+            author = User.objects.create_user(
+                email=f'cook{self.number}@recipebook.ru',
+                username=f'cook{self.number}', first_name='Повар',
+                last_name=str(self.number), password='Qwerty123'
+            )
+            Follow.objects.create(user=self.admin, author=author)
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт админки {self.number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10,
+            )
+            recipe.tags.set(self.tags[:2])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=10)
+                for ingredient in self.ingredients[:3]
+            )
+            FavoriteRecipe.objects.create(user=author, recipe=recipe)
+            RecipeShoppingList.objects.create(user=author, recipe=recipe)
+        return recipe
+
+    def get_query_counts(self, recipe):
+        counts = {}
+        for changelist in self.CHANGELISTS:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/admin/{changelist}/')
+            self.assertEqual(response.status_code, HTTPStatus.OK, changelist)
+            counts[changelist] = len(queries)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/admin/recipes/recipe/{recipe.id}/change/'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        counts['recipe_change'] = len(queries)
+        return counts
+
+    def test_changelists(self):
+        """Страницы списков и рецепта - постоянное число запросов."""
+        # Первый запрос загружает кеши типов содержимого и прав.
+        self.get_query_counts(self.add_data(1))
+        counts = self.get_query_counts(self.add_data(2))
+        self.assertEqual(self.get_query_counts(self.add_data(8)), counts)
+        for page, count in counts.items():
+            self.assertLessEqual(count, 12, page)
+
+    def test_ingredient_autocomplete(self):
+        """В форме рецепта нет списка всех ингредиентов."""
+        recipe = self.add_data(1)
+        response = self.client.get(
+            f'/admin/recipes/recipe/{recipe.id}/change/'
+        )
+        self.assertContains(response, self.ingredients[0].name)
+        self.assertNotContains(response, self.ingredients[-1].name)
+        response = self.client.get(
+            '/admin/autocomplete/', {
+                'app_label': 'recipes', 'model_name': 'recipeingredient',
+                'field_name': 'ingredient', 'term': '"тестовый продукт 2"',
+            }
+        )
+        self.assertEqual(
+            len(response.json()['results']),
+            Ingredient.objects.filter(
+                name__startswith='тестовый продукт 2'
+            ).count(),
+        )
+
+    def test_ingredient_rows_sync(self):
+        """Изменения ингредиентов в админке попадают в списки покупок."""
+        recipe = self.add_data(1)
+        RecipeShoppingList.objects.create(user=self.admin, recipe=recipe)
+        rows = list(recipe.recipeingredient_set.order_by('id'))
+        response = self.client.post(
+            f'/admin/recipes/recipe/{recipe.id}/change/', {
+                'author': recipe.author_id, 'name': recipe.name,
+                'text': recipe.text, 'cooking_time': recipe.cooking_time,
+                'tags': [tag.id for tag in self.tags[:2]],
+                'recipeingredient_set-TOTAL_FORMS': 4,
+                'recipeingredient_set-INITIAL_FORMS': 3,
+                'recipeingredient_set-0-id': rows[0].id,
+                'recipeingredient_set-0-recipe': recipe.id,
+                'recipeingredient_set-0-ingredient': rows[0].ingredient_id,
+                'recipeingredient_set-0-amount': 25,
+                'recipeingredient_set-1-id': rows[1].id,
+                'recipeingredient_set-1-recipe': recipe.id,
+                'recipeingredient_set-1-ingredient': rows[1].ingredient_id,
+                'recipeingredient_set-1-amount': 10,
+                'recipeingredient_set-1-DELETE': 'on',
+                'recipeingredient_set-2-id': rows[2].id,
+                'recipeingredient_set-2-recipe': recipe.id,
+                'recipeingredient_set-2-ingredient': rows[2].ingredient_id,
+                'recipeingredient_set-2-amount': 10,
+                'recipeingredient_set-3-recipe': recipe.id,
+                'recipeingredient_set-3-ingredient': self.ingredients[5].id,
+                'recipeingredient_set-3-amount': 7,
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(len(get_recipe_amounts(recipe)), 3)
+        self.assertFalse(get_shopping_list_drift())
+        response = self.client.post(
+            f'/admin/recipes/recipeingredient/{rows[2].id}/change/', {
+                'recipe': recipe.id, 'ingredient': self.ingredients[6].id,
+                'amount': 40,
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertFalse(get_shopping_list_drift())
+        response = self.client.post(
+            f'/admin/recipes/recipeingredient/{rows[0].id}/delete/',
+            {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertFalse(get_shopping_list_drift())
+        response = self.client.post('/admin/recipes/recipeingredient/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(recipe.recipeingredient_set.values_list(
+                'id', flat=True
+            )),
+        })
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertFalse(recipe.recipeingredient_set.exists())
+        self.assertFalse(get_shopping_list_drift())
+
+    def test_ingredient_rows_features(self):
+        """
+        Изменения связей с ингредиентами в админке обновляют похожие
+        рецепты и индекс поиска по продуктам.
+        """
+        recipe = self.add_data(1)
+        rows = list(recipe.recipeingredient_set.order_by('id'))
+        requests = (
+            (f'/admin/recipes/recipeingredient/{rows[0].id}/change/', {
+                'recipe': recipe.id, 'ingredient': self.ingredients[6].id,
+                'amount': 40,
+            }),
+            (f'/admin/recipes/recipeingredient/{rows[1].id}/delete/',
+             {'post': 'yes'}),
+            ('/admin/recipes/recipeingredient/', {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': [rows[2].id],
+            }),
+        )
+        for url, data in requests:
+            with self.subTest(url=url), \
+                    patch('recipes.admin.refresh_similar') as similar, \
+                    patch('recipes.admin.record_pantry_change') as pantry:
+                response = self.client.post(url, data)
+                self.assertEqual(response.status_code, HTTPStatus.FOUND)
+                similar.assert_called_once_with(recipe.id)
+                pantry.assert_called_once_with(recipe.id)
+
+    def test_tag_rows_features(self):
+        """
+        Изменения связей с тегами в админке обновляют маски тегов
+        и похожие рецепты.
+        """
+        recipe = self.add_data(1)
+        rows = list(recipe.recipetag_set.order_by('id'))
+        requests = (
+            (f'/admin/recipes/recipetag/{rows[0].id}/change/', {
+                'recipe': recipe.id, 'tag': self.tags[2].id,
+            }),
+            (f'/admin/recipes/recipetag/{rows[1].id}/delete/',
+             {'post': 'yes'}),
+            ('/admin/recipes/recipetag/', {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': [rows[0].id],
+            }),
+        )
+        for url, data in requests:
+            with self.subTest(url=url), \
+                    patch('recipes.admin.refresh_similar') as similar:
+                response = self.client.post(url, data)
+                self.assertEqual(response.status_code, HTTPStatus.FOUND)
+                similar.assert_called_once_with(recipe.id)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_mask, 0)
+
+    def test_estimated_count(self):
+        """Без фильтров число строк берётся из статистики БД."""
+        self.add_data(1)
+        with override_settings(ADMIN_ESTIMATED_COUNT_FROM=1000), patch(
+            'recipes.paginators.get_estimated_count', return_value=5000
+        ):
+            response = self.client.get('/admin/recipes/recipe/')
+            self.assertEqual(response.context['cl'].result_count, 5000)
+            response = self.client.get('/admin/recipes/recipe/?q=админки')
+            self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class RecipeBatchTestCase(TestCase):
+    """Массовое добавление рецептов в избранное и список покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='planner@recipebook.ru', username='planner',
+            first_name='Планировщик', last_name='Меню', password='Qwerty123'
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'тестовая крупа {number}', unit='г')
+            for number in range(3)
+        )
+        cls.recipes = []
+        for number in range(5):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Обед на неделю {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=30,
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=10 * (number + 1))
+                for ingredient in ingredients[:number % 3 + 1]
+            )
+            cls.recipes.append(recipe)
+        cls.ids = [recipe.id for recipe in cls.recipes]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return {
+            result['id']: result['status']
+            for result in response.data['results']
+        }
+
+    def test_shopping_cart(self):
+        """Добавление и удаление с результатом по каждому id."""
+        url = '/api/recipes/shopping_cart/'
+        RecipeShoppingList.objects.create(user=self.user,
+                                          recipe=self.recipes[0])
+        with CaptureQueriesContext(connection) as small:
+            self.batch('post', url, self.ids[1:2])
+        self.client.delete(url, {'ids': self.ids[1:2]}, format='json')
+        with CaptureQueriesContext(connection) as large:
+            statuses = self.batch('post', url, self.ids + [10 ** 9])
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(statuses, {
+            self.ids[0]: 'exists',
+            **{recipe_id: 'added' for recipe_id in self.ids[1:]},
+            10 ** 9: 'not_found',
+        })
+        self.assertFalse(get_shopping_list_drift())
+        self.assertFalse(get_counter_drift())
+        statuses = self.batch('delete', url, self.ids[:3])
+        self.assertEqual(set(statuses.values()), {'removed'})
+        statuses = self.batch('delete', url, self.ids[:4])
+        self.assertEqual(statuses[self.ids[0]], 'missing')
+        self.assertEqual(statuses[self.ids[3]], 'removed')
+        self.assertEqual(
+            list(RecipeShoppingList.objects.values_list('recipe', flat=True)),
+            [self.ids[4]],
+        )
+        self.assertFalse(get_shopping_list_drift())
+        self.assertFalse(get_counter_drift())
+
+    def test_favorite(self):
+        """Избранное обновляет счётчики рецептов."""
+        statuses = self.batch('post', '/api/recipes/favorite/', self.ids)
+        self.assertEqual(set(statuses.values()), {'added'})
+        self.assertEqual(
+            set(Recipe.objects.values_list('favorites_count', flat=True)),
+            {1},
+        )
+        self.batch('delete', '/api/recipes/favorite/', self.ids)
+        self.assertFalse(FavoriteRecipe.objects.exists())
+        self.assertFalse(get_counter_drift())
+
+    def test_concurrent_add(self):
+        """Рецепт, добавленный параллельно, не учитывается дважды."""
+        raced = []
+
+        def add_concurrently(execute, sql, params, many, context):
+            # Строка появляется между проверкой и INSERT, как
+            # при параллельном запросе на добавление одного рецепта.
+            if sql.startswith('INSERT') and not raced:
+                raced.append(True)
+                RecipeShoppingList.objects.create(user=self.user,
+                                                  recipe=self.recipes[1])
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(add_concurrently):
+            statuses = self.batch('post', '/api/recipes/shopping_cart/',
+                                  self.ids[:3])
+        self.assertEqual(statuses, {
+            self.ids[0]: 'added', self.ids[1]: 'exists', self.ids[2]: 'added',
+        })
+        self.assertFalse(get_shopping_list_drift())
+        self.assertFalse(get_counter_drift())
+
+    @override_settings(RECIPE_BATCH_LIMIT=3)
+    def test_invalid(self):
+        """Пустой, слишком длинный или некорректный список - ошибка 400."""
+        for ids in ([], self.ids, ['abc'], None):
+            response = self.client.post('/api/recipes/favorite/',
+                                        {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.client.post('/api/recipes/favorite/',
+                                    {'ids': self.ids[:2] * 3}, format='json')
+        self.assertEqual(len(response.data['results']), 2)
+        response = APIClient().post('/api/recipes/favorite/',
+                                    {'ids': self.ids[:1]}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class RecipeUpdateTestCase(TestCase):
+    """Изменение рецепта записывает в БД только разницу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='editor@recipebook.ru', username='editor',
+            first_name='Редактор', last_name='Рецептов', password='Qwerty123'
+        )
+        cls.tags = [
+            Tag.objects.create(name='Ужин', color='#8775D2', slug='dinner'),
+            Tag.objects.create(name='Перекус', color='#E26C2D',
+                               slug='snack'),
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'тестовая зелень {number}', unit='г')
+            for number in range(4)
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Салат с зеленью',
+            image='recipes/images/test.png', text='Нарезать',
+            cooking_time=10,
+        )
+        cls.recipe.tags.add(cls.tags[0])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=cls.recipe, ingredient=ingredient,
+                             amount=10)
+            for ingredient in cls.ingredients[:3]
+        )
+        RecipeShoppingList.objects.create(user=cls.author, recipe=cls.recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get_data(self, **changes):
+        return {
+            'name': self.recipe.name,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [self.tags[0].id],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:3]
+            ],
+            **changes,
+        }
+
+    def patch(self, data):
+        """Ответ и изменяющие запросы к связям рецепта."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, data, format='json')
+        writes = [
+            query['sql'].split()[0].upper() for query in queries
+            if query['sql'].lstrip()[:6].upper()
+            in QueryCollector.WRITE_STATEMENTS
+            and ('recipeingredient' in query['sql']
+                 or 'recipetag' in query['sql'])
+        ]
+        return response, writes
+
+    def test_author_only(self):
+        """Изменять и удалять рецепт может только его автор."""
+        other = User.objects.create_user(
+            email='stranger@recipebook.ru', username='stranger',
+            first_name='Чужой', last_name='Повар', password='Qwerty123'
+        )
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.patch(self.url, self.get_data(text='Чужой текст'),
+                                format='json')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        response = client.delete(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.text, 'Нарезать')
+        response, _ = self.patch(self.get_data(text='Свой текст'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(id=self.recipe.id).exists())
+
+    def test_text_only(self):
+        """Без изменения состава связи рецепта не перезаписываются."""
+        response, writes = self.patch(self.get_data(text='Нарезать мелко'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(writes, [])
+        self.assertEqual(response.data['text'], 'Нарезать мелко')
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+    def test_ingredients_and_tags_diff(self):
+        """Изменения состава и тегов - один upsert и точечные удаления."""
+        first, second, _, fourth = self.ingredients
+        response, writes = self.patch(self.get_data(
+            tags=[self.tags[1].id],
+            ingredients=[
+                {'id': first.id, 'amount': 10},
+                {'id': second.id, 'amount': 25},
+                {'id': fourth.id, 'amount': 5},
+            ],
+        ))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        # Тег: удаление и вставка; ингредиенты: удаление и один upsert.
+        self.assertEqual(writes, ['DELETE', 'INSERT', 'DELETE', 'INSERT'])
+        self.assertEqual(
+            {item['id']: item['amount']
+             for item in response.data['ingredients']},
+            {first.id: 10, second.id: 25, fourth.id: 5},
+        )
+        self.assertEqual([tag['id'] for tag in response.data['tags']],
+                         [self.tags[1].id])
+        self.assertEqual(set(RecipeIngredient.objects.filter(
+            recipe=self.recipe
+        ).values_list('ingredient', 'amount')), {
+            (first.id, 10), (second.id, 25), (fourth.id, 5)
+        })
+        self.assertFalse(get_shopping_list_drift())
+
+    def test_invalid_ingredients_and_tags(self):
+        """Повторы и несуществующие id - ошибка 400 без изменений."""
+        first = self.ingredients[0]
+        for data in (
+            self.get_data(ingredients=[{'id': first.id, 'amount': 1},
+                                       {'id': first.id, 'amount': 2}]),
+            self.get_data(ingredients=[{'id': 10 ** 9, 'amount': 1}]),
+            self.get_data(tags=[10 ** 9]),
+        ):
+            response = self.client.patch(self.url, data, format='json')
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            RecipeIngredient.objects.filter(recipe=self.recipe).count(), 3
+        )
+
+    def test_validation_query_count(self):
+        """Ингредиенты и теги проверяются одним запросом каждые."""
+        serializer = RecipeCreateUpdateSerializer(self.recipe, data={
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients
+            ],
+        }, partial=True)
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid())
+
+
+@override_settings(
+    DATABASE_REPLICAS=['replica1'],
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }},
+)
+class ReplicaRoutingTestCase(SimpleTestCase):
+    """Чтение с реплик и из основной БД после изменений."""
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def get_response(self, request):
+        return HttpResponse(self.router.db_for_read(Recipe))
+
+    async def aget_response(self, request):
+        return self.get_response(request)
+
+    def request(self, method, token=None, is_async=False,
+                path='/api/recipes/'):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        request = getattr(self.factory, method)(path, headers=headers)
+        if is_async:
+            response = async_to_sync(
+                ReplicaRoutingMiddleware(self.aget_response)
+            )(request)
+        else:
+            response = ReplicaRoutingMiddleware(self.get_response)(request)
+        return response.content.decode()
+
+    def test_router(self):
+        """Реплики только для разрешённого чтения вне транзакций."""
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Recipe), 'replica1')
+            self.assertEqual(self.router.db_for_read(Token), 'default')
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+            with patch.object(connections['default'], 'in_atomic_block',
+                              True):
+                self.assertEqual(self.router.db_for_read(Recipe),
+                                 'default')
+        self.assertIs(self.router.allow_migrate('replica1', 'recipes'),
+                      False)
+        self.assertIsNone(self.router.allow_migrate('default', 'recipes'))
+        with override_settings(DATABASE_REPLICAS=[]), replica_reads():
+            self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_read_your_writes(self):
+        """После изменений клиент читает из основной БД."""
+        for is_async in (False, True):
+            with self.subTest(is_async=is_async):
+                token = f'writer-{is_async}'
+                self.assertEqual(self.request('get', token, is_async),
+                                 'replica1')
+                self.assertEqual(self.request('post', token, is_async),
+                                 'default')
+                self.assertEqual(self.request('get', token, is_async),
+                                 'default')
+                self.assertEqual(
+                    self.request('get', f'reader-{is_async}', is_async),
+                    'replica1',
+                )
+                self.assertEqual(self.request('get', None, is_async),
+                                 'replica1')
+
+    def test_api_only(self):
+        """Админка и другие страницы читают из основной БД."""
+        for is_async in (False, True):
+            with self.subTest(is_async=is_async):
+                self.assertEqual(
+                    self.request('get', None, is_async,
+                                 path='/admin/recipes/recipe/'),
+                    'default',
+                )
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_pin_window(self):
+        """Без окна REPLICA_PIN_SECONDS чтение сразу идёт на реплики."""
+        self.request('post', 'writer')
+        self.assertEqual(self.request('get', 'writer'), 'replica1')
+
+
+class ReplicaConnectionTestCase(TestCase):
+    """Запросы API читают с реплики или из основной БД."""
+    databases = {'default', 'replica1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='replicated@recipebook.ru', username='replicated',
+            first_name='Читатель', last_name='Реплики', password='Qwerty123'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт с реплики',
+            image='recipes/images/test.png', text='Описание',
+            cooking_time=10,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client(
+            headers={'Authorization': f'Token {self.token.key}'}
+        )
+        replica = connections['replica1']
+        if replica.vendor == 'sqlite':
+            # Зеркало sqlite в памяти - второе соединение к той же базе:
+            # без read_uncommitted его чтение блокирует таблицы до конца
+            # транзакции теста.
+            with replica.cursor() as cursor:
+                cursor.execute('PRAGMA read_uncommitted = 1')
+
+    def served_by(self, client, method, url):
+        """Соединения, выполнившие запросы к рецептам и тегам."""
+        captures = {
+            alias: CaptureQueriesContext(connections[alias])
+            for alias in ('default', 'replica1')
+        }
+        # TestCase держит основную БД в транзакции, из которой
+        # маршрутизатор иначе всегда читал бы сам.
+        with patch.object(PrimaryReplicaRouter, 'in_transaction',
+                          return_value=False):
+            with captures['default'], captures['replica1']:
+                response = getattr(client, method)(url)
+        self.assertLess(response.status_code, HTTPStatus.BAD_REQUEST)
+        return {
+            alias for alias, queries in captures.items()
+            if any(
+                'recipes_tag' in query['sql']
+                or 'recipes_recipe' in query['sql']
+                for query in queries.captured_queries
+            )
+        }
+
+    def test_read_your_writes(self):
+        """Чтение - с реплики, после изменений клиент читает из основной."""
+        self.assertEqual(self.served_by(self.client, 'get', '/api/tags/'),
+                         {'replica1'})
+        self.assertEqual(
+            self.served_by(self.client, 'post',
+                           f'/api/recipes/{self.recipe.id}/favorite/'),
+            {'default'},
+        )
+        self.assertEqual(self.served_by(self.client, 'get', '/api/tags/'),
+                         {'default'})
+        self.assertEqual(self.served_by(Client(), 'get', '/api/tags/'),
+                         {'replica1'})
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedTestCase(TestCase):
+    """Лента рецептов авторов из подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, cls.author, cls.star = (
+            User.objects.create_user(
+                email=f'{name}@recipebook.ru', username=name,
+                first_name='Читатель', last_name='Ленты',
+                password='Qwerty123',
+            )
+            for name in ('reader', 'other', 'author', 'star')
+        )
+        cls.number = 0
+        for author in (cls.author, cls.star):
+            for _ in range(4):
+                cls.create_recipe(author)
+
+    @classmethod
+    def create_recipe(cls, author):
+        cls.number += 1
+        return Recipe.objects.create(
+            author=author, name=f'Рецепт для ленты {cls.number}',
+            image='recipes/images/test.png', text='Описание',
+            cooking_time=15,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, user, author, method='post'):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = getattr(client, method)(
+            f'/api/users/{author.id}/subscribe/'
+        )
+        self.assertLess(response.status_code, 300)
+
+    def get_feed_ids(self):
+        ids = []
+        url = '/api/recipes/feed/'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertIsNone(response.data['previous'])
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def get_expected_ids(self, *authors):
+        return list(Recipe.objects.filter(author__in=authors).values_list(
+            'id', flat=True
+        ))
+
+    def test_push_and_pull(self):
+        """Рецепты рассылаются в ленты или читаются при запросе."""
+        self.assertEqual(self.get_feed_ids(), [])
+        self.subscribe(self.reader, self.author)
+        self.subscribe(self.reader, self.star)
+        self.subscribe(self.other, self.star)
+        self.create_recipe(self.author)
+        recipe = self.create_recipe(self.star)
+        # У star подписчиков стало больше FEED_FANOUT_LIMIT:
+        # новые рецепты не рассылаются, а читаются при запросе.
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        self.assertEqual(FeedEntry.objects.filter(author=self.author).count(),
+                         5)
+        ids = self.get_feed_ids()
+        self.assertEqual(ids, self.get_expected_ids(self.author, self.star))
+        self.assertEqual(len(ids), 10)
+        self.assertFalse(get_feed_drift())
+
+    def test_unsubscribe(self):
+        """Отписка чистит ленту, рецепты переходят в рассылку."""
+        self.subscribe(self.reader, self.author)
+        self.subscribe(self.reader, self.star)
+        self.subscribe(self.other, self.star)
+        self.subscribe(self.reader, self.author, 'delete')
+        self.assertFalse(
+            FeedEntry.objects.filter(user=self.reader,
+                                     author=self.author).exists()
+        )
+        self.subscribe(self.other, self.star, 'delete')
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader,
+                                     author=self.star).count(),
+            4,
+        )
+        self.assertEqual(self.get_feed_ids(),
+                         self.get_expected_ids(self.star))
+        self.assertFalse(get_feed_drift())
+
+    def test_query_count(self):
+        """Число запросов к странице ленты не зависит от подписок."""
+        self.subscribe(self.reader, self.author)
+        self.subscribe(self.reader, self.star)
+        self.subscribe(self.other, self.star)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/feed/')
+        # Журнал запросов очищается следующим запросом к API.
+        query_count = len(queries)
+        self.subscribe(self.reader, self.other)
+        self.create_recipe(self.other)
+        with self.assertNumQueries(query_count):
+            self.client.get('/api/recipes/feed/')
+
+    def test_invalid(self):
+        """Без авторизации - 401, неверный курсор - 404."""
+        response = APIClient().get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        response = self.client.get('/api/recipes/feed/?cursor=bad')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_rebuild_command(self):
+        """Команда пересобирает ленты по подпискам."""
+        self.subscribe(self.reader, self.author)
+        FeedEntry.objects.filter(user=self.reader).delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_feeds', '--check', stdout=StringIO())
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(self.get_feed_ids(),
+                         self.get_expected_ids(self.author))
+
+
+class SimilarRecipesTestCase(TestCase):
+    """Похожие рецепты по ингредиентам и тегам."""
+
+    COMPOSITIONS = {
+        'base': ('a', 'b', 'c'),
+        'close': ('a', 'b', 'd'),
+        'partial': ('a', 'e'),
+        'far': ('e', 'f'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='cook@recipebook.ru', username='cook',
+            first_name='Повар', last_name='Похожий', password='Qwerty123'
+        )
+        cls.tag = Tag.objects.create(name='Суп', color='#E26C2D',
+                                     slug='soup')
+        cls.ingredients = {
+            name: Ingredient.objects.create(name=f'продукт {name}', unit='г')
+            for name in 'abcdef'
+        }
+        cls.recipes = {}
+        for name, composition in cls.COMPOSITIONS.items():
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Похожий рецепт {name}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=20,
+            )
+            recipe.tags.add(cls.tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe,
+                                 ingredient=cls.ingredients[item], amount=1)
+                for item in composition
+            )
+            cls.recipes[name] = recipe
+        rebuild_similar()
+
+    def get_similar(self, name):
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[name].id}/similar/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        names = {recipe.id: name for name, recipe in self.recipes.items()}
+        return [names[recipe['id']] for recipe in response.data]
+
+    def get_lists(self):
+        # Оценки в чужих списках уточняет только полный пересчёт,
+        # поэтому сравнивается состав списков, а не порядок.
+        return set(SimilarRecipe.objects.values_list('recipe', 'similar'))
+
+    def test_ranking(self):
+        """Больше общих редких ингредиентов - выше в списке."""
+        self.assertEqual(self.get_similar('base'), ['close', 'partial'])
+        self.assertEqual(self.get_similar('far'), ['partial'])
+        with self.assertNumQueries(5):
+            self.get_similar('partial')
+
+    def test_refresh_on_update(self):
+        """Изменение состава обновляет списки как полный пересчёт."""
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.patch(
+            f'/api/recipes/{self.recipes["far"].id}/',
+            {'tags': [self.tag.id], 'ingredients': [
+                {'id': self.ingredients[item].id, 'amount': 1}
+                for item in ('a', 'b', 'c')
+            ]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_similar('base')[0], 'far')
+        refreshed = self.get_lists()
+        rebuild_similar()
+        self.assertEqual(refreshed, self.get_lists())
+
+    def test_not_found(self):
+        """Несуществующий рецепт - 404."""
+        for pk in (10 ** 9, 'abc'):
+            response = self.client.get(f'/api/recipes/{pk}/similar/')
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class PantrySearchTestCase(TestCase):
+    """Поиск рецептов по имеющимся продуктам."""
+
+    COMPOSITIONS = {
+        'pair': ('a', 'b'),
+        'triple': ('a', 'b', 'c'),
+        'other': ('c', 'd'),
+        'single': ('a',),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='pantry@recipebook.ru', username='pantry',
+            first_name='Повар', last_name='Запасливый', password='Qwerty123'
+        )
+        cls.tag = Tag.objects.create(name='Ужин', color='#49B64E',
+                                     slug='dinner')
+        cls.ingredients = {
+            name: Ingredient.objects.create(name=f'запас {name}', unit='г')
+            for name in 'abcd'
+        }
+        cls.recipes = {}
+        for name, composition in cls.COMPOSITIONS.items():
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Из запасов {name}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=10,
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe,
+                                 ingredient=cls.ingredients[item], amount=1)
+                for item in composition
+            )
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        pantry_index.invalidate()
+
+    def search(self, have, missing_max=0):
+        ids = ','.join(str(self.ingredients[item].id) for item in have)
+        response = self.client.get(
+            f'/api/recipes/?have={ids}&missing_max={missing_max}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        names = {recipe.id: name for name, recipe in self.recipes.items()}
+        return [names[recipe['id']] for recipe in response.data['results']]
+
+    def test_search(self):
+        """Сначала рецепты с наибольшей долей имеющихся ингредиентов."""
+        self.assertCountEqual(self.search('ab'), ['pair', 'single'])
+        found = self.search('ab', missing_max=1)
+        self.assertCountEqual(found[:2], ['pair', 'single'])
+        self.assertEqual(found[2:], ['triple'])
+        self.assertEqual(self.search('cd', missing_max=2)[0], 'other')
+        self.assertEqual(self.search('d'), [])
+        self.assertEqual(self.search('d', missing_max=5), ['other'])
+        with self.assertNumQueries(5):
+            self.search('abcd')
+
+    @override_settings(PANTRY_RESULTS_LIMIT=3)
+    def test_limit(self):
+        """Отдаются не больше PANTRY_RESULTS_LIMIT лучших рецептов."""
+        self.assertCountEqual(self.search('abc', missing_max=1),
+                              ['pair', 'triple', 'single'])
+        with override_settings(PANTRY_RESULTS_LIMIT=1):
+            self.assertEqual(self.search('ab', missing_max=1), ['single'])
+
+    def test_invalid(self):
+        """Отрицательный missing_max - ошибка."""
+        response = self.client.get(
+            f'/api/recipes/?have={self.ingredients["a"].id}&missing_max=-1'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_changes(self):
+        """Индекс обновляет только изменённые рецепты."""
+        self.search('a')
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with patch.object(pantry_index, '_build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.patch(
+                    f'/api/recipes/{self.recipes["other"].id}/',
+                    {'ingredients': [
+                        {'id': self.ingredients['d'].id, 'amount': 1}
+                    ]},
+                    format='json',
+                )
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.recipes['single'].delete()
+            self.assertEqual(self.search('d'), ['other'])
+            self.assertEqual(self.search('a'), [])
+            build.assert_not_called()
+
+    def change(self):
+        """Меняет состав рецепта single и возвращает вызовы _build."""
+        with patch.object(pantry_index, '_build',
+                          wraps=pantry_index._build) as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                RecipeIngredient.objects.filter(
+                    recipe=self.recipes['single']
+                ).update(ingredient=self.ingredients['d'])
+                record_pantry_change(self.recipes['single'].id)
+            self.assertCountEqual(self.search('d'), ['single'])
+        return build.call_count
+
+    def test_evicted_version(self):
+        """Вытесненный счётчик версий начинает новую эпоху."""
+        self.search('a')
+        epoch, version = get_pantry_version()
+        cache.delete(PANTRY_VERSION_KEY.format(epoch))
+        self.assertEqual(self.change(), 1)
+        self.assertNotEqual(get_pantry_version()[0], epoch)
+
+    def test_without_change_log(self):
+        """Без атомарного кеша индекс перестраивается целиком."""
+        self.search('a')
+        with patch('recipes.pantry.has_change_log', return_value=False):
+            self.assertEqual(self.change(), 1)
+
+
+THROTTLE_SETTINGS = {
+    'CACHES': {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }},
+    'REST_FRAMEWORK': {
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {
+            'read': '2/min', 'write': '2/min',
+            'upload': '1/min', 'export': '1/min',
+        },
+    },
+}
+
+
+@override_settings(**THROTTLE_SETTINGS)
+class ThrottlingTestCase(TestCase):
+    """Ограничение частоты запросов и сброс нагрузки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='hasty@recipebook.ru', username='hasty',
+            first_name='Торопыга', last_name='Быстров', password='Qwerty123'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        timer = patch.object(TokenBucketThrottle, 'timer',
+                             side_effect=lambda: self.now)
+        timer.start()
+        self.addCleanup(timer.stop)
+        self.user_client = APIClient()
+        self.user_client.force_authenticate(self.user)
+
+    def test_token_bucket(self):
+        """Ведро пополняется равномерно, области и клиенты независимы."""
+        for _ in range(2):
+            response = self.client.get('/api/recipes/')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(
+            self.user_client.get('/api/recipes/').status_code, HTTPStatus.OK
+        )
+        self.now += 30
+        self.assertEqual(
+            self.client.get('/api/recipes/').status_code, HTTPStatus.OK
+        )
+        url = '/api/recipes/download_shopping_cart/'
+        self.assertEqual(self.user_client.get(url).status_code,
+                         HTTPStatus.OK)
+        self.assertEqual(self.user_client.get(url).status_code,
+                         HTTPStatus.TOO_MANY_REQUESTS)
+
+    @patch('api.throttling.sleep')
+    def test_bucket_lock(self, sleep):
+        """Пока ведро клиента занято другим запросом, токен не берётся."""
+        lock = 'throttle:read:127.0.0.1:lock'
+        cache.add(lock, True)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(sleep.call_count, TokenBucketThrottle.lock_attempts)
+        cache.delete(lock)
+        for _ in range(2):
+            response = self.client.get('/api/recipes/')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIsNone(cache.get(lock))
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'],
+                       ROOT_URLCONF='recipebook.asgi_urls')
+    def test_async_views(self):
+        """Асинхронное чтение ограничивается так же."""
+        statuses = [
+            self.client.get('/api/ingredients/').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [HTTPStatus.OK, HTTPStatus.OK,
+                                    HTTPStatus.TOO_MANY_REQUESTS])
+
+    @override_settings(LOAD_SHEDDING_MAX_REQUESTS=1)
+    def test_load_shedding(self):
+        """При перегрузке дорогие запросы сразу получают 429."""
+        factory = RequestFactory()
+        middleware = LoadSheddingMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'data']))
+        )
+        streaming = middleware(factory.get('/api/recipes/'))
+        self.assertEqual(middleware.in_flight, 1)
+        with self.assertLogs('api.performance', 'WARNING'):
+            for method, url in (
+                ('post', '/api/recipes/'),
+                ('get', '/api/recipes/download_shopping_cart/'),
+            ):
+                response = middleware(getattr(factory, method)(url))
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.TOO_MANY_REQUESTS)
+                self.assertEqual(response['Retry-After'], '1')
+        # Дешёвые запросы не отклоняются.
+        response = middleware(factory.get('/api/tags/'))
+        self.assertIsInstance(response, StreamingHttpResponse)
+        response.close()
+        # Потоковый ответ обрабатывается, пока не отдан.
+        self.assertEqual(middleware.in_flight, 1)
+        b''.join(streaming.streaming_content)
+        self.assertEqual(middleware.in_flight, 0)
+        self.assertIsInstance(middleware(factory.post('/api/recipes/')),
+                              StreamingHttpResponse)
+
+    def test_load_shedding_async_stream(self):
+        """Асинхронный потоковый ответ занимает слот, пока не отдан."""
+        async def content():
+            yield b'data'
+
+        middleware = LoadSheddingMiddleware(
+            lambda request: StreamingHttpResponse(content())
+        )
+        response = middleware(RequestFactory().get('/api/recipes/'))
+        self.assertTrue(response.is_async)
+        self.assertEqual(middleware.in_flight, 1)
+
+        @async_to_sync
+        async def consume():
+            return [part async for part in response.streaming_content]
+
+        self.assertEqual(consume(), [b'data'])
+        self.assertEqual(middleware.in_flight, 0)
+
+
+class TagMaskTestCase(TestCase):
+    """Маски тегов рецептов и фильтр по ним."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='tagger@recipebook.ru', username='tagger',
+            first_name='Повар', last_name='Теговый', password='Qwerty123'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Метка {number}',
+                               color=f'#00000{number}', slug=f'mark{number}')
+            for number in range(3)
+        ]
+        cls.ingredient = Ingredient.objects.create(name='метка соли',
+                                                   unit='г')
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'С метками {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=5,
+            )
+            recipe.tags.set(cls.tags[:number + 1])
+            cls.recipes.append(recipe)
+
+    def get_masks(self):
+        return dict(Recipe.objects.filter(
+            author=self.author
+        ).values_list('id', 'tag_mask'))
+
+    def assert_masks_synced(self):
+        masks = self.get_masks()
+        self.assertEqual(masks, {
+            recipe_id: calculate_masks([recipe_id]).get(recipe_id, 0)
+            for recipe_id in masks
+        })
+
+    def test_bits(self):
+        """Теги получают свободные биты, их не больше TAG_BITS."""
+        self.assertEqual([tag.bit for tag in self.tags], [0, 1, 2])
+        self.tags[1].delete()
+        tag = Tag.objects.create(name='Новая', color='#00000A', slug='new')
+        self.assertEqual(tag.bit, 1)
+        Tag.objects.bulk_create(
+            Tag(name=f'Ещё {number}', color=f'#1{number:05}',
+                slug=f'more{number}')
+            for number in range(TAG_BITS - 3)
+        )
+        assign_tag_bits()
+        with self.assertRaises(ValidationError):
+            Tag.objects.create(name='Лишняя', color='#FFFFF0', slug='extra')
+
+    def test_sync(self):
+        """Маски следуют за связями с тегами."""
+        self.assertEqual(sorted(self.get_masks().values()),
+                         [0b1, 0b11, 0b111])
+        recipe = self.recipes[0]
+        recipe.tags.add(self.tags[2])
+        recipe.tags.remove(self.tags[0])
+        self.tags[1].recipe.add(recipe)
+        self.assert_masks_synced()
+        self.tags[2].delete()
+        self.assert_masks_synced()
+        recipe.tags.clear()
+        self.tags[1].recipe.clear()
+        self.assertEqual(set(self.get_masks().values()), {0b0, 0b1})
+        Recipe.objects.update(tag_mask=0)
+        rebuild_tag_masks()
+        self.assert_masks_synced()
+
+    def test_filter(self):
+        """Фильтр по тегам без соединения и дубликатов."""
+        url = (f'/api/recipes/?tags={self.tags[1].slug}'
+               f'&tags={self.tags[2].slug}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            sorted(recipe['id'] for recipe in response.data['results']),
+            [recipe.id for recipe in self.recipes[1:]],
+        )
+        self.assertNotIn('recipes_recipetag', queries[0]['sql'])
+        response = self.client.get('/api/recipes/?tags=unknown')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class FavoriteCartFilterTestCase(TestCase):
+    """Фильтры избранного и списка покупок через EXISTS."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='chooser@recipebook.ru', username='chooser',
+            first_name='Повар', last_name='Разборчивый', password='Qwerty123'
+        )
+        cls.other = User.objects.create_user(
+            email='other@recipebook.ru', username='other',
+            first_name='Повар', last_name='Другой', password='Qwerty123'
+        )
+        cls.tag = Tag.objects.create(name='Ужин', color='#0000AA',
+                                     slug='supper')
+        cls.recipes = []
+        for number in range(4):
+            recipe = Recipe.objects.create(
+                author=cls.user if number % 2 else cls.other,
+                name=f'Выбранный {number}',
+                image='recipes/images/test.png', text='Описание',
+                cooking_time=5,
+            )
+            if number < 2:
+                recipe.tags.add(cls.tag)
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[1:]:
+            FavoriteRecipe.objects.create(user=cls.user, recipe=recipe)
+            FavoriteRecipe.objects.create(user=cls.other, recipe=recipe)
+        for recipe in cls.recipes[:2]:
+            RecipeShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_ids(self, query, client=None):
+        response = (client or self.client).get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return sorted(recipe['id'] for recipe in response.data['results'])
+
+    def test_compose(self):
+        """Фильтры сочетаются с автором и тегами и не дают дубликатов."""
+        ids = [recipe.id for recipe in self.recipes]
+        self.assertEqual(self.get_ids('is_favorited=1'), ids[1:])
+        self.assertEqual(self.get_ids('is_favorited=0'), ids[:1])
+        self.assertEqual(
+            self.get_ids(f'is_favorited=1&author={self.user.id}'),
+            [ids[1], ids[3]]
+        )
+        self.assertEqual(
+            self.get_ids(f'is_in_shopping_cart=1&tags={self.tag.slug}'
+                         f'&author={self.other.id}'),
+            ids[:1]
+        )
+        self.assertEqual(self.get_ids('is_in_shopping_cart=0'), ids[2:])
+        self.assertEqual(
+            self.get_ids('is_in_shopping_cart=1&is_favorited=1'), ids[1:2]
+        )
+
+    def test_anonymous(self):
+        """У анонима избранное и список покупок пусты."""
+        client = APIClient()
+        self.assertEqual(self.get_ids('is_favorited=1', client), [])
+        self.assertEqual(self.get_ids('is_in_shopping_cart=1', client), [])
+        self.assertEqual(self.get_ids('is_in_shopping_cart=0', client),
+                         [recipe.id for recipe in self.recipes])
+
+    def test_plan(self):
+        """Подзапрос читает только индекс (user, recipe)."""
+        request = RequestFactory().get('/')
+        request.user = self.user
+        for query, table, index in (
+            ({'is_favorited': '1'}, 'favoriterecipe', 'unique_elected'),
+            ({'is_in_shopping_cart': '0'}, 'recipeshoppinglist',
+             'unique_shopping_pair'),
+        ):
+            queryset = RecipeFilter(query, Recipe.objects.all(),
+                                    request=request).qs
+            with self.subTest(query=query):
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                    self.assertIn(f'Index Only Scan using {index}',
+                                  queryset.explain())
+                else:
+                    self.assertIn(
+                        f'COVERING INDEX sqlite_autoindex_recipes_{table}_1',
+                        queryset.explain()
+                    )
+
+
+class QueryPlanTestCase(TestCase):
+    """Проверка планов SQL-запросов API."""
+
+    def test_find_problems(self):
+        """Замечания к последовательному чтению и сортировке на диске."""
+        table_rows = {'recipes_recipe': 5000, 'recipes_tag': 10}
+        scan = {'Node Type': 'Seq Scan', 'Relation Name': 'recipes_recipe'}
+        plan = {'Node Type': 'Limit', 'Plans': [{
+            'Node Type': 'Sort', 'Sort Method': 'external merge',
+            'Sort Space Type': 'Disk', 'Plans': [
+                scan,
+                {'Node Type': 'Seq Scan', 'Relation Name': 'recipes_tag'},
+            ],
+        }]}
+        self.assertEqual(find_plan_problems(plan, table_rows, 1000), [
+            'Sort на диске',
+            'Seq Scan по recipes_recipe (5000 строк в таблице)',
+        ])
+        self.assertEqual(find_plan_problems(plan, table_rows, 10000), [
+            'Sort на диске',
+        ])
+        count = {'Node Type': 'Aggregate', 'Plans': [scan]}
+        self.assertEqual(find_plan_problems(count, table_rows, 1000), [])
+        count['Plans'] = [{**scan, 'Filter': '(author_id = 1)'}]
+        self.assertEqual(len(find_plan_problems(count, table_rows, 1000)), 1)
+        self.assertEqual(find_plan_problems(
+            scan, table_rows, 1000, full_scans={'recipes_recipe'}
+        ), [])
+        # Фильтр по тегам проверяет маску у каждого рецепта.
+        count['Plans'] = [{**scan, 'Filter': '((tag_mask & 3) > 0)'}]
+        self.assertEqual(find_plan_problems(
+            count, table_rows, 1000, FULL_SCANS['recipes_tags']
+        ), [])
+        index_scan = {
+            'Node Type': 'Index Only Scan', 'Relation Name': 'recipes_recipe',
+            'Index Name': 'recipe_pub_date_id_idx',
+        }
+        self.assertEqual(find_plan_problems(index_scan, table_rows, 1), [])
+
+    @skipIf(connection.vendor == 'postgresql', 'Проверка для других СУБД')
+    def test_postgres_only(self):
+        """Без PostgreSQL команда сообщает об ошибке."""
+        with self.assertRaises(CommandError):
+            call_command('explain_queries', stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Нужен PostgreSQL')
+    def test_seeded_plans(self):
+        """Запросы эндпоинтов к заполненной БД читают индексы."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', color=f'#0000{number:02}',
+                slug=f'plan{number}')
+            for number in range(8)
+        )
+        assign_tag_bits()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'продукт для плана {number}', unit='г')
+            for number in range(500)
+        )
+        with override_settings(MEDIA_ROOT=tmp_dir):
+            call_command('seed', '--users', '200', '--recipes', '5000',
+                         stdout=StringIO())
+            call_command('explain_queries', '--analyze', stdout=StringIO())
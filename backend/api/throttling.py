@@ -0,0 +1,92 @@
+from time import sleep
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+def get_throttle_scope(view_class, action, method):
+    """
+    Область ограничения запроса: из throttle_scopes представления
+    по действию, иначе read для чтения и write для изменений.
+    """
+    scope = getattr(view_class, 'throttle_scopes', {}).get(action)
+    if scope is not None:
+        return scope
+    return 'read' if method in SAFE_METHODS else 'write'
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Ограничение частоты запросов по алгоритму «ведро токенов»
+    в общем кеше: для каждой области и пользователя (анонимов -
+    по IP) ведро на N запросов из частоты 'N/период' пополняется
+    равномерно, поэтому после паузы разрешён всплеск до N запросов.
+    Частоты областей - в DEFAULT_THROTTLE_RATES, области без частоты
+    не ограничиваются. Ведро меняется под блокировкой в кеше
+    (атомарный add), чтобы одновременные запросы клиента
+    не потратили один и тот же токен.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+    # Блокировка снимается сама, если процесс упал, не сняв её.
+    lock_timeout = 1
+    lock_attempts = 20
+    lock_wait = 0.005
+
+    def __init__(self):
+        # Область и частота известны только для конкретного запроса.
+        pass
+
+    def get_rate(self):
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.scope = get_throttle_scope(
+            type(view), getattr(view, 'action', None), request.method
+        )
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        self.key = self.get_cache_key(request, view)
+        lock = f'{self.key}:lock'
+        for _ in range(self.lock_attempts):
+            if self.cache.add(lock, True, self.lock_timeout):
+                break
+            sleep(self.lock_wait)
+        else:
+            # Ведро долго занято другими запросами того же клиента.
+            self.tokens = 0
+            return self.throttle_failure()
+        try:
+            return self.take_token()
+        finally:
+            self.cache.delete(lock)
+
+    def take_token(self):
+        """Пополняет ведро по прошедшему времени и берёт из него токен."""
+        self.now = self.timer()
+        tokens, updated = self.cache.get(
+            self.key, (self.num_requests, self.now)
+        )
+        tokens = min(
+            self.num_requests,
+            tokens + (self.now - updated) * self.num_requests / self.duration,
+        )
+        if tokens < 1:
+            self.tokens = tokens
+            return self.throttle_failure()
+        # Полное ведро хранить незачем: через duration оно полное.
+        self.cache.set(self.key, (tokens - 1, self.now), self.duration)
+        return True
+
+    def wait(self):
+        """Секунд до появления следующего токена."""
+        return (1 - self.tokens) * self.duration / self.num_requests
@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import get_async_urlpatterns
 from .views import (
     IngredientViewSet,
     RecipeViewSet,
@@ -22,3 +23,9 @@ urlpatterns = [
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+# Для ASGI (recipebook.asgi_urls): те же адреса, но рецепты,
+# справочники и подписки читают асинхронные представления.
+async_urlpatterns = [
+    path('', include(get_async_urlpatterns(router.urls))),
+] + urlpatterns[1:]
@@ -1,10 +1,24 @@
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
-from django.http.response import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    Window
+)
+from django.db.models.functions import RowNumber
+from django.http import Http404
+from django.http.response import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from .serializers import (
@@ -12,16 +26,35 @@ from .serializers import (
     FavoriteRecipeSerializer,
     IngredientSerializer,
     RecipeCreateUpdateSerializer,
+    RecipeIdsSerializer,
     RecipeSerializer,
     RecipeShoppingListSerializer,
     SubscriptionsSerializer,
     TagSerializer
 )
-from .filters import IngredientFilter, RecipeFilter
+from .decorators import catalog_cache
+from .filters import RecipeFilter
+from .indexes import ingredient_index
+from .pagination import (
+    FeedCursorPagination,
+    OptInCursorPagination,
+    SubscriptionPagination
+)
 from .permissions import AuthorOnly
-from recipes.models import Ingredient, Recipe, Tag
+from .renderers import SHOPPING_LIST_RENDERERS
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeShoppingList,
+    SimilarRecipe,
+    Tag
+)
+from recipes.feed import get_feed
+from recipes.services import add_recipes, remove_recipes
 from users.models import Follow, User
-from .services import get_ingredients
+from .services import aiter_batches, iter_ingredients
 
 
 class CustomUserViewSet(UserViewSet):
@@ -32,6 +65,38 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
 
+    def get_recipes_limit(self):
+        """Проверенное значение параметра recipes_limit."""
+        limit = self.request.query_params.get('recipes_limit')
+        if not limit:
+            return None
+        if not limit.isdigit():
+            raise ValidationError({
+                'recipes_limit': 'Укажите целое неотрицательное число.'
+            })
+        return int(limit)
+
+    def with_recipes(self, authors):
+        """
+        Авторы, на которых подписан пользователь, с не более
+        recipes_limit последними рецептами каждого.
+        Рецепты всех авторов загружаются одним запросом
+        с нумерацией ROW_NUMBER() внутри автора.
+        """
+        recipes = Recipe.objects.all()
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            recipes = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').asc()),
+            )).filter(row_number__lte=limit)
+        return authors.annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
+
     @action(methods=['POST'],
             detail=False,
             permission_classes=[permissions.IsAuthenticated])
@@ -69,10 +134,11 @@ class CustomUserViewSet(UserViewSet):
             if user == author:
                 return Response({'error': 'Невозможно подписаться на себя'},
                                 status=status.HTTP_400_BAD_REQUEST)
+            self.get_recipes_limit()
+            Follow.objects.create(user=user, author=author)
             serializer = SubscriptionsSerializer(
-                author,
+                self.with_recipes(User.objects.filter(id=author.id)).get(),
                 context={'request': request})
-            Follow.objects.create(user=user, author=author)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if subscription.exists():
             subscription.delete()
@@ -82,15 +148,16 @@ class CustomUserViewSet(UserViewSet):
 
     @action(methods=['GET'],
             detail=False,
-            permission_classes=[permissions.IsAuthenticated])
+            permission_classes=[permissions.IsAuthenticated],
+            pagination_class=SubscriptionPagination)
     def subscriptions(self, request):
         """
         Авторизированный пользователь
         получает список своих подписок.
         """
-        subscriptions = User.objects.filter(
+        subscriptions = self.with_recipes(User.objects.filter(
             following__user=self.request.user
-        )
+        ))
         page = self.paginate_queryset(subscriptions)
         serializer = SubscriptionsSerializer(
             page, many=True,
@@ -106,17 +173,59 @@ class RecipeViewSet(viewsets.ModelViewSet):
     этих списках; скачивание файла.
     """
     queryset = Recipe.objects.all()
-    permission_classes = (permissions.IsAuthenticated,)
+    permission_classes = (permissions.IsAuthenticated, AuthorOnly)
     serializer_class = RecipeCreateUpdateSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = OptInCursorPagination
+    # Создание и изменение принимают изображение в base64.
+    throttle_scopes = {
+        'create': 'upload',
+        'update': 'upload',
+        'partial_update': 'upload',
+        'download_shopping_cart': 'export',
+    }
+
+    def get_queryset(self):
+        """
+        Рецепты с отметками избранного, списка покупок и подписки
+        для текущего пользователя и заранее загруженными
+        автором, тегами и ингредиентами.
+        """
+        user = self.request.user
+        authors = User.objects.all()
+        queryset = super().get_queryset()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+            queryset = queryset.annotate(
+                is_favorited=Exists(FavoriteRecipe.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(RecipeShoppingList.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+            )
+        else:
+            authors = authors.annotate(is_subscribed=Value(False))
+            queryset = queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
 
     def get_permissions(self):
         """
         Просмотр списка рецептов и списка по id
         доступен всем.
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'similar']:
             return (permissions.AllowAny(),)
         return super().get_permissions()
 
@@ -149,6 +258,36 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response({'Этого рецепта не было в cписке'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    def _batch_post_delete(self, model):
+        """
+        Массовое добавление/удаление рецептов в списки одним
+        INSERT или DELETE с результатом для каждого id.
+        """
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found = set(Recipe.objects.filter(id__in=ids).values_list(
+            'id', flat=True
+        ))
+        recipe_ids = [recipe_id for recipe_id in ids if recipe_id in found]
+        if self.request.method == 'POST':
+            changed = add_recipes(model, self.request.user.id, recipe_ids)
+            statuses = ('added', 'exists')
+        else:
+            changed = remove_recipes(model, self.request.user.id, recipe_ids)
+            statuses = ('removed', 'missing')
+        changed = set(changed)
+        return Response({'results': [
+            {
+                'id': recipe_id,
+                'status': (
+                    'not_found' if recipe_id not in found
+                    else statuses[recipe_id not in changed]
+                ),
+            }
+            for recipe_id in ids
+        ]})
+
     @action(detail=True,
             permission_classes=[permissions.IsAuthenticated],
             methods=['POST', 'DELETE'])
@@ -156,6 +295,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Добавляет/удаляет рецепт в список избранного."""
         return self._action_post_delete(pk, FavoriteRecipeSerializer)
 
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            methods=['POST', 'DELETE'],
+            url_path='favorite')
+    def favorite_batch(self, request):
+        """Добавляет/удаляет рецепты из ids в список избранного."""
+        return self._batch_post_delete(FavoriteRecipe)
+
     @action(detail=True,
             permission_classes=[permissions.IsAuthenticated],
             methods=['POST', 'DELETE'], )
@@ -163,22 +310,77 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Добавляет/удаляет рецепт в список покупок."""
         return self._action_post_delete(pk, RecipeShoppingListSerializer)
 
-    @action(detail=False, permission_classes=[AuthorOnly])
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            methods=['POST', 'DELETE'],
+            url_path='shopping_cart')
+    def shopping_cart_batch(self, request):
+        """Добавляет/удаляет рецепты из ids в список покупок."""
+        return self._batch_post_delete(RecipeShoppingList)
+
+    @action(detail=True, pagination_class=None)
+    def similar(self, request, pk=None):
+        """
+        Рецепты, ближайшие по ингредиентам и тегам: готовый
+        список из SimilarRecipe, самые похожие сначала.
+        """
+        if not pk.isdigit():
+            raise Http404
+        ids = list(SimilarRecipe.objects.filter(recipe_id=pk).order_by(
+            '-score', 'similar_id'
+        ).values_list('similar_id', flat=True))
+        if not ids and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes],
+            many=True,
+        )
+        return Response(serializer.data)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            pagination_class=FeedCursorPagination)
+    def feed(self, request):
+        """
+        Лента: рецепты авторов из подписок пользователя,
+        новые сначала, с курсорной пагинацией.
+        """
+        ids = self.paginator.paginate_feed(
+            lambda limit, position: get_feed(request.user.id, limit,
+                                             position),
+            request,
+        )
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for recipe_id in ids if recipe_id in recipes],
+            many=True,
+        )
+        return self.paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
-        """Загружает .txt файл со списком покупок."""
-        ingredients = get_ingredients(request.user)
-        shopping_list = 'Список покупок:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n- {ingredient[0]} "
-                f"({ingredient[1]}) - "
-                f"{ingredient[2]}")
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+        """
+        Потоково отдаёт файл со списком покупок.
+        Формат задаётся параметром ?format=txt|csv|json|md.
+        """
+        renderer = request.accepted_renderer
+        content = renderer.stream(iter_ingredients(request.user))
+        if isinstance(request._request, ASGIRequest):
+            content = aiter_batches(content)
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
         return response
 
 
+@method_decorator(catalog_cache, name='dispatch')
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """Вывод тегов."""
     queryset = Tag.objects.all()
@@ -187,11 +389,19 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.AllowAny,)
 
 
+@method_decorator(catalog_cache, name='dispatch')
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
-    """Вывод ингредиентов."""
+    """
+    Вывод ингредиентов.
+    Поиск по началу названия (?name=) выполняется
+    по индексу в памяти, без запросов к БД.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
-    filter_backends = (IngredientFilter,)
-    search_fields = ('^name', )
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        limit = settings.INGREDIENT_SEARCH_LIMIT if name else None
+        return Response(ingredient_index.search(name, limit))
@@ -0,0 +1,22 @@
+"""
+ASGI config for recipebook project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipebook.settings')
+os.environ.setdefault('ROOT_URLCONF', 'recipebook.asgi_urls')
+
+application = get_asgi_application()
+
+from api.indexes import ingredient_index, pantry_index  # noqa: E402
+
+ingredient_index.warm_up()
+pantry_index.warm_up()
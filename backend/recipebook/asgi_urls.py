@@ -0,0 +1,22 @@
+"""
+URL-адреса для запуска через ASGI: чтение рецептов, тегов,
+ингредиентов и подписок обслуживают асинхронные представления,
+остальные адреса - как в recipebook.urls.
+"""
+from django.conf import settings
+from django.conf.urls.static import static
+from django.contrib import admin
+from django.urls import include, path
+
+from api.urls import app_name, async_urlpatterns
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('api/', include((async_urlpatterns, app_name))),
+]
+
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL,
+                          document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.STATIC_URL,
+                          document_root=settings.STATIC_ROOT)
@@ -0,0 +1,63 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Можно ли читать с реплик. По умолчанию нельзя: команды, админка
+# и изменяющие запросы работают только с основной БД.
+_replica_reads = ContextVar('replica_reads', default=False)
+
+# Модели, которые всегда читаются из основной БД: токен,
+# выданный при входе, должен работать в следующем же запросе.
+PRIMARY_ONLY_MODELS = ('authtoken.token',)
+
+
+@contextmanager
+def replica_reads(allowed=True):
+    """Разрешает или запрещает чтение с реплик внутри блока."""
+    token = _replica_reads.set(allowed)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись и транзакции - в основной БД, чтение - со случайной реплики
+    из DATABASE_REPLICAS, если оно разрешено (см. replica_reads).
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            not replicas
+            or not _replica_reads.get()
+            or model._meta.label_lower in PRIMARY_ONLY_MODELS
+            or self.in_transaction()
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    @staticmethod
+    def in_transaction():
+        """Открыта ли транзакция в основной БД: тогда читаем из неё."""
+        return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной БД.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему репликацией из основной БД.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
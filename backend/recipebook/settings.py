@@ -1,4 +1,5 @@
 import os
+import sys
 
 from dotenv import load_dotenv
 
@@ -11,6 +12,9 @@ SECRET_KEY = os.getenv('TOKEN', 'default-token')
 
 DEBUG = False
 
+# Запуск тестов (manage.py test).
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['84.252.140.107', 'localhost', '127.0.0.1', 'recipebook.hopto.org']
 
 
@@ -23,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -37,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.LoadSheddingMiddleware',
+    'api.middleware.QueryInstrumentationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',
@@ -47,7 +55,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'recipebook.urls'
+# asgi.py подключает recipebook.asgi_urls с асинхронным чтением.
+ROOT_URLCONF = os.getenv('ROOT_URLCONF', 'recipebook.urls')
 
 TEMPLATES = [
     {
@@ -82,6 +91,36 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS - адреса через запятую
+# (host или host:port), остальные параметры как у основной БД.
+# В тестах реплики указывают на тестовую основную БД.
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1
+):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+# Без настроенных реплик тесты получают реплику - зеркало основной БД
+# с отдельным соединением, на котором проверяется маршрутизация.
+if TESTING and not DATABASE_REPLICAS:
+    DATABASES['replica1'] = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append('replica1')
+
+DATABASE_ROUTERS = ['recipebook.routers.PrimaryReplicaRouter']
+
+# Сколько секунд после изменяющего запроса клиент читает
+# из основной БД, а не с реплик.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -141,7 +180,19 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 6,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
-    ]
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.TokenBucketThrottle',
+    ],
+    # Запросов на пользователя (анонима - на IP) за период
+    # в каждой области; upload - рецепты с изображением,
+    # export - скачивание списка покупок.
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.getenv('THROTTLE_READ_RATE', '600/min'),
+        'write': os.getenv('THROTTLE_WRITE_RATE', '120/min'),
+        'upload': os.getenv('THROTTLE_UPLOAD_RATE', '30/min'),
+        'export': os.getenv('THROTTLE_EXPORT_RATE', '20/min'),
+    },
 }
 
 DJOSER = {
@@ -158,4 +209,103 @@ DJOSER = {
     },
 }
 
+# Общий для всех процессов кеш: версия справочников, лимиты запросов,
+# журнал изменений рецептов для поиска по продуктам. Рабочий вариант -
+# Redis (REDIS_URL): увеличение чисел атомарно, а ключи не вытесняются
+# случайно. Без него - файловый кеш с явным лимитом записей: при
+# переполнении удаляется 1/CULL_FREQUENCY из них, а incr не атомарен.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv(
+                'CACHE_LOCATION', os.path.join(BASE_DIR, 'cache/')
+            ),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+                'CULL_FREQUENCY': int(os.getenv('CACHE_CULL_FREQUENCY', 3)),
+            },
+        }
+    }
+# Тесты не трогают общий кеш и не оставляют в нём состояния.
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Максимум подсказок при поиске ингредиентов по началу названия.
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+# Максимум рецептов в одном запросе массового добавления
+# в избранное и список покупок.
+RECIPE_BATCH_LIMIT = int(os.getenv('RECIPE_BATCH_LIMIT', 100))
+
+# Рецепты авторов, у которых подписчиков не больше FEED_FANOUT_LIMIT,
+# рассылаются в ленты подписчиков при публикации, остальных -
+# читаются при запросе ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+# Сколько похожих рецептов хранится и отдаётся для каждого рецепта.
+SIMILAR_RECIPES_LIMIT = int(os.getenv('SIMILAR_RECIPES_LIMIT', 10))
+
+# Сколько лучших рецептов отдаёт поиск по имеющимся продуктам.
+PANTRY_RESULTS_LIMIT = int(os.getenv('PANTRY_RESULTS_LIMIT', 500))
+
+# Сколько секунд браузер может не перепроверять теги и ингредиенты.
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', 60))
+
+# С какого числа строк списки в админке показывают оценку их числа
+# по статистике PostgreSQL вместо точного COUNT(*).
+ADMIN_ESTIMATED_COUNT_FROM = int(
+    os.getenv('ADMIN_ESTIMATED_COUNT_FROM', 10000)
+)
+
+# Сколько запросов процесс обрабатывает одновременно, прежде чем
+# отвечать на запросы областей LOAD_SHEDDING_SCOPES кодом 429
+# (0 - не отклонять), и через сколько секунд их повторить.
+LOAD_SHEDDING_MAX_REQUESTS = int(os.getenv('LOAD_SHEDDING_MAX_REQUESTS', 20))
+LOAD_SHEDDING_SCOPES = ('upload', 'export')
+LOAD_SHEDDING_RETRY_AFTER = int(os.getenv('LOAD_SHEDDING_RETRY_AFTER', 1))
+
+# Замеры запросов к БД и заголовок Server-Timing для каждого запроса.
+QUERY_INSTRUMENTATION = os.getenv(
+    'QUERY_INSTRUMENTATION', 'True'
+).lower() in ('true', '1')
+# Запрос пишется в лог api.performance, если он дольше SLOW_REQUEST_MS
+# или делает не меньше SLOW_REQUEST_QUERIES запросов к БД.
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+# С какого числа одинаковых запросов считать их проблемой N+1.
+DUPLICATE_QUERY_THRESHOLD = int(os.getenv('DUPLICATE_QUERY_THRESHOLD', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.performance': {
+            'handlers': ['console'],
+            'level': os.getenv('PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+# В тестах лог медленных запросов не засоряет вывод, assertLogs его видит.
+if TESTING:
+    LOGGING['handlers']['console'] = {'class': 'logging.NullHandler'}
+
 CSRF_TRUSTED_ORIGINS = ['https://recipebook.hopto.org']
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipebook.settings')
 
 application = get_wsgi_application()
+
+from api.indexes import ingredient_index, pantry_index  # noqa: E402
+
+ingredient_index.warm_up()
+pantry_index.warm_up()
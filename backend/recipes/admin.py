@@ -1,5 +1,11 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
+from recipes.images import schedule_derivatives
 from recipes.models import (
     FavoriteRecipe,
     Ingredient,
@@ -9,6 +15,75 @@ from recipes.models import (
     RecipeTag,
     Tag
 )
+from recipes.paginators import EstimatedCountPaginator
+from recipes.pantry import record_pantry_change
+from recipes.services import change_recipe_amounts, get_recipe_amounts
+from recipes.similarity import refresh_similar
+from recipes.tag_masks import refresh_tag_masks
+
+
+def count_recipes(model, relation):
+    """
+    Число рецептов коррелированным подзапросом: считается
+    только для строк страницы, без GROUP BY по всей таблице.
+    """
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{relation: OuterRef('pk')}).order_by()
+            .values(relation).annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+@contextmanager
+def ingredients_changed(recipe_ids):
+    """
+    Переносит изменения ингредиентов рецептов recipe_ids внутри блока
+    в сводные списки покупок, похожие рецепты и индекс поиска
+    по продуктам, как при изменении рецепта через API.
+    В отдаваемое множество добавляются рецепты с изменёнными тегами.
+    """
+    with transaction.atomic():
+        old_amounts = {
+            recipe_id: get_recipe_amounts(recipe_id)
+            for recipe_id in recipe_ids
+        }
+        tags_changed = set()
+        yield tags_changed
+        for recipe_id, amounts in old_amounts.items():
+            new_amounts = get_recipe_amounts(recipe_id)
+            change_recipe_amounts(recipe_id, amounts, new_amounts)
+            features_changed = amounts.keys() != new_amounts.keys()
+            if features_changed:
+                record_pantry_change(recipe_id)
+            if features_changed or recipe_id in tags_changed:
+                # Похожие рецепты считаются по набору ингредиентов и тегов.
+                refresh_similar(recipe_id)
+
+
+@contextmanager
+def tags_changed(recipe_ids):
+    """
+    Обновляет маски тегов и похожие рецепты для рецептов recipe_ids
+    после изменения их тегов внутри блока.
+    """
+    with transaction.atomic():
+        yield
+        refresh_tag_masks(recipe_ids)
+        for recipe_id in recipe_ids:
+            refresh_similar(recipe_id)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Основа для моделей с большими таблицами: оценка числа строк
+    вместо COUNT(*) и без второго подсчёта всех строк при поиске.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    empty_value_display = '-пусто-'
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -18,81 +93,181 @@ class TagAdmin(admin.ModelAdmin):
         'name',
         'color',
         'slug',
+        'recipes_count',
     )
+    search_fields = ('name', 'slug')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=count_recipes(RecipeTag, 'tag')
+        )
+
+    @admin.display(description='Рецептов', ordering='recipes_count')
+    def recipes_count(self, obj):
+        return obj.recipes_count
 
 
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     """Отображение модели ингредиентов в админке."""
     list_display = (
         'name',
         'unit',
+        'recipes_count',
     )
-    list_filter = ('name',)
-    search_fields = ('name',)
+    list_filter = ('unit',)
+    # Поиск по началу названия использует индекс по name.
+    search_fields = ('^name',)
     ordering = ('name',)
-    empty_value_display = '-пусто-'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=count_recipes(RecipeIngredient, 'ingredient')
+        )
+
+    @admin.display(description='Рецептов', ordering='recipes_count')
+    def recipes_count(self, obj):
+        return obj.recipes_count
 
 
 class RecipeIngredientsInline(admin.TabularInline):
     model = RecipeIngredient
+    autocomplete_fields = ('ingredient',)
     min_num = 1
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipe', 'ingredient'
+        )
 
-class RecipeAdmin(admin.ModelAdmin):
+
+class RecipeAdmin(LargeTableAdmin):
     """Отображение модели рецептов в админке."""
     list_display = (
         'id',
         'name',
         'author',
         'pub_date',
-        'elected',
+        'favorites_count',
+        'in_carts_count',
     )
-    list_filter = ('name', 'author', 'tags',)
-    readonly_fields = ('elected',)
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username', 'author__email')
+    autocomplete_fields = ('author',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
     inlines = (RecipeIngredientsInline,)
-    empty_value_display = '-пусто-'
 
-    def elected(self, obj):
+    def save_model(self, request, obj, form, change):
         """
-        Общее число добавлений рецепта в избранное.
+        Создание уменьшенных копий загруженного изображения
+        и удаление копий прежнего.
         """
-        return obj.elected.all().count()
+        old_image = form.initial.get('image')
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data and obj.image:
+            schedule_derivatives(obj, old_image.name if old_image else '')
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Сводные списки покупок, похожие рецепты и индекс поиска
+        по продуктам по сохранённым ингредиентам и тегам.
+        """
+        with ingredients_changed([form.instance.id]) as tags_changed:
+            super().save_related(request, form, formsets, change)
+            if 'tags' in form.changed_data:
+                tags_changed.add(form.instance.id)
 
 
-class FavoriteRecipeAdmin(admin.ModelAdmin):
+class FavoriteRecipeAdmin(LargeTableAdmin):
     """
     Отображение модели избранных пользователем
     рецептов в админке.
     """
     list_display = ('id', 'user', 'recipe',)
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
 
 
-class RecipeShoppingListAdmin(admin.ModelAdmin):
+class RecipeShoppingListAdmin(LargeTableAdmin):
     """
     Отображение модели рецептов из списка покупок в админке.
     """
     list_display = ('id', 'user', 'recipe',)
-    empty_value_display = '-пусто-'
+    list_select_related = ('user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
 
 
-class RecipeIngredientsAdmin(admin.ModelAdmin):
+class RecipeIngredientsAdmin(LargeTableAdmin):
     """
     Отображение вспомогающей модели связи рецептов
     и ингредиентов в админке.
     """
     list_display = ('id', 'recipe', 'ingredient', 'amount',)
-    list_filter = ('recipe', 'ingredient')
+    list_select_related = ('recipe', 'ingredient')
+    search_fields = ('recipe__name', '^ingredient__name')
+    raw_id_fields = ('recipe',)
+    autocomplete_fields = ('ingredient',)
+
+    def save_model(self, request, obj, form, change):
+        """
+        Сводные списки покупок, похожие рецепты и индекс поиска
+        по продуктам прежнего и нового рецепта связи.
+        """
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.update(RecipeIngredient.objects.filter(
+                pk=obj.pk
+            ).values_list('recipe_id', flat=True))
+        with ingredients_changed(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with ingredients_changed([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with ingredients_changed(
+            set(queryset.values_list('recipe_id', flat=True))
+        ):
+            super().delete_queryset(request, queryset)
 
 
-class RecipeTagAdmin(admin.ModelAdmin):
+class RecipeTagAdmin(LargeTableAdmin):
     """
     Отображение вспомогающей модели связи рецептов
     и тегов в админке.
     """
     list_display = ('id', 'recipe', 'tag',)
-    list_filter = ('recipe', 'tag',)
+    list_filter = ('tag',)
+    list_select_related = ('recipe', 'tag')
+    search_fields = ('recipe__name',)
+    raw_id_fields = ('recipe',)
+
+    def save_model(self, request, obj, form, change):
+        """
+        Маски тегов и похожие рецепты прежнего
+        и нового рецепта связи.
+        """
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.update(RecipeTag.objects.filter(
+                pk=obj.pk
+            ).values_list('recipe_id', flat=True))
+        with tags_changed(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with tags_changed([obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with tags_changed(
+            set(queryset.values_list('recipe_id', flat=True))
+        ):
+            super().delete_queryset(request, queryset)
 
 
 admin.site.register(Tag, TagAdmin)
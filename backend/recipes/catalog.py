@@ -0,0 +1,31 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'recipes:catalog_version'
+
+
+def get_catalog_version():
+    """
+    Версия справочников тегов и ингредиентов - время последнего
+    изменения в наносекундах. Хранится в общем кеше, поэтому
+    проверка версии не обращается к БД.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Отмечает изменение справочников."""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_catalog_last_modified():
+    """Время последнего изменения справочников."""
+    return datetime.fromtimestamp(
+        get_catalog_version() // 10 ** 9, tz=timezone.utc
+    )
@@ -0,0 +1,106 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+# Счётчик field модели model - число строк модели source,
+# ссылающихся на неё полем relation.
+Counter = namedtuple('Counter', ('model', 'field', 'source', 'relation'))
+
+
+@lru_cache(maxsize=None)
+def get_counters():
+    """Все денормализованные счётчики."""
+    from recipes.models import FavoriteRecipe, Recipe, RecipeShoppingList
+    from users.models import Follow, User
+    return (
+        Counter(Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+        Counter(Recipe, 'in_carts_count', RecipeShoppingList, 'recipe'),
+        Counter(User, 'recipes_count', Recipe, 'author'),
+        Counter(User, 'followers_count', Follow, 'author'),
+    )
+
+
+def change_counters(source, pks, delta):
+    """
+    Атомарно изменяет через F() счётчики строк модели source
+    у объектов с первичными ключами pks.
+    """
+    for counter in get_counters():
+        if counter.source is source and pks:
+            change_counter_in_bulk(counter, pks, delta)
+
+
+def change_counter_in_bulk(counter, pks, delta):
+    objects = counter.model.objects.filter(pk__in=pks)
+    if delta < 0:
+        objects = objects.filter(**{f'{counter.field}__gte': -delta})
+    objects.update(**{counter.field: F(counter.field) + delta})
+
+
+def change_counter(counter, instance, delta):
+    """
+    Атомарно изменяет счётчик объекта, на который ссылается instance,
+    через F(); значение в загруженном связанном объекте тоже меняется.
+    """
+    change_counter_in_bulk(
+        counter, [getattr(instance, f'{counter.relation}_id')], delta
+    )
+    descriptor = getattr(counter.source, counter.relation)
+    if descriptor.is_cached(instance):
+        related = getattr(instance, counter.relation)
+        setattr(related, counter.field,
+                max(getattr(related, counter.field) + delta, 0))
+
+
+def get_actual_count(counter):
+    """Подзапрос с фактическим значением счётчика."""
+    return Coalesce(
+        Subquery(
+            counter.source.objects.filter(
+                **{counter.relation: OuterRef('pk')}
+            ).order_by().values(counter.relation).annotate(
+                count=Count('pk')
+            ).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def get_counter_drift():
+    """
+    Расхождения счётчиков с данными:
+    {(модель, поле): {pk: (хранимое, фактическое)}}.
+    """
+    drift = {}
+    for counter in get_counters():
+        rows = counter.model.objects.annotate(
+            actual=get_actual_count(counter)
+        ).filter(~Q(**{counter.field: F('actual')})).values_list(
+            'pk', counter.field, 'actual'
+        ).order_by()
+        if rows:
+            drift[counter.model._meta.label, counter.field] = {
+                pk: (stored, actual) for pk, stored, actual in rows
+            }
+    return drift
+
+
+@transaction.atomic
+def recount():
+    """
+    Пересчитывает все счётчики одним UPDATE на каждый.
+    Возвращает число исправленных строк по счётчикам.
+    """
+    fixed = {}
+    for counter in get_counters():
+        actual = get_actual_count(counter)
+        fixed[counter.model._meta.label, counter.field] = (
+            counter.model.objects.annotate(actual=actual).filter(
+                ~Q(**{counter.field: F('actual')})
+            ).order_by().update(**{counter.field: actual})
+        )
+    return fixed
@@ -0,0 +1,142 @@
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from recipes.models import FeedEntry, Recipe
+from users.models import Follow
+
+
+def is_pushed(prefix=''):
+    """
+    Условие на автора, рецепты которого рассылаются в ленты
+    подписчиков при публикации. Рецепты авторов с числом
+    подписчиков больше FEED_FANOUT_LIMIT читаются при запросе ленты.
+    """
+    return Q(**{f'{prefix}followers_count__lte': settings.FEED_FANOUT_LIMIT})
+
+
+def create_entries(rows, batch_size=1000):
+    """Записи лент из строк (пользователь, рецепт, автор, дата)."""
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+            for user_id, recipe_id, author_id, pub_date in rows
+        ),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+
+def push_recipe(recipe):
+    """Новый рецепт в ленты подписчиков автора."""
+    follower_ids = Follow.objects.filter(
+        is_pushed('author__'), author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    create_entries(
+        (user_id, recipe.id, recipe.author_id, recipe.pub_date)
+        for user_id in follower_ids
+    )
+
+
+def add_author(user_id, author_id):
+    """Рецепты автора в ленту нового подписчика."""
+    recipes = Recipe.objects.filter(
+        is_pushed('author__'), author_id=author_id
+    ).values_list('id', 'pub_date')
+    create_entries(
+        (user_id, recipe_id, author_id, pub_date)
+        for recipe_id, pub_date in recipes.iterator()
+    )
+
+
+@transaction.atomic
+def remove_author(user_id, author_id, followers_count):
+    """
+    Рецепты автора из ленты отписавшегося пользователя. Если
+    подписчиков у автора стало FEED_FANOUT_LIMIT, его рецепты
+    больше не читаются при запросе и рассылаются оставшимся.
+    """
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+    if followers_count == settings.FEED_FANOUT_LIMIT:
+        create_entries(calculate_feeds().filter(author_id=author_id))
+
+
+def get_feed(user_id, limit, position=None):
+    """
+    Страница ленты: [(дата публикации, id рецепта)] по убыванию даты
+    после позиции position. Записи ленты и рецепты авторов, которые
+    читаются при запросе, выбираются по limit строк и сливаются.
+    """
+    entries = FeedEntry.objects.filter(user_id=user_id).order_by(
+        '-pub_date', 'recipe_id'
+    ).values_list('pub_date', 'recipe_id')
+    pulled = Recipe.objects.filter(author__in=Follow.objects.filter(
+        ~is_pushed('author__'), user_id=user_id
+    ).values('author')).order_by('-pub_date', 'id').values_list(
+        'pub_date', 'id'
+    )
+    if position is not None:
+        pub_date, recipe_id = position
+        entries = entries.filter(
+            Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, recipe_id__gt=recipe_id)
+        )
+        pulled = pulled.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__gt=recipe_id)
+        )
+    # Рецепт может быть в обеих выборках, если у автора стало
+    # слишком много подписчиков после рассылки.
+    rows = {
+        recipe_id: pub_date
+        for pub_date, recipe_id in chain(entries[:limit], pulled[:limit])
+    }
+    return sorted(
+        ((pub_date, recipe_id) for recipe_id, pub_date in rows.items()),
+        key=lambda row: (-row[0].timestamp(), row[1]),
+    )[:limit]
+
+
+def calculate_feeds():
+    """
+    Записи лент, посчитанные заново по подпискам:
+    (пользователь, рецепт, автор, дата публикации).
+    """
+    return Recipe.objects.filter(
+        is_pushed('author__'), author__following__isnull=False
+    ).values_list(
+        'author__following__user_id', 'id', 'author_id', 'pub_date'
+    ).order_by()
+
+
+def get_feed_drift():
+    """
+    Расхождения лент с подписками: {(id пользователя, id рецепта):
+    'missing' - записи нет, 'stale' - пользователь не подписан на автора}.
+    """
+    expected = {
+        (user_id, recipe_id)
+        for user_id, recipe_id, _, _ in calculate_feeds()
+    }
+    follows = set(Follow.objects.values_list('user_id', 'author_id'))
+    drift = {}
+    for user_id, recipe_id, author_id in FeedEntry.objects.values_list(
+        'user_id', 'recipe_id', 'author_id'
+    ):
+        expected.discard((user_id, recipe_id))
+        if (user_id, author_id) not in follows:
+            drift[user_id, recipe_id] = 'stale'
+    drift.update((key, 'missing') for key in expected)
+    return drift
+
+
+@transaction.atomic
+def rebuild_feeds(batch_size=1000):
+    """Пересобирает ленты подписок с нуля."""
+    FeedEntry.objects.all().delete()
+    create_entries(
+        calculate_feeds().iterator(chunk_size=batch_size),
+        batch_size=batch_size,
+    )
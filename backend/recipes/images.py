@@ -0,0 +1,108 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+# Максимальные размеры производных изображений (ширина, высота);
+# пропорции сохраняются, изображения меньше размера не увеличиваются.
+IMAGE_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (600, 400),
+    'detail': (1200, 1200),
+}
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def get_derivative_name(name, size, extension):
+    """Имя производного файла рядом с оригиналом."""
+    root, _ = os.path.splitext(name)
+    return f'{root}_{size}.{extension}'
+
+
+def has_derivatives(image):
+    """
+    Есть ли в хранилище производные изображения для файла: detail
+    в JPEG сохраняется последним. Запрос к хранилищу - только для
+    команд; при выводе рецептов читается Recipe.image_derivatives.
+    """
+    return image.storage.exists(
+        get_derivative_name(image.name, 'detail', 'jpeg')
+    )
+
+
+def create_derivatives(image):
+    """Создаёт уменьшенные копии изображения во всех размерах и форматах."""
+    storage = image.storage
+    with storage.open(image.name, 'rb') as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original = original.convert('RGB')
+    for size, dimensions in IMAGE_SIZES.items():
+        resized = original.copy()
+        resized.thumbnail(dimensions, Image.LANCZOS)
+        for extension, (image_format, options) in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            name = get_derivative_name(image.name, size, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def delete_derivatives(storage, name):
+    """Удаляет производные изображения файла name."""
+    for size in IMAGE_SIZES:
+        for extension in IMAGE_FORMATS:
+            storage.delete(get_derivative_name(name, size, extension))
+
+
+def mark_derivatives(recipe_id, name):
+    """Отмечает, что для изображения name рецепта созданы копии."""
+    Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_derivatives=name
+    )
+
+
+def schedule_derivatives(recipe, old_name=''):
+    """
+    Создаёт уменьшенные копии изображения рецепта после фиксации
+    транзакции и удаляет копии прежнего изображения old_name: при откате
+    не остаётся лишних файлов, обработка не держит транзакцию открытой,
+    а ошибка обработки пишется в лог и не отменяет сохранение.
+    """
+    image = recipe.image
+
+    def process():
+        if old_name and old_name != image.name:
+            delete_derivatives(image.storage, old_name)
+        create_derivatives(image)
+        mark_derivatives(recipe.pk, image.name)
+
+    transaction.on_commit(process, robust=True)
+
+
+def get_image_urls(recipe):
+    """
+    Ссылки на производные изображения рецепта: {размер: {формат: url}}.
+    Пока копии не созданы, везде ссылка на оригинал.
+    """
+    image = recipe.image
+    if not image:
+        return {}
+    derived = recipe.image_derivatives == image.name
+    return {
+        size: {
+            extension: image.storage.url(
+                get_derivative_name(image.name, size, extension)
+                if derived else image.name
+            )
+            for extension in IMAGE_FORMATS
+        }
+        for size in IMAGE_SIZES
+    }
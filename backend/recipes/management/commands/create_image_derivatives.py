@@ -0,0 +1,51 @@
+from django.core.management import BaseCommand
+
+from recipes.images import (
+    create_derivatives,
+    has_derivatives,
+    mark_derivatives
+)
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Создаём уменьшенные копии изображений уже добавленных рецептов.
+    Копии, которые уже есть в хранилище, только отмечаются в рецепте.
+    """
+    help = 'Создание производных изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии, даже если они уже есть',
+        )
+
+    def handle(self, *args, **options):
+        created = marked = failed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_derivatives'
+        )
+        for recipe in recipes.iterator():
+            if not options['force']:
+                if recipe.image_derivatives == recipe.image.name:
+                    continue
+                if has_derivatives(recipe.image):
+                    mark_derivatives(recipe.id, recipe.image.name)
+                    marked += 1
+                    continue
+            try:
+                create_derivatives(recipe.image)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(
+                    f'Рецепт {recipe.id}, {recipe.image.name}: {error}'
+                )
+                continue
+            mark_derivatives(recipe.id, recipe.image.name)
+            created += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Созданы копии изображений для рецептов: {created}, '
+            f'отмечены готовые: {marked}, ошибок: {failed}')
+        )
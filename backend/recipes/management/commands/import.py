@@ -1,29 +1,334 @@
 import csv
-
-from django.core.management import BaseCommand
+import json
+import os
+import time
+from collections import namedtuple
+from io import StringIO
+from itertools import islice
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from recipes.catalog import bump_catalog_version
 from recipes.models import Ingredient, Tag
+from recipes.tag_masks import assign_tag_bits
+
+# fields - колонки таблицы, unique_fields - ключ для поиска дубликатов,
+# aliases - другие названия колонок во входных файлах.
+Catalog = namedtuple(
+    'Catalog', ('model', 'file', 'fields', 'unique_fields', 'aliases')
+)
+
+CATALOGS = {
+    'ingredients': Catalog(
+        model=Ingredient,
+        file='ingredients.csv',
+        fields=('name', 'unit'),
+        unique_fields=('name', 'unit'),
+        aliases={'measurement_unit': 'unit'},
+    ),
+    'tags': Catalog(
+        model=Tag,
+        file='tags.csv',
+        fields=('name', 'color', 'slug'),
+        unique_fields=('slug',),
+        aliases={},
+    ),
+}
+FORMATS = ('csv', 'json', 'ndjson')
+JSON_BUFFER_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
 
-MODELS_FILES = {
-    Ingredient: 'ingredients.csv',
-    Tag: 'tags.csv',
+def read_json(file):
+    """Потоковое чтение JSON-массива объектов без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_BUFFER_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON-файл должен содержать массив объектов')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(JSON_BUFFER_SIZE)
+            if not chunk:
+                raise CommandError('JSON-файл оборван')
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'ndjson': read_ndjson,
 }
 
 
+def get_format(path, file_format=None):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension == 'jsonl':
+        return 'ndjson'
+    if extension not in FORMATS:
+        raise CommandError(
+            f'Не удалось определить формат файла {path}, укажите --format'
+        )
+    return extension
+
+
+def normalize(catalog, row):
+    """Строка файла в виде кортежа значений колонок каталога."""
+    row = {
+        catalog.aliases.get(key, key): value for key, value in row.items()
+    }
+    try:
+        return tuple(str(row[field]).strip() for field in catalog.fields)
+    except KeyError as error:
+        raise CommandError(f'В строке {row} нет поля {error}')
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class Command(BaseCommand):
-    """Добавляем ингредиенты в базу из файла CSV. """
-    help = 'Импорт данных из файла csv в БД'
-
-    def handle(self, *args, **kwargs):
-        for model, file in MODELS_FILES.items():
-            with open(
-                    f'{settings.BASE_DIR}/data/{file}',
-                    'r', encoding='utf-8',
-            ) as table:
-                reader = csv.DictReader(table)
-                model.objects.bulk_create(model(**data) for data in reader)
+    """
+    Загружаем справочники ингредиентов и тегов из CSV, JSON
+    или NDJSON. Файлы читаются потоково и пишутся пачками;
+    существующие записи пропускаются (ингредиенты) или
+    обновляются (теги), поэтому команду можно запускать повторно.
+    """
+    help = 'Импорт справочников из файлов CSV, JSON и NDJSON в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'catalogs',
+            nargs='*',
+            help='Справочники для загрузки: '
+                 f'{", ".join(CATALOGS)}; по умолчанию все',
+        )
+        parser.add_argument(
+            '--file',
+            help='Путь к файлу (только для одного справочника)',
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файла, по умолчанию - по расширению',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной пачке',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет добавлено и изменено',
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY в PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        names = options['catalogs'] or tuple(CATALOGS)
+        unknown = set(names) - set(CATALOGS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные справочники: {", ".join(sorted(unknown))}'
+            )
+        if options['file'] and len(names) != 1:
+            raise CommandError('--file можно указать только '
+                               'для одного справочника')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть больше нуля')
+        self.verbosity = options['verbosity']
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        for name in names:
+            catalog = CATALOGS[name]
+            path = options['file'] or os.path.join(
+                settings.BASE_DIR, 'data', catalog.file
+            )
+            self.import_file(catalog, path, options)
+        if options['dry_run']:
+            return
+        if 'tags' in names:
+            try:
+                assign_tag_bits()
+            except ValidationError as error:
+                raise CommandError(error.messages[0])
+        bump_catalog_version()
 
         self.stdout.write(self.style.SUCCESS(
             'Данные успешно загружены')
         )
+
+    def import_file(self, catalog, path, options):
+        reader = READERS[get_format(path, options['format'])]
+        verbose_name = catalog.model._meta.verbose_name_plural
+        started = time.monotonic()
+        total = 0
+        stats = {'new': 0, 'changed': 0, 'unchanged': 0}
+        with open(path, 'r', encoding='utf-8') as file:
+            rows = (normalize(catalog, row) for row in reader(file))
+            for chunk in chunked(rows, options['chunk_size']):
+                if options['dry_run']:
+                    self.diff_chunk(catalog, chunk, stats)
+                else:
+                    self.write_chunk(catalog, chunk)
+                total += len(chunk)
+                self.report(verbose_name, total, started)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{verbose_name}: {total} строк за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} строк/с)'
+        )
+        if options['dry_run']:
+            self.stdout.write(
+                f'{verbose_name}: новых {stats["new"]}, '
+                f'изменённых {stats["changed"]}, '
+                f'без изменений {stats["unchanged"]}'
+            )
+
+    def report(self, verbose_name, total, started):
+        if self.verbosity < 2:
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{verbose_name}: обработано {total} строк, '
+            f'{total / elapsed if elapsed else total:.0f} строк/с'
+        )
+
+    def write_chunk(self, catalog, chunk):
+        try:
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy_chunk(catalog, chunk)
+                else:
+                    self.bulk_create_chunk(catalog, chunk)
+        except IntegrityError as error:
+            raise CommandError(f'Ошибка загрузки: {error}')
+
+    def get_update_fields(self, catalog):
+        return tuple(
+            field for field in catalog.fields
+            if field not in catalog.unique_fields
+        )
+
+    def bulk_create_chunk(self, catalog, chunk):
+        objects = (
+            catalog.model(**dict(zip(catalog.fields, row))) for row in chunk
+        )
+        update_fields = self.get_update_fields(catalog)
+        if update_fields:
+            # Последняя строка с тем же ключом в пачке побеждает.
+            objects = {
+                tuple(getattr(obj, field) for field in catalog.unique_fields):
+                obj for obj in objects
+            }.values()
+            catalog.model.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=catalog.unique_fields,
+                update_fields=update_fields,
+            )
+        else:
+            catalog.model.objects.bulk_create(objects, ignore_conflicts=True)
+
+    def copy_chunk(self, catalog, chunk):
+        """
+        COPY пачки во временную таблицу и INSERT ... ON CONFLICT.
+        Как и при bulk_create, из строк с одним ключом побеждает
+        последняя: номер строки во временной таблице растёт
+        в порядке COPY.
+        """
+        quote = connection.ops.quote_name
+        table = quote(catalog.model._meta.db_table)
+        temporary = quote(f'import_{catalog.model._meta.db_table}')
+        columns = ', '.join(quote(field) for field in catalog.fields)
+        key = ', '.join(quote(field) for field in catalog.unique_fields)
+        update_fields = self.get_update_fields(catalog)
+        if update_fields:
+            conflict = 'DO UPDATE SET ' + ', '.join(
+                f'{quote(field)} = EXCLUDED.{quote(field)}'
+                for field in update_fields
+            )
+        else:
+            conflict = 'DO NOTHING'
+        buffer = StringIO()
+        csv.writer(buffer).writerows(chunk)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {temporary} '
+                f'ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            cursor.execute(
+                f'ALTER TABLE {temporary} '
+                f'ADD COLUMN IF NOT EXISTS import_row bigserial'
+            )
+            cursor.copy_expert(
+                f'COPY {temporary} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT ON ({key}) {columns} FROM {temporary} '
+                f'ORDER BY {key}, import_row DESC '
+                f'ON CONFLICT ({key}) {conflict}'
+            )
+
+    def diff_chunk(self, catalog, chunk, stats):
+        """Сравнение пачки с БД без записи."""
+        rows = {
+            tuple(dict(zip(catalog.fields, row))[field]
+                  for field in catalog.unique_fields): row
+            for row in chunk
+        }
+        first_field = catalog.unique_fields[0]
+        existing = {
+            tuple(dict(zip(catalog.fields, row))[field]
+                  for field in catalog.unique_fields): row
+            for row in catalog.model.objects.filter(**{
+                f'{first_field}__in': {key[0] for key in rows}
+            }).values_list(*catalog.fields)
+        }
+        for key, row in rows.items():
+            if key not in existing:
+                stats['new'] += 1
+                if self.verbosity >= 2:
+                    self.stdout.write(f'+ {row}')
+            elif existing[key] != row:
+                stats['changed'] += 1
+                if self.verbosity >= 2:
+                    self.stdout.write(f'~ {existing[key]} -> {row}')
+            else:
+                stats['unchanged'] += 1
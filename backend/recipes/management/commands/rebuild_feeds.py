@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.feed import get_feed_drift, rebuild_feeds
+
+DRIFT_MESSAGES = {
+    'missing': 'нет в ленте',
+    'stale': 'в ленте без подписки на автора',
+}
+
+
+class Command(BaseCommand):
+    """Пересобираем ленты подписок по подпискам и рецептам."""
+    help = 'Пересборка и проверка лент подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить ленты, не пересобирая их',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            rebuild_feeds()
+        drift = get_feed_drift()
+        for (user_id, recipe_id), problem in drift.items():
+            self.stdout.write(
+                f'Пользователь {user_id}, рецепт {recipe_id}: '
+                f'{DRIFT_MESSAGES[problem]}'
+            )
+        if drift:
+            raise CommandError(f'Расхождений в лентах: {len(drift)}')
+        self.stdout.write(self.style.SUCCESS(
+            'Ленты подписок совпадают с подписками')
+        )
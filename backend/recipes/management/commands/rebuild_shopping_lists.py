@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.services import get_shopping_list_drift, rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    """Пересобираем сводные списки покупок по рецептам. """
+    help = 'Пересборка и проверка сводных списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить списки, не пересобирая их',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            rebuild_shopping_lists()
+        drift = get_shopping_list_drift()
+        for (user_id, ingredient_id), (stored, expected) in drift.items():
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'хранится {stored}, ожидается {expected}'
+            )
+        if drift:
+            raise CommandError(
+                f'Расхождений в списках покупок: {len(drift)}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Сводные списки покупок совпадают с рецептами')
+        )
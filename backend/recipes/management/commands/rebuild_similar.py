@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from recipes.models import SimilarRecipe
+from recipes.similarity import rebuild_similar
+
+
+class Command(BaseCommand):
+    """
+    Пересчитываем похожие рецепты: TF-IDF по ингредиентам
+    и тегам, косинусное сходство.
+    """
+    help = 'Пересчёт похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=settings.SIMILAR_RECIPES_LIMIT,
+            help='Сколько похожих рецептов хранить для каждого',
+        )
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1:
+            raise CommandError('--limit должен быть больше нуля')
+        started = time.monotonic()
+        rebuild_similar(options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожих рецептов: {SimilarRecipe.objects.count()} '
+            f'за {time.monotonic() - started:.1f} с.')
+        )
@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.counters import get_counter_drift, recount
+
+
+class Command(BaseCommand):
+    """
+    Пересчитываем счётчики избранного, списков покупок,
+    рецептов и подписчиков по данным.
+    """
+    help = 'Пересчёт и проверка денормализованных счётчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить счётчики, не исправляя их',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            for (model, field), count in recount().items():
+                if count:
+                    self.stdout.write(
+                        f'{model}.{field}: исправлено строк {count}'
+                    )
+        drift = get_counter_drift()
+        for (model, field), rows in drift.items():
+            for pk, (stored, actual) in rows.items():
+                self.stdout.write(
+                    f'{model}.{field}, id {pk}: '
+                    f'хранится {stored}, фактически {actual}'
+                )
+        if drift:
+            raise CommandError(
+                f'Расхождений в счётчиках: '
+                f'{sum(len(rows) for rows in drift.values())}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Счётчики совпадают с данными')
+        )
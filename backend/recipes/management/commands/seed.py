@@ -0,0 +1,219 @@
+import random
+import time
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.counters import recount
+from recipes.feed import rebuild_feeds
+from recipes.images import create_derivatives
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeShoppingList,
+    RecipeTag,
+    Tag
+)
+from recipes.search import rebuild_search_index
+from recipes.pantry import reset_pantry
+from recipes.services import rebuild_shopping_lists, sync_suspended
+from recipes.similarity import rebuild_similar
+from recipes.tag_masks import rebuild_tag_masks
+from users.models import Follow, User
+
+SEED_PASSWORD = 'Qwerty123'
+SEED_IMAGE = 'recipes/images/seed.png'
+WORDS = (
+    'Суп', 'Салат', 'Пирог', 'Омлет', 'Рагу', 'Паста', 'Каша', 'Запеканка',
+    'Блины', 'Котлеты', 'Плов', 'Борщ', 'Сырники', 'Шарлотка', 'Гуляш',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'острый', 'сытный', 'лёгкий',
+    'праздничный', 'овощной', 'бабушкин', 'пряный',
+)
+
+
+def get_seed_image():
+    """Общая картинка для сгенерированных рецептов."""
+    if not default_storage.exists(SEED_IMAGE):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), (255, 183, 3)).save(buffer, 'PNG')
+        default_storage.save(SEED_IMAGE, ContentFile(buffer.getvalue()))
+        create_derivatives(Recipe(image=SEED_IMAGE).image)
+    return SEED_IMAGE
+
+
+class Command(BaseCommand):
+    """
+    Заполняем БД воспроизводимыми тестовыми данными для нагрузочных
+    проверок: пользователи, рецепты из реальных ингредиентов и тегов,
+    подписки, избранное и списки покупок. При одинаковом --seed
+    получаются одинаковые данные.
+    """
+    help = 'Генерация тестовых данных для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100,
+                            help='Количество пользователей')
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='Количество рецептов')
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок у каждого пользователя')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном у пользователя')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в списке покупок у пользователя')
+        parser.add_argument('--ingredients', type=int, default=8,
+                            help='Наибольшее число ингредиентов в рецепте')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Начальное значение генератора')
+        parser.add_argument('--prefix', default='seed',
+                            help='Префикс имён пользователей')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество строк в одном INSERT')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить ранее созданные данные с тем '
+                                 'же префиксом')
+
+    def handle(self, *args, **options):
+        for option in ('users', 'recipes', 'ingredients', 'batch_size'):
+            if options[option] < 1:
+                raise CommandError(f'--{option.replace("_", "-")} '
+                                   f'должен быть больше нуля')
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError('Справочники пусты, сначала выполните import')
+        prefix = options['prefix']
+        users = User.objects.filter(username__startswith=prefix)
+        if options['clear']:
+            with sync_suspended():
+                users.delete()
+        elif users.exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                f'укажите --clear или другой --prefix'
+            )
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        with transaction.atomic():
+            users = self.create_users(prefix, options['users'])
+            recipes = self.create_recipes(
+                users, ingredient_ids, tag_ids, options
+            )
+            self.create_relations(users, recipes, options)
+            rebuild_search_index(Recipe.objects.filter(
+                author__username__startswith=prefix
+            ))
+            rebuild_shopping_lists(batch_size=self.batch_size)
+            rebuild_tag_masks(batch_size=self.batch_size)
+            recount()
+            rebuild_feeds(batch_size=self.batch_size)
+            rebuild_similar(batch_size=self.batch_size)
+            reset_pantry()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)} '
+            f'за {time.monotonic() - started:.1f} с. '
+            f'Пароль пользователей: {SEED_PASSWORD}')
+        )
+
+    def sample(self, population, count):
+        return self.rng.sample(population, min(count, len(population)))
+
+    def create_users(self, prefix, count):
+        password = make_password(SEED_PASSWORD)
+        return User.objects.bulk_create(
+            (
+                User(
+                    username=f'{prefix}{number}',
+                    email=f'{prefix}{number}@recipebook.ru',
+                    first_name='Тестовый',
+                    last_name=f'Пользователь {number}',
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+
+    def create_recipes(self, users, ingredient_ids, tag_ids, options):
+        image = get_seed_image()
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=self.rng.choice(users),
+                    name=f'{self.rng.choice(WORDS)} '
+                         f'{self.rng.choice(ADJECTIVES)} {number}',
+                    text=' '.join(
+                        self.rng.choices(ADJECTIVES, k=self.rng.randint(5, 30))
+                    ),
+                    image=image,
+                    image_derivatives=image,
+                    cooking_time=self.rng.randint(1, 180),
+                )
+                for number in range(options['recipes'])
+            ),
+            batch_size=self.batch_size,
+        )
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500),
+                )
+                for recipe in recipes
+                for ingredient_id in self.sample(
+                    ingredient_ids,
+                    self.rng.randint(1, options['ingredients'])
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        RecipeTag.objects.bulk_create(
+            (
+                RecipeTag(recipe=recipe, tag_id=tag_id)
+                for recipe in recipes
+                for tag_id in self.sample(
+                    tag_ids, self.rng.randint(1, len(tag_ids))
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        return recipes
+
+    def create_relations(self, users, recipes, options):
+        Follow.objects.bulk_create(
+            (
+                Follow(user=user, author=author)
+                for user in users
+                for author in [
+                    author
+                    for author in self.sample(users, options['follows'] + 1)
+                    if author != user
+                ][:options['follows']]
+            ),
+            batch_size=self.batch_size,
+        )
+        for model, count in (
+            (FavoriteRecipe, options['favorites']),
+            (RecipeShoppingList, options['cart']),
+        ):
+            model.objects.bulk_create(
+                (
+                    model(user=user, recipe=recipe)
+                    for user in users
+                    for recipe in self.sample(recipes, count)
+                ),
+                batch_size=self.batch_size,
+            )
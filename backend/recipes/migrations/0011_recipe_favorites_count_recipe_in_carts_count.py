@@ -0,0 +1,51 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:19
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# (модель, поле, модель для подсчёта, поле связи)
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteRecipe', 'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'recipes.RecipeShoppingList',
+     'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, source, relation in COUNTERS:
+        apps.get_model(model).objects.update(**{field: Coalesce(
+            Subquery(
+                apps.get_model(source).objects.filter(
+                    **{relation: OuterRef('pk')}
+                ).order_by().values(relation).annotate(
+                    count=Count('pk')
+                ).values('count'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_pub_date_id_idx'),
+        ('users', '0003_user_followers_count_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
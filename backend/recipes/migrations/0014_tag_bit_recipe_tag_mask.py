@@ -0,0 +1,54 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:56
+
+import django.core.validators
+from collections import defaultdict
+
+from django.db import migrations, models
+
+TAG_BITS = 63
+
+
+def fill_tag_masks(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeTag = apps.get_model('recipes', 'RecipeTag')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > TAG_BITS:
+        raise ValueError(f'Тегов может быть не больше {TAG_BITS}.')
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ('bit',))
+    masks = defaultdict(int)
+    for recipe_id, bit in RecipeTag.objects.values_list(
+        'recipe_id', 'tag__bit'
+    ).iterator(chunk_size=5000):
+        masks[recipe_id] |= 1 << bit
+    by_mask = defaultdict(list)
+    for recipe_id, mask in masks.items():
+        by_mask[mask].append(recipe_id)
+    for mask, recipe_ids in by_mask.items():
+        for start in range(0, len(recipe_ids), 1000):
+            Recipe.objects.filter(
+                id__in=recipe_ids[start:start + 1000]
+            ).update(tag_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, validators=[django.core.validators.MaxValueValidator(62)], verbose_name='Бит в маске тегов рецепта'),
+        ),
+        migrations.RunPython(fill_tag_masks, migrations.RunPython.noop),
+    ]
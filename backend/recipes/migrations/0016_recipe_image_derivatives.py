@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_deliberate_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_derivatives',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение с уменьшенными копиями'),
+        ),
+    ]
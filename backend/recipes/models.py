@@ -1,10 +1,15 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
 User = get_user_model()
 
+# Сколько тегов помещается в Recipe.tag_mask (bigint без знакового бита).
+TAG_BITS = 63
+
 
 class Tag(models.Model):
     """Модель тега."""
@@ -22,6 +27,14 @@ class Tag(models.Model):
         verbose_name='Слаг',
         unique=True,
     )
+    # Назначается при сохранении, после импорта - recipes.tag_masks.
+    bit = models.PositiveSmallIntegerField(
+        null=True,
+        unique=True,
+        editable=False,
+        validators=[MaxValueValidator(TAG_BITS - 1)],
+        verbose_name='Бит в маске тегов рецепта',
+    )
 
     class Meta:
         ordering = ('name',)
@@ -37,6 +50,22 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def get_free_bits(cls):
+        """Не занятые тегами биты маски по возрастанию."""
+        used = set(cls.objects.exclude(bit=None).values_list('bit', flat=True))
+        return [bit for bit in range(TAG_BITS) if bit not in used]
+
+    def clean(self):
+        if self.bit is None and not self.get_free_bits():
+            raise ValidationError(f'Тегов может быть не больше {TAG_BITS}.')
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.clean()
+            self.bit = self.get_free_bits()[0]
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     """Модель ингредиента."""
@@ -66,11 +95,13 @@ class Ingredient(models.Model):
 
 class Recipe(models.Model):
     """Модель рецепта."""
+    # Поиск по автору - индекс recipe_author_pub_date_idx.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
         verbose_name='Автор рецепта',
+        db_index=False,
     )
     name = models.CharField(
         verbose_name='Название рецепта',
@@ -81,6 +112,14 @@ class Recipe(models.Model):
         verbose_name='Фото блюда',
         upload_to='recipes/images/',
     )
+    # Изображение, для которого созданы уменьшенные копии
+    # (recipes.images): пока имя не совпадает с image, отдаётся оригинал.
+    image_derivatives = models.CharField(
+        verbose_name='Изображение с уменьшенными копиями',
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(verbose_name='Описание рецепта')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -110,9 +149,44 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    # Поддерживается recipes.search; GIN-индексы по вектору
+    # и триграммам названия создаются миграцией только в PostgreSQL.
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
+    # Поддерживаются recipes.counters.
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+    # Биты Tag.bit тегов рецепта, поддерживается recipes.tag_masks.
+    tag_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов',
+    )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', 'id')
+        indexes = (
+            models.Index(
+                fields=('-pub_date', 'id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            # Рецепты авторов, которые читаются в ленту при запросе.
+            models.Index(
+                fields=('author', '-pub_date', 'id'),
+                name='recipe_author_pub_date_idx',
+            ),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -190,11 +264,13 @@ class RecipeTag(models.Model):
 
 class FavoriteRecipe(models.Model):
     """Модель рецепта из избранного списка."""
+    # Поиск по пользователю - уникальный индекс unique_elected.
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
         related_name='elected',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
@@ -229,11 +305,13 @@ class RecipeShoppingList(models.Model):
         verbose_name='Рецепт',
         related_name='shopping'
     )
+    # Поиск по пользователю - уникальный индекс unique_shopping_pair.
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
         related_name='shopping_user',
+        db_index=False,
     )
 
     class Meta:
@@ -252,3 +330,125 @@ class RecipeShoppingList(models.Model):
             f'У пользователя {self.user} рецепт {self.recipe} '
             f'в списке покупок'
         )
+
+
+class ShoppingListIngredient(models.Model):
+    """
+    Сводный список покупок пользователя: суммарное количество
+    ингредиента по всем рецептам из списка покупок.
+    Поддерживается изменениями на разницу, см. recipes.services.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Суммарное количество',
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient',),
+                name='unique_shopping_ingredient',
+            ),
+        )
+        verbose_name = 'Ингредиент из списка покупок'
+        verbose_name_plural = 'Сводные списки покупок'
+
+    def __str__(self):
+        return (
+            f'{self.ingredient} - {self.amount} '
+            f'в списке покупок пользователя {self.user}'
+        )
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты пользователя: рецепт автора из его подписок.
+    Автор и дата публикации повторяют рецепт, чтобы читать ленту
+    и чистить её при отписке без соединения с рецептами.
+    Поддерживается recipes.feed.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='feed_entries',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор рецепта',
+        related_name='+',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', 'recipe'),
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='feed_user_author_idx',
+            ),
+        )
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+
+    def __str__(self):
+        return f'{self.recipe} в ленте пользователя {self.user}'
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт: один из ближайших к recipe по ингредиентам
+    и тегам. Поддерживается recipes.similarity.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='similar_recipes',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='+',
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe',
+            ),
+        )
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}'
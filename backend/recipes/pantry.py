@@ -0,0 +1,109 @@
+from uuid import uuid4
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+
+# Эпоха журнала - случайная метка. Номера версий и записи журнала
+# хранятся в пределах эпохи; если счётчик версий вытеснен из кеша,
+# начинается новая эпоха, и индексы перестраиваются целиком.
+PANTRY_EPOCH_KEY = 'recipes:pantry_epoch'
+PANTRY_VERSION_KEY = 'recipes:pantry_version:{}'
+PANTRY_CHANGE_KEY = 'recipes:pantry_change:{}:{}'
+# Сколько хранятся записи журнала. Процесс, отставший сильнее,
+# перестраивает индекс целиком.
+PANTRY_CHANGE_TIMEOUT = 24 * 60 * 60
+# Больше изменений дешевле прочитать полной перестройкой индекса.
+PANTRY_CHANGES_MAX = 1000
+# Кеши с атомарным incr. В остальных (например, FileBasedCache)
+# два изменения могут получить один номер, поэтому журнал не ведётся:
+# растёт только версия, и индексы перестраиваются целиком.
+ATOMIC_CACHES = (RedisCache, BaseMemcachedCache, LocMemCache)
+
+
+def has_change_log():
+    """Ведётся ли журнал изменений в общем кеше."""
+    return isinstance(caches['default'], ATOMIC_CACHES)
+
+
+def get_pantry_version():
+    """
+    Версия состава рецептов для индексов «что приготовить»
+    в памяти процессов: (эпоха, номер последней записи журнала
+    изменений в общем кеше).
+    """
+    epoch = cache.get(PANTRY_EPOCH_KEY)
+    version = (
+        None if epoch is None
+        else cache.get(PANTRY_VERSION_KEY.format(epoch))
+    )
+    if version is None:
+        new_epoch = uuid4().hex
+        cache.add(PANTRY_VERSION_KEY.format(new_epoch), 0, timeout=None)
+        if epoch is None:
+            cache.add(PANTRY_EPOCH_KEY, new_epoch, timeout=None)
+        else:
+            # Счётчик вытеснен: номера в старой эпохе начались бы
+            # заново и совпали бы с версиями, уже известными процессам.
+            cache.set(PANTRY_EPOCH_KEY, new_epoch, timeout=None)
+        epoch = cache.get(PANTRY_EPOCH_KEY, new_epoch)
+        version = cache.get(PANTRY_VERSION_KEY.format(epoch), 0)
+    return epoch, version
+
+
+def _next_version():
+    """
+    Новая версия журнала или None, если счётчик вытеснен
+    и началась новая эпоха.
+    """
+    epoch, _ = get_pantry_version()
+    try:
+        return epoch, cache.incr(PANTRY_VERSION_KEY.format(epoch))
+    except ValueError:
+        get_pantry_version()
+        return None
+
+
+def record_pantry_change(recipe_id):
+    """
+    Отмечает в журнале изменение состава рецепта (или его удаление)
+    после фиксации транзакции: индексы других процессов
+    перечитают только этот рецепт.
+    """
+    def record():
+        version = _next_version()
+        if version is not None and has_change_log():
+            cache.set(PANTRY_CHANGE_KEY.format(*version), recipe_id,
+                      timeout=PANTRY_CHANGE_TIMEOUT)
+    transaction.on_commit(record)
+
+
+def reset_pantry():
+    """
+    Отмечает массовое изменение рецептов: версия растёт без записи
+    в журнале, и индексы перестраиваются целиком.
+    """
+    transaction.on_commit(_next_version)
+
+
+def get_pantry_changes(since, version):
+    """
+    Id рецептов, изменённых после версии since до version включительно,
+    или None, если журнал не ведётся, эпоха сменилась или часть
+    журнала уже недоступна (или кеш очищен).
+    """
+    (since_epoch, since), (epoch, version) = since, version
+    if (
+        not has_change_log()
+        or since_epoch != epoch
+        or not 0 <= version - since <= PANTRY_CHANGES_MAX
+    ):
+        return None
+    keys = [PANTRY_CHANGE_KEY.format(epoch, number)
+            for number in range(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        return None
+    return set(changes.values())
@@ -0,0 +1,102 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramWordSimilarity
+)
+from django.db import connections
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def get_search_vector():
+    """Вектор поиска по рецепту: название важнее описания."""
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_index(recipe):
+    """Обновляет поисковый индекс рецепта после сохранения."""
+    connection = connections[recipe._state.db]
+    if connection.vendor == 'postgresql':
+        type(recipe).objects.using(recipe._state.db).filter(
+            pk=recipe.pk
+        ).update(search_vector=get_search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', (recipe.pk,)
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'VALUES (%s, %s, %s)',
+                (recipe.pk, recipe.name, recipe.text)
+            )
+
+
+def rebuild_search_index(queryset):
+    """Обновляет поисковый индекс всех рецептов из queryset разом."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        queryset.update(search_vector=get_search_vector())
+    elif connection.vendor == 'sqlite':
+        query, params = queryset.order_by().values_list(
+            'id', 'name', 'text'
+        ).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+                f'(SELECT id FROM ({query}))', params
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) {query}',
+                params
+            )
+
+
+def remove_from_search_index(recipe):
+    """Удаляет рецепт из поискового индекса SQLite."""
+    connection = connections[recipe._state.db]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', (recipe.pk,)
+            )
+
+
+def search_recipes(queryset, value):
+    """
+    Рецепты, подходящие под поисковую строку, по убыванию релевантности.
+    В PostgreSQL - полнотекстовый поиск с учётом морфологии и поиск
+    по триграммам названия для запросов с опечатками,
+    в SQLite - поиск по началу слов через FTS5.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=TrigramWordSimilarity(value, 'name'),
+        ).filter(
+            Q(search_vector=query) | Q(name__trigram_word_similar=value)
+        ).order_by('-rank', '-similarity', '-pub_date')
+    terms = re.findall(r'\w+', value)
+    if not terms:
+        return queryset.none()
+    match = ' '.join(f'"{term}"*' for term in terms)
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match,)
+    )).annotate(rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipes_recipe.id',
+        (match,),
+        output_field=FloatField(),
+    )).order_by('-rank', '-pub_date')
@@ -0,0 +1,231 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from recipes.counters import change_counters
+from recipes.models import (
+    RecipeIngredient,
+    RecipeShoppingList,
+    ShoppingListIngredient
+)
+
+_sync_suspended = ContextVar('sync_suspended', default=False)
+
+
+@contextmanager
+def sync_suspended():
+    """
+    Отключает обновление сводных списков покупок и счётчиков
+    в обработчиках сигналов: массовые операции обновляют их
+    сами или пересчитывают после.
+    """
+    token = _sync_suspended.set(True)
+    try:
+        yield
+    finally:
+        _sync_suspended.reset(token)
+
+
+def is_sync_suspended():
+    return _sync_suspended.get()
+
+
+def get_recipe_amounts(recipe):
+    """Количество каждого ингредиента в рецепте: {id ингредиента: amount}."""
+    return dict(RecipeIngredient.objects.filter(recipe=recipe).values_list(
+        'ingredient_id', 'amount'
+    ))
+
+
+@transaction.atomic
+def apply_shopping_list_deltas(user_ids, deltas):
+    """
+    Изменяет сводные списки покупок пользователей
+    на величины deltas {id ингредиента: изменение количества}.
+    Строки с нулевым количеством удаляются.
+    """
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+    ShoppingListIngredient.objects.bulk_create(
+        (
+            ShoppingListIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, amount=0
+            )
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ),
+        ignore_conflicts=True,
+    )
+    items = ShoppingListIngredient.objects.filter(
+        user_id__in=user_ids,
+        ingredient_id__in=deltas,
+    )
+    items.update(amount=F('amount') + Case(
+        *(
+            When(ingredient_id=ingredient_id, then=Value(delta))
+            for ingredient_id, delta in deltas.items()
+        ),
+        default=Value(0),
+    ))
+    items.filter(amount__lte=0).delete()
+
+
+def get_recipes_amounts(recipe_ids):
+    """Суммарное количество каждого ингредиента в рецептах."""
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).values_list('ingredient_id', 'total').order_by())
+
+
+def add_to_shopping_list(user_id, recipe):
+    """Добавляет ингредиенты рецепта в сводный список покупок."""
+    apply_shopping_list_deltas([user_id], get_recipe_amounts(recipe))
+
+
+def remove_from_shopping_list(user_id, recipe):
+    """Вычитает ингредиенты рецепта из сводного списка покупок."""
+    apply_shopping_list_deltas([user_id], {
+        ingredient_id: -amount
+        for ingredient_id, amount in get_recipe_amounts(recipe).items()
+    })
+
+
+def recipe_links_changed(model, user_id, recipe_ids, sign):
+    """
+    Счётчики и сводный список покупок после массового добавления
+    (sign=1) или удаления (sign=-1) рецептов пользователя
+    в избранном или списке покупок.
+    """
+    change_counters(model, recipe_ids, sign)
+    if model is RecipeShoppingList and recipe_ids:
+        apply_shopping_list_deltas([user_id], {
+            ingredient_id: sign * amount
+            for ingredient_id, amount
+            in get_recipes_amounts(recipe_ids).items()
+        })
+
+
+@transaction.atomic
+def add_recipes(model, user_id, recipe_ids):
+    """
+    Добавляет рецепты в избранное или список покупок (model)
+    одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+    Возвращает id добавленных рецептов: строки, которые уже были
+    или вставлены параллельным запросом, не учитываются
+    в счётчиках и списке покупок.
+    """
+    if not recipe_ids:
+        return []
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    user, recipe = (
+        quote_name(model._meta.get_field(name).column)
+        for name in ('user', 'recipe')
+    )
+    rows = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user}, {recipe}) VALUES {rows} '
+            f'ON CONFLICT DO NOTHING RETURNING {recipe}',
+            [
+                value for recipe_id in recipe_ids
+                for value in (user_id, recipe_id)
+            ],
+        )
+        inserted = {recipe_id for recipe_id, in cursor.fetchall()}
+    added = [recipe_id for recipe_id in recipe_ids if recipe_id in inserted]
+    recipe_links_changed(model, user_id, added, 1)
+    return added
+
+
+@transaction.atomic
+def remove_recipes(model, user_id, recipe_ids):
+    """
+    Убирает рецепты из избранного или списка покупок (model)
+    одним DELETE. Возвращает id убранных рецептов.
+    """
+    links = model.objects.filter(user_id=user_id, recipe_id__in=recipe_ids)
+    removed = list(
+        links.select_for_update().values_list('recipe_id', flat=True)
+    )
+    with sync_suspended():
+        links.delete()
+    recipe_links_changed(model, user_id, removed, -1)
+    return removed
+
+
+def change_recipe_amounts(recipe, old_amounts, new_amounts):
+    """
+    Переносит изменение состава рецепта в сводные списки
+    покупок всех пользователей, у которых он в списке покупок.
+    """
+    deltas = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    if not any(deltas.values()):
+        return
+    user_ids = list(RecipeShoppingList.objects.filter(
+        recipe=recipe
+    ).values_list('user_id', flat=True))
+    apply_shopping_list_deltas(user_ids, deltas)
+
+
+def calculate_shopping_lists():
+    """Сводные списки покупок, посчитанные заново по рецептам."""
+    return RecipeIngredient.objects.values(
+        'ingredient_id',
+        shopper_id=F('recipe__shopping__user'),
+    ).filter(shopper_id__isnull=False).annotate(
+        total=Sum('amount'),
+    ).values_list('shopper_id', 'ingredient_id', 'total').order_by()
+
+
+def get_shopping_list_drift():
+    """
+    Расхождения сводных списков покупок с рецептами:
+    {(id пользователя, id ингредиента): (хранимое, ожидаемое)}.
+    """
+    expected = {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in calculate_shopping_lists()
+    }
+    stored = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in ShoppingListIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        )
+    }
+    return {
+        key: (stored.get(key), expected.get(key))
+        for key in expected.keys() | stored.keys()
+        if stored.get(key) != expected.get(key)
+    }
+
+
+@transaction.atomic
+def rebuild_shopping_lists(batch_size=1000):
+    """Пересобирает сводные списки покупок с нуля."""
+    ShoppingListIngredient.objects.all().delete()
+    ShoppingListIngredient.objects.bulk_create(
+        (
+            ShoppingListIngredient(
+                user_id=user_id, ingredient_id=ingredient_id, amount=total
+            )
+            for user_id, ingredient_id, total
+            in calculate_shopping_lists().iterator(chunk_size=batch_size)
+        ),
+        batch_size=batch_size,
+    )
@@ -0,0 +1,154 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete
+)
+from django.dispatch import receiver
+
+from recipes.catalog import bump_catalog_version
+from recipes.counters import change_counter, get_counters
+from recipes.feed import add_author, push_recipe, remove_author
+from recipes.models import (
+    FavoriteRecipe,
+    Ingredient,
+    Recipe,
+    RecipeShoppingList,
+    Tag
+)
+from recipes.pantry import record_pantry_change, reset_pantry
+from recipes.search import remove_from_search_index, update_search_index
+from recipes.services import (
+    add_to_shopping_list,
+    is_sync_suspended,
+    remove_from_shopping_list
+)
+from recipes.tag_masks import add_tags, remove_tag, remove_tags
+from users.models import Follow
+
+
+@receiver(post_save, sender=RecipeShoppingList)
+def shopping_list_added(sender, instance, created, **kwargs):
+    """Рецепт добавлен в список покупок."""
+    if created and not is_sync_suspended():
+        add_to_shopping_list(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=RecipeShoppingList)
+def shopping_list_removed(sender, instance, **kwargs):
+    """
+    Рецепт убран из списка покупок. Обрабатывается до удаления,
+    чтобы при каскадном удалении рецепта его ингредиенты
+    ещё были в базе.
+    """
+    if not is_sync_suspended():
+        remove_from_shopping_list(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    """Обновление поискового индекса рецепта."""
+    update_search_index(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Удаление рецепта из поискового индекса и поиска по продуктам."""
+    remove_from_search_index(instance)
+    if not is_sync_suspended():
+        record_pantry_change(instance.id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalog_changed(sender, **kwargs):
+    """Изменился справочник тегов или ингредиентов."""
+    bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Маски тегов рецептов при изменении связей через recipe.tags."""
+    if is_sync_suspended():
+        return
+    if action == 'post_clear':
+        if reverse:
+            remove_tag(instance)
+        else:
+            type(instance).objects.filter(pk=instance.pk).update(tag_mask=0)
+        return
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    if reverse:
+        recipe_ids, tag_ids = pk_set, [instance.pk]
+    else:
+        recipe_ids, tag_ids = [instance.pk], pk_set
+    if action == 'post_add':
+        add_tags(recipe_ids, tag_ids)
+    else:
+        remove_tags(recipe_ids, tag_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    """Удалённый тег убирается из масок рецептов одним запросом."""
+    if instance.bit is not None:
+        remove_tag(instance)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    """Ингредиент удалён из всех рецептов."""
+    reset_pantry()
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=RecipeShoppingList)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def counted_created(sender, instance, created, **kwargs):
+    """Увеличение счётчиков, считающих строки этой модели."""
+    if created and not is_sync_suspended():
+        for counter in get_counters():
+            if counter.source is sender:
+                change_counter(counter, instance, 1)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=RecipeShoppingList)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def counted_deleted(sender, instance, **kwargs):
+    """Уменьшение счётчиков, считающих строки этой модели."""
+    if is_sync_suspended():
+        return
+    for counter in get_counters():
+        if counter.source is sender:
+            change_counter(counter, instance, -1)
+
+
+# Обработчики лент объявлены после счётчиков: при отписке
+# followers_count автора уже уменьшен.
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    """Новый рецепт в ленты подписчиков."""
+    if created and not is_sync_suspended():
+        push_recipe(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    """Рецепты автора в ленту нового подписчика."""
+    if created and not is_sync_suspended():
+        add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Рецепты автора из ленты отписавшегося пользователя."""
+    if not is_sync_suspended():
+        remove_author(instance.user_id, instance.author_id,
+                      instance.author.followers_count)
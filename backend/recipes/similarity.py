@@ -0,0 +1,228 @@
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag, SimilarRecipe
+
+# Признаки рецепта: ('i', id ингредиента) и ('t', id тега).
+INGREDIENT, TAG = 'i', 't'
+# Кандидаты в похожие ищутся только по ингредиентам, которые есть
+# не больше чем в CANDIDATE_MAX_SHARE рецептов (но не меньше чем
+# в CANDIDATE_MIN_DF): общая соль или тег почти ничего не говорят,
+# хотя в оценку сходства кандидатов входят.
+CANDIDATE_MAX_SHARE = 0.1
+CANDIDATE_MIN_DF = 100
+# Сколько кандидатов с наибольшим числом общих ингредиентов
+# оценивается при обновлении одного рецепта.
+CANDIDATE_LIMIT = 500
+
+
+def load_features(recipe_ids=None):
+    """{id рецепта: множество признаков} из ингредиентов и тегов."""
+    features = defaultdict(set)
+    for model, kind, field in (
+        (RecipeIngredient, INGREDIENT, 'ingredient_id'),
+        (RecipeTag, TAG, 'tag_id'),
+    ):
+        rows = model.objects.values_list('recipe_id', field).order_by()
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        for recipe_id, feature_id in rows.iterator(chunk_size=5000):
+            features[recipe_id].add((kind, feature_id))
+    return features
+
+
+def load_frequencies(features=None):
+    """
+    {признак: число рецептов с ним} для признаков features
+    или для всех.
+    """
+    frequencies = {}
+    for model, kind, field in (
+        (RecipeIngredient, INGREDIENT, 'ingredient_id'),
+        (RecipeTag, TAG, 'tag_id'),
+    ):
+        rows = model.objects.values(field).annotate(
+            count=Count('id')
+        ).values_list(field, 'count').order_by()
+        if features is not None:
+            rows = rows.filter(**{f'{field}__in': [
+                feature_id for feature_kind, feature_id in features
+                if feature_kind == kind
+            ]})
+        frequencies.update(
+            ((kind, feature_id), count) for feature_id, count in rows
+        )
+    return frequencies
+
+
+def is_selective(feature, frequencies, total):
+    """Признак, по которому ищутся кандидаты в похожие."""
+    return feature[0] == INGREDIENT and frequencies.get(feature, 0) <= max(
+        CANDIDATE_MAX_SHARE * total, CANDIDATE_MIN_DF
+    )
+
+
+class RecipeVectors:
+    """
+    TF-IDF векторы рецептов по признакам, нормированные так,
+    что скалярное произведение равно косинусу угла между ними.
+    Признак в рецепте либо есть, либо нет, поэтому вес - это idf.
+    """
+
+    def __init__(self, features, frequencies, total):
+        self.frequencies = frequencies
+        self.total = total
+        self.vectors = {
+            recipe_id: self.vectorize(recipe_features)
+            for recipe_id, recipe_features in features.items()
+            if recipe_features
+        }
+
+    def vectorize(self, features):
+        weights = {
+            feature: math.log((1 + self.total)
+                              / (1 + self.frequencies.get(feature, 0))) + 1
+            for feature in features
+        }
+        norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+        return {feature: weight / norm for feature, weight in weights.items()}
+
+    def similarity(self, recipe_id, other_id):
+        vector, other = self.vectors[recipe_id], self.vectors[other_id]
+        if len(other) < len(vector):
+            vector, other = other, vector
+        return sum(
+            weight * other.get(feature, 0)
+            for feature, weight in vector.items()
+        )
+
+    def nearest(self, recipe_id, candidate_ids, limit):
+        """[(id рецепта, сходство)] ближайших из candidate_ids."""
+        scores = (
+            (other_id, self.similarity(recipe_id, other_id))
+            for other_id in candidate_ids if other_id != recipe_id
+        )
+        return heapq.nlargest(
+            limit,
+            (item for item in scores if item[1] > 0),
+            key=lambda item: (item[1], -item[0]),
+        )
+
+
+def get_similar(vectors, limit):
+    """
+    Ближайшие рецепты для всех рецептов из vectors
+    по инвертированному индексу избирательных признаков.
+    """
+    postings = defaultdict(list)
+    for recipe_id, vector in vectors.vectors.items():
+        for feature in vector:
+            if is_selective(feature, vectors.frequencies, vectors.total):
+                postings[feature].append(recipe_id)
+    for recipe_id, vector in vectors.vectors.items():
+        candidate_ids = {
+            other_id
+            for feature in vector if feature in postings
+            for other_id in postings[feature]
+        }
+        yield recipe_id, vectors.nearest(recipe_id, candidate_ids, limit)
+
+
+@transaction.atomic
+def rebuild_similar(limit=None, batch_size=1000):
+    """Пересчитывает похожие рецепты для всех рецептов."""
+    limit = limit or settings.SIMILAR_RECIPES_LIMIT
+    vectors = RecipeVectors(load_features(), load_frequencies(),
+                            Recipe.objects.count())
+    SimilarRecipe.objects.all().delete()
+    SimilarRecipe.objects.bulk_create(
+        (
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for recipe_id, nearest in get_similar(vectors, limit)
+            for similar_id, score in nearest
+        ),
+        batch_size=batch_size,
+    )
+
+
+def get_candidates(recipe_id, features, total):
+    """
+    Кандидаты в похожие на рецепт: рецепты с наибольшим числом
+    общих избирательных ингредиентов и те, где он уже в списке.
+    """
+    frequencies = load_frequencies(features)
+    candidate_ids = set(RecipeIngredient.objects.filter(
+        ingredient_id__in=[
+            feature_id for kind, feature_id in features
+            if is_selective((kind, feature_id), frequencies, total)
+        ],
+    ).exclude(recipe_id=recipe_id).values('recipe_id').annotate(
+        shared=Count('id')
+    ).order_by('-shared', 'recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:CANDIDATE_LIMIT])
+    candidate_ids.update(SimilarRecipe.objects.filter(
+        similar_id=recipe_id
+    ).values_list('recipe_id', flat=True))
+    return candidate_ids
+
+
+@transaction.atomic
+def refresh_similar(recipe_id, limit=None):
+    """
+    Обновляет похожие рецепты после изменения состава рецепта:
+    его собственный список и его место в списках кандидатов.
+    Частоты признаков в остальных строках уточняет периодический
+    rebuild_similar.
+    """
+    limit = limit or settings.SIMILAR_RECIPES_LIMIT
+    total = Recipe.objects.count()
+    own_features = load_features([recipe_id])[recipe_id]
+    SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+    if not own_features:
+        SimilarRecipe.objects.filter(similar_id=recipe_id).delete()
+        return
+    candidate_ids = get_candidates(recipe_id, own_features, total)
+    features = load_features(candidate_ids | {recipe_id})
+    vectors = RecipeVectors(
+        features, load_frequencies(set().union(*features.values())), total
+    )
+    candidate_ids &= vectors.vectors.keys()
+    new_rows = [
+        SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                      score=score)
+        for similar_id, score in vectors.nearest(
+            recipe_id, candidate_ids, limit
+        )
+    ]
+    lists = defaultdict(dict)
+    for row in SimilarRecipe.objects.filter(recipe_id__in=candidate_ids):
+        lists[row.recipe_id][row.similar_id] = row
+    stale_ids = []
+    for candidate_id in candidate_ids:
+        rows = lists[candidate_id]
+        if recipe_id in rows:
+            stale_ids.append(rows.pop(recipe_id).id)
+        score = vectors.similarity(candidate_id, recipe_id)
+        if score <= 0:
+            continue
+        rows[recipe_id] = SimilarRecipe(
+            recipe_id=candidate_id, similar_id=recipe_id, score=score
+        )
+        if len(rows) > limit:
+            weakest = rows.pop(min(
+                rows, key=lambda similar_id: (rows[similar_id].score,
+                                              -similar_id)
+            ))
+            if weakest.similar_id != recipe_id:
+                stale_ids.append(weakest.id)
+        if recipe_id in rows:
+            new_rows.append(rows[recipe_id])
+    SimilarRecipe.objects.filter(id__in=stale_ids).delete()
+    SimilarRecipe.objects.bulk_create(new_rows)
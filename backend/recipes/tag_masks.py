@@ -0,0 +1,116 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+from recipes.catalog import get_catalog_version
+from recipes.models import TAG_BITS, Recipe, RecipeTag, Tag
+
+# (версия справочников, {слаг: бит}, {id: бит}) - кеш процесса.
+_tag_bits = (None, {}, {})
+
+
+def _load_tag_bits():
+    global _tag_bits
+    version = get_catalog_version()
+    if _tag_bits[0] != version:
+        by_slug, by_id = {}, {}
+        for tag_id, slug, bit in Tag.objects.exclude(bit=None).values_list(
+            'id', 'slug', 'bit'
+        ):
+            by_slug[slug] = by_id[tag_id] = bit
+        _tag_bits = (version, by_slug, by_id)
+    return _tag_bits
+
+
+def get_tag_bits():
+    """
+    {слаг тега: бит в Recipe.tag_mask}. Кешируется в процессе
+    до изменения справочников.
+    """
+    return _load_tag_bits()[1]
+
+
+def get_mask(bits):
+    """Маска из номеров битов."""
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask
+
+
+def get_tags_mask(tag_ids):
+    by_id = _load_tag_bits()[2]
+    return get_mask(by_id[tag_id] for tag_id in tag_ids)
+
+
+def add_tags(recipe_ids, tag_ids):
+    """Атомарно добавляет теги в маски рецептов."""
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        tag_mask=F('tag_mask').bitor(get_tags_mask(tag_ids))
+    )
+
+
+def remove_tags(recipe_ids, tag_ids):
+    """Атомарно убирает теги из масок рецептов."""
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        tag_mask=F('tag_mask').bitand(~get_tags_mask(tag_ids))
+    )
+
+
+def remove_tag(tag):
+    """Убирает тег из масок всех рецептов."""
+    bit = 1 << tag.bit
+    Recipe.objects.alias(
+        tag_bit=F('tag_mask').bitand(bit)
+    ).filter(tag_bit=bit).update(tag_mask=F('tag_mask').bitand(~bit))
+
+
+def calculate_masks(recipe_ids=None):
+    """{id рецепта: маска} по связям с тегами."""
+    rows = RecipeTag.objects.values_list('recipe_id', 'tag__bit').order_by()
+    if recipe_ids is not None:
+        rows = rows.filter(recipe_id__in=recipe_ids)
+    masks = defaultdict(int)
+    for recipe_id, bit in rows.iterator(chunk_size=5000):
+        masks[recipe_id] |= 1 << bit
+    return masks
+
+
+def refresh_tag_masks(recipe_ids):
+    """Пересчитывает маски рецептов recipe_ids по связям с тегами."""
+    masks = calculate_masks(recipe_ids)
+    for recipe_id in recipe_ids:
+        Recipe.objects.filter(id=recipe_id).update(
+            tag_mask=masks.get(recipe_id, 0)
+        )
+
+
+@transaction.atomic
+def assign_tag_bits():
+    """Назначает биты тегам, добавленным в обход Tag.save (импорт)."""
+    tags = list(Tag.objects.filter(bit=None).order_by('id'))
+    free = Tag.get_free_bits()
+    if len(tags) > len(free):
+        raise ValidationError(f'Тегов может быть не больше {TAG_BITS}.')
+    for tag, bit in zip(tags, free):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ('bit',))
+
+
+@transaction.atomic
+def rebuild_tag_masks(batch_size=1000):
+    """
+    Пересчитывает маски всех рецептов: по одному UPDATE
+    на каждое сочетание тегов и пачку рецептов.
+    """
+    by_mask = defaultdict(list)
+    for recipe_id, mask in calculate_masks().items():
+        by_mask[mask].append(recipe_id)
+    Recipe.objects.exclude(tag_mask=0).update(tag_mask=0)
+    for mask, recipe_ids in by_mask.items():
+        for start in range(0, len(recipe_ids), batch_size):
+            Recipe.objects.filter(
+                id__in=recipe_ids[start:start + batch_size]
+            ).update(tag_mask=mask)
@@ -2,24 +2,33 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 
 from .models import Follow
+from recipes.paginators import EstimatedCountPaginator
 
 User = get_user_model()
 
 
 class UserAdmin(admin.ModelAdmin):
     """Отображение модели пользователя в админке."""
-    list_display = ('pk', 'username', 'email', 'first_name', 'last_name')
-    list_filter = ('email', 'first_name')
-    search_fields = ('email', 'first_name')
+    list_display = ('pk', 'username', 'email', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
+    list_filter = ('is_staff', 'is_active')
+    search_fields = ('username', 'email', 'first_name')
+    readonly_fields = ('recipes_count', 'followers_count')
     ordering = ('username',)
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class FollowAdmin(admin.ModelAdmin):
     """Отображение модели подписок в админке."""
     list_display = ('pk', 'user', 'author')
-    list_filter = ('user', 'author')
+    list_select_related = ('user', 'author')
+    search_fields = ('user__username', 'author__username')
+    autocomplete_fields = ('user', 'author')
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 admin.site.register(User, UserAdmin)
@@ -32,6 +32,17 @@ class User(AbstractUser):
         max_length=150,
         help_text=('Введите пароль'),
     )
+    # Поддерживаются recipes.counters.
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'password',)
@@ -53,17 +64,21 @@ class User(AbstractUser):
 
 class Follow(models.Model):
     """Модель подписки."""
+    # Подписки пользователя - индекс follow_user_author_idx,
+    # подписчики автора - уникальный индекс unique_follow.
     user = models.ForeignKey(
         User,
         related_name='follower',
         verbose_name='Подписчик',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
         related_name='following',
         verbose_name='Автор',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False,
     )
 
     class Meta:
@@ -77,6 +92,11 @@ class Follow(models.Model):
                 check=~Q(user=F('author')),
                 name='no_self_follow')
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'],
+                name='follow_user_author_idx'),
+        ]
 
     def __str__(self):
         return f'Пользователь {self.user} подписан(а) на {self.author}'